@@ -6,9 +6,31 @@
 """
 
 import click
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
+from typing import Optional
+import sys
 
-from ausseabed.mbespc.lib.density_check import AlgorithmIndependentDensityCheck
+from ausseabed.mbespc.lib.density_check import (
+    AlgorithmIndependentDensityCheck,
+    DENSITY_ENGINES,
+    OUTPUT_MODES,
+)
+from ausseabed.mbespc.lib.cache import DensityCache, DEFAULT_MAX_BYTES
+from ausseabed.mbespc.lib.errors import CheckCancelled, MbesPcError
+from ausseabed.mbespc.lib.profiling import format_rss
+from ausseabed.mbespc.lib.progress import ProgressEvent
+from ausseabed.mbespc.lib.qajson_runner import (
+    load_qajson,
+    qajson_tasks,
+    run_checks,
+    worker_settings,
+    write_qajson,
+)
+from ausseabed.mbespc.lib.utils import HISTOGRAM_CAP, bin_label, find_point_files
+from ausseabed.mbespc.lib.surface_check import SurfaceConsistencyCheck
+from ausseabed.mbespc.lib.vector_sink import VECTOR_SINKS
+from ausseabed.mbespc.lib.vertical_check import VerticalStatisticsCheck
 
 
 @click.group()
@@ -16,6 +38,40 @@ def cli():
     pass
 
 
+def _parse_thresholds(ctx, param, value):
+    """Parse repeated MC[:MCP] threshold options."""
+    thresholds = []
+    for item in value:
+        count, _, percentage = item.partition(":")
+        try:
+            thresholds.append(
+                (int(count), float(percentage) if percentage else None)
+            )
+        except ValueError:
+            raise click.BadParameter(f"{item} is not of the form MC[:MCP]")
+
+    return tuple(thresholds)
+
+
+@contextmanager
+def _stop_on_cancel():
+    """Report a cancelled (e.g. timed out) check as a command error."""
+    try:
+        yield
+    except CheckCancelled as err:
+        raise click.ClickException(str(err))
+
+
+def _show_progress(event: Optional[ProgressEvent]) -> Optional[str]:
+    """Progress bar detail of the current stage."""
+    if event is None or event.stage == "complete":
+        return None
+    if event.total is None:
+        return f"{event.stage}: {event.done} {event.unit}"
+
+    return f"{event.stage}: {event.done} / {event.total} {event.unit}"
+
+
 @cli.command(help=(
     "Run point cloud quality assurance checks over input defined "
     "within QAJSON file")
@@ -25,20 +81,110 @@ def cli():
     required=True,
     type=click.Path(exists=True, file_okay=True, dir_okay=False, resolve_path=True),
     help='Path to input QA JSON file')
+@click.option(
+    '-o', '--output',
+    type=click.Path(exists=False, file_okay=True, dir_okay=False, resolve_path=True),
+    help=(
+        "Path to the updated QA JSON file, written as each check completes. "
+        "Defaults to updating the input file."
+    )
+)
+@click.option(
+    '-od', '--output-directory',
+    type=click.Path(exists=False, dir_okay=True, file_okay=False, resolve_path=True),
+    help=(
+        "Persist the density grids and low density outputs (and the "
+        "vertical statistics and surface difference grids) of each check "
+        "within this directory."
+    )
+)
+@click.option(
+    '--spatial-qajson',
+    is_flag=True,
+    help=(
+        "Include the grid bounds and low density regions within the "
+        "QA JSON outputs (for display in the QAX map viewer)."
+    )
+)
+@click.option(
+    '-e', '--engine',
+    type=click.Choice(list(DENSITY_ENGINES)),
+    default="pdal",
+    show_default=True,
+    help="Engine used to calculate the density grids."
+)
+@click.option(
+    '-w', '--workers',
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Number of checks run concurrently, each within a worker process. "
+        "Defaults to the checks' 'Worker processes' parameter, otherwise "
+        "the number of CPUs."
+    )
+)
+@click.option(
+    '--worker-memory',
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Memory budget of each worker in MiB. Density grids estimated to "
+        "exceed the budget are calculated one tile at a time. Defaults to "
+        "the checks' 'Worker memory budget (MiB)' parameter."
+    )
+)
 def qajson(
-        input
+        input,
+        output,
+        output_directory,
+        spatial_qajson: bool,
+        engine: str,
+        workers: Optional[int],
+        worker_memory: Optional[int],
     ):
     """
     Run point cloud quality assurance checks over input defined
     within QAJSON file
     """
+    input_pathname = Path(input)
+    output_pathname = input_pathname if output is None else Path(output)
+    outdir = None if output_directory is None else Path(output_directory)
 
-    # TODO: later
-    # this is where a QAJSON file would be loaded, and the files+checks+params
-    # defined in the QAJSON would be run through the appropriate checks.
-    # Not currently essential as this will primarily be done through QAX
+    qajson_root = load_qajson(input_pathname)
+    checks, tasks = qajson_tasks(qajson_root, outdir, spatial_qajson, engine)
+    click.echo(f"Running {len(tasks)} checks")
 
-    click.echo("Not implemented")
+    def on_complete(index: int, outputs) -> None:
+        # write the qajson as each check completes, so the outputs of
+        # completed checks persist should the run be interrupted
+        checks[index].outputs = outputs
+        write_qajson(qajson_root, output_pathname)
+        execution = outputs.execution
+        click.echo(
+            f"  [{index + 1}] {tasks[index].grid_file}: {execution.status}"
+            f"{'' if outputs.check_state is None else ', ' + outputs.check_state}"
+        )
+
+    # the options take precedence over the worker parameters of the checks
+    qajson_workers, qajson_memory = worker_settings(checks)
+    if worker_memory is not None:
+        qajson_memory = worker_memory * 2**20
+
+    results = run_checks(
+        tasks,
+        workers=workers or qajson_workers,
+        memory_budget=qajson_memory,
+        on_complete=on_complete,
+    )
+    write_qajson(qajson_root, output_pathname)
+
+    failed = [r for r in results if r.execution.status != "completed"]
+    click.echo(
+        f"{len(results) - len(failed)} / {len(results)} checks completed, "
+        f"QA JSON written to {output_pathname}"
+    )
+    if failed:
+        sys.exit(1)
 
 
 @cli.command(help=(
@@ -47,8 +193,13 @@ def qajson(
 @click.option(
     '-pf', '--point-file',
     required=True,
-    type=click.Path(exists=True, file_okay=True, dir_okay=True, resolve_path=True),
-    help="Path to input point cloud file"
+    multiple=True,
+    type=str,
+    help=(
+        "Path to input point cloud file. May be repeated, and may be a "
+        "directory (all .las/.laz files within) or a glob pattern. Counts "
+        "from all files are accumulated into the one density grid."
+    )
 )
 @click.option(
     '-gf', '--grid-file',
@@ -85,36 +236,685 @@ def qajson(
          "the vector geometry of flagged pixels are to persist."
     )
 )
+@click.option(
+    '-e', '--engine',
+    type=click.Choice(list(DENSITY_ENGINES)),
+    default="pdal",
+    show_default=True,
+    help=(
+        "Engine used to calculate the density grid. 'pdal' runs a PDAL "
+        "pipeline, 'pdal-stream' streams the points of a PDAL pipeline "
+        "into a count grid in chunks, 'numpy' bins the points directly "
+        "using laspy and NumPy."
+    )
+)
+@click.option(
+    '-ts', '--tile-size',
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Calculate the density grid in square tiles of this many cells "
+        "to bound memory use on large grids. Each tile reads the point "
+        "files whose bounds overlap it, so files spanning many tiles are "
+        "read many times."
+    )
+)
+@click.option(
+    '-p', '--processes',
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Number of worker processes used for tiled density calculations. "
+        "Defaults to the number of CPUs."
+    )
+)
+@click.option(
+    '-nt', '--threads',
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Number of threads used to read, process and write the blocks of "
+        "the density grid (and to read the point files with the numpy "
+        "and pdal-stream engines, the numpy engine also decompressing "
+        "LAZ files in parallel). Defaults to the number of CPUs."
+    )
+)
+@click.option(
+    '--cache-dir',
+    envvar="MBESPC_CACHE_DIR",
+    type=click.Path(exists=False, dir_okay=True, file_okay=False, resolve_path=True),
+    help=(
+        "Cache density grids within this directory, re-using them when "
+        "the check is re-run with the same point files and grid "
+        "(e.g. when tuning thresholds). Can also be set via MBESPC_CACHE_DIR."
+    )
+)
+@click.option(
+    '--cache-max-size',
+    type=click.IntRange(min=0),
+    default=DEFAULT_MAX_BYTES // 2**20,
+    show_default=True,
+    help="Maximum size of the density grid cache in MiB."
+)
+@click.option(
+    '--count-grid',
+    type=click.Path(exists=False, dir_okay=False, file_okay=True, resolve_path=True),
+    help=(
+        "Keep the raw point counts within this GeoTIFF, along with a "
+        "manifest of the point files counted. Re-runs only bin the point "
+        "files added since (e.g. the latest survey lines). Requires the "
+        "numpy engine."
+    )
+)
+@click.option(
+    '-vs', '--vertical-statistics',
+    is_flag=True,
+    help=(
+        "Also run the vertical statistics check (see vertical-check) with "
+        "the minimum count, from the same pass of the point files as the "
+        "density grid rather than reading them again. Requires the numpy "
+        "engine ('-e numpy'), and can't be combined with tiling or a count "
+        "grid."
+    )
+)
+@click.option(
+    '--tvu-a',
+    type=click.FloatRange(min=0),
+    default=0.5,
+    show_default=True,
+    help="Depth independent portion of the TVU (metres), for -vs."
+)
+@click.option(
+    '--tvu-b',
+    type=click.FloatRange(min=0),
+    default=0.013,
+    show_default=True,
+    help="Coefficient of the depth dependent portion of the TVU, for -vs."
+)
+@click.option(
+    '--tvu-percentage',
+    type=float,
+    default=95.0,
+    show_default=True,
+    help="Minimum percentage of the evaluated cells within the TVU, for -vs."
+)
+@click.option(
+    '-t', '--threshold',
+    multiple=True,
+    callback=_parse_thresholds,
+    metavar="MC[:MCP]",
+    help=(
+        "Evaluate several thresholds from the one density grid. Each is a "
+        "minimum count, optionally followed by a colon and the minimum "
+        "count percentage (defaults to --minimum-count-percentage), "
+        "e.g. -t 3 -t 5:95 -t 9:95. May be repeated."
+    )
+)
+@click.option(
+    '-vf', '--vector-format',
+    type=click.Choice(list(VECTOR_SINKS)),
+    default="fgb",
+    show_default=True,
+    help=(
+        "Format of the persisted low density polygons; FlatGeobuf (with a "
+        "spatial index), GeoPackage, GeoParquet or ESRI Shapefile."
+    )
+)
+@click.option(
+    '-om', '--output-mode',
+    type=click.Choice(list(OUTPUT_MODES)),
+    default="vector",
+    show_default=True,
+    help=(
+        "'vector' vectorises the low density cells. 'raster' skips the "
+        "vectorisation and writes a 1-bit mask of the low density cells "
+        "to the output directory."
+    )
+)
+@click.option(
+    '--histogram-cap',
+    type=click.IntRange(min=1),
+    default=HISTOGRAM_CAP,
+    show_default=True,
+    help=(
+        "Densities below this value are binned individually within the "
+        "histogram, larger densities are binned into ranges that double "
+        "in width. Raised to the minimum count(s) if lower."
+    )
+)
+@click.option(
+    '--coarse-levels',
+    is_flag=True,
+    help=(
+        "Also evaluate the minimum count at the coarser resolutions of the "
+        "density grid's overviews (2x, 4x ... the cell size), whose cells "
+        "sum the soundings of the cells within."
+    )
+)
+@click.option(
+    '--profile',
+    is_flag=True,
+    help=(
+        "Report the wall time, CPU time, peak memory and throughput of "
+        "each stage of the check."
+    )
+)
+@click.option(
+    '--timeout',
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help=(
+        "Stop the check (removing its temporary files) if it runs for "
+        "longer than this number of seconds."
+    )
+)
+@click.option(
+    '--progress/--no-progress',
+    default=True,
+    show_default=True,
+    help="Display a progress bar (when attached to a terminal)."
+)
 def density_check(
-        point_file: Path,
+        point_file: tuple[str, ...],
         grid_file: Path,
         minimum_count: int,
         minimum_count_percentage: float,
         output_directory,
+        engine: str,
+        tile_size: int,
+        processes: int,
+        threads: int,
+        cache_dir,
+        cache_max_size: int,
+        count_grid,
+        vertical_statistics: bool,
+        tvu_a: float,
+        tvu_b: float,
+        tvu_percentage: float,
+        threshold: tuple[tuple[int, Optional[float]], ...],
+        vector_format: str,
+        output_mode: str,
+        histogram_cap: int,
+        coarse_levels: bool,
+        profile: bool,
+        timeout: Optional[float],
+        progress: bool,
 ):
     """ Command runs the resolution independent density check only
     """
-    click.echo("Running density check")
+    try:
+        point_files = find_point_files(point_file)
+    except MbesPcError as err:
+        raise click.BadParameter(str(err), param_hint="'-pf' / '--point-file'")
+
+    if count_grid is not None and (engine != "numpy" or tile_size):
+        raise click.BadParameter(
+            "requires the numpy engine ('-e numpy'), without tiling",
+            param_hint="'--count-grid'",
+        )
+
+    if vertical_statistics and (
+        engine != "numpy" or tile_size or count_grid is not None
+    ):
+        raise click.BadParameter(
+            "requires the numpy engine ('-e numpy'), and can't be combined "
+            "with tiling or a count grid",
+            param_hint="'-vs' / '--vertical-statistics'",
+        )
+
+    if vertical_statistics and minimum_count < 2:
+        raise click.BadParameter(
+            "must be at least 2 for the vertical statistics",
+            param_hint="'-mc' / '--minimum-count'",
+        )
+
+    click.echo(f"Running density check over {len(point_files)} point files")
     if output_directory is not None:
         output_directory = Path(output_directory)
 
+    # the vertical statistics are evaluated within the density check's
+    # pass of the point files
+    v_check = None
+    if vertical_statistics:
+        v_check = VerticalStatisticsCheck(
+            point_cloud_file=point_files,
+            grid_file=Path(grid_file),
+            tvu_a=tvu_a,
+            tvu_b=tvu_b,
+            minimum_count=minimum_count,
+            minimum_percentage=tvu_percentage,
+            outdir=output_directory,
+        )
+
     d_check = AlgorithmIndependentDensityCheck(
-        point_cloud_file=Path(point_file),
+        point_cloud_file=point_files,
         grid_file=Path(grid_file),
         minimum_count=minimum_count,
         minimum_count_percentage=minimum_count_percentage,
         outdir=output_directory,
+        engine=engine,
+        tile_size=tile_size,
+        processes=processes,
+        threads=threads,
+        cache_dir=None if cache_dir is None else Path(cache_dir),
+        cache_max_bytes=cache_max_size * 2**20,
+        vector_format=vector_format,
+        output_mode=output_mode,
+        timeout=timeout,
+        histogram_cap=histogram_cap,
+        coarse_levels=coarse_levels,
+        count_grid=None if count_grid is None else Path(count_grid),
+        vertical_check=v_check,
     )
-    d_check.run()
 
-    # print out some summary info from the check run
-    click.echo(f"Check passed: {d_check.passed}")
-    click.echo(f"{d_check.failed_nodes} / {d_check.total_nodes} failed")
+    # progress is reported as a percentage of the whole check
+    progress_bar = nullcontext()
+    if progress:
+        bar = click.progressbar(
+            length=100,
+            label="Density check",
+            file=sys.stderr,
+            item_show_func=_show_progress,
+        )
+
+        def on_progress(event: ProgressEvent) -> None:
+            bar.update(int(event.fraction * 100) - bar.pos, event)
+
+        d_check.progress_callback = on_progress
+        progress_bar = bar
+
+    if threshold:
+        # evaluate all thresholds from the one density grid, only
+        # vectorising when the outputs are to persist
+        with progress_bar, _stop_on_cancel():
+            results = d_check.sweep(
+                [
+                    (mc, minimum_count_percentage if mcp is None else mcp)
+                    for mc, mcp in threshold
+                ],
+                vectorise=output_directory is not None,
+            )
+        click.echo("Thresholds (minimum count, percentage, passed, failed nodes)")
+        for result in results:
+            click.echo(
+                f"  {result.minimum_count : 3}, "
+                f"{result.minimum_count_percentage : 6.2f}, "
+                f"{result.passed!s:>5}, "
+                f"{result.failed_nodes} / {result.total_nodes}"
+            )
+    else:
+        with progress_bar, _stop_on_cancel():
+            d_check.run()
+
+        # print out some summary info from the check run
+        click.echo(f"Check passed: {d_check.passed}")
+        click.echo(f"{d_check.failed_nodes} / {d_check.total_nodes} failed")
+
+        if d_check.coarse_results:
+            click.echo("Coarse levels (factor, percentage passed, failed nodes)")
+            for result in d_check.coarse_results:
+                click.echo(
+                    f"  {result.factor : 4}x, "
+                    f"{result.percentage_passed : 6.2f}, "
+                    f"{result.failed_nodes} / {result.total_nodes}"
+                )
+
     click.echo("Histogram (density value, cells count)")
 
-    hist_strs = [f"  {d : 3}, {c : 8}" for d, c in d_check.histogram]
+    hist_strs = [
+        f"  {bin_label(d, d_check.histogram_tail) : >3}, {c : 8}"
+        for d, c in d_check.histogram
+    ]
+    click.echo("\n".join(hist_strs))
+
+    if v_check is not None:
+        click.echo("Vertical statistics check")
+        _echo_tvu_result(v_check)
+        _echo_vertical_statistics(v_check)
+
+    if profile:
+        _echo_profile(d_check)
+
+
+def _tvu_check_options(func):
+    """Options shared by the checks evaluating the nodes against the TVU."""
+    options = [
+        click.option(
+            '-pf', '--point-file',
+            required=True,
+            multiple=True,
+            type=str,
+            help=(
+                "Path to input point cloud file. May be repeated, and may be "
+                "a directory (all .las/.laz files within) or a glob pattern. "
+                "Soundings from all files are accumulated into the one grid."
+            )
+        ),
+        click.option(
+            '-gf', '--grid-file',
+            required=True,
+            type=click.Path(
+                exists=True, file_okay=True, dir_okay=True, resolve_path=True
+            ),
+            help=(
+                "Path to input gridded file. Resolution, target extents, and "
+                "CRS will be extracted from this file."
+            )
+        ),
+        click.option(
+            '-a', '--tvu-a',
+            type=click.FloatRange(min=0),
+            default=0.5,
+            show_default=True,
+            help="Depth independent portion of the TVU (metres)."
+        ),
+        click.option(
+            '-b', '--tvu-b',
+            type=click.FloatRange(min=0),
+            default=0.013,
+            show_default=True,
+            help="Coefficient of the depth dependent portion of the TVU."
+        ),
+        click.option(
+            '-mp', '--minimum-percentage',
+            type=float,
+            default=95.0,
+            show_default=True,
+            help="Minimum percentage of the evaluated cells within the TVU."
+        ),
+        click.option(
+            '-nt', '--threads',
+            type=click.IntRange(min=1),
+            default=None,
+            help=(
+                "Number of threads used to read the point files and the "
+                "blocks of the grid. Defaults to the number of CPUs."
+            )
+        ),
+        click.option(
+            '--profile',
+            is_flag=True,
+            help=(
+                "Report the wall time, CPU time, peak memory and throughput "
+                "of each stage of the check."
+            )
+        ),
+        click.option(
+            '--timeout',
+            type=click.FloatRange(min=0, min_open=True),
+            default=None,
+            help=(
+                "Stop the check (removing its temporary files) if it runs "
+                "for longer than this number of seconds."
+            )
+        ),
+        click.option(
+            '--progress/--no-progress',
+            default=True,
+            show_default=True,
+            help="Display a progress bar (when attached to a terminal)."
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+
+    return func
+
+
+def _run_tvu_check(check, label: str, progress: bool) -> None:
+    """
+    Run a check evaluating the nodes against the TVU, displaying a
+    progress bar if asked, and report whether it passed.
+    """
+    progress_bar = nullcontext()
+    if progress:
+        bar = click.progressbar(
+            length=100,
+            label=label,
+            file=sys.stderr,
+            item_show_func=_show_progress,
+        )
+
+        def on_progress(event: ProgressEvent) -> None:
+            bar.update(int(event.fraction * 100) - bar.pos, event)
+
+        check.progress_callback = on_progress
+        progress_bar = bar
+
+    with progress_bar, _stop_on_cancel():
+        check.run()
+
+    _echo_tvu_result(check)
+
+
+def _echo_tvu_result(check) -> None:
+    """Report whether a check evaluating the nodes against the TVU passed."""
+    click.echo(f"Check passed: {check.passed}")
+    if not check.evaluated_nodes:
+        click.echo(
+            f"No nodes evaluated; none of the {check.total_nodes} nodes held "
+            f"at least {check.minimum_count} soundings"
+        )
+        return
+
+    click.echo(
+        f"{check.failed_nodes} / {check.evaluated_nodes} evaluated nodes "
+        f"beyond the TVU ({check.total_nodes} nodes)"
+    )
+
+
+def _echo_vertical_statistics(check) -> None:
+    """Report the spread of the soundings of a vertical statistics check."""
+    click.echo(
+        f"Maximum standard deviation: {check.max_std:.3f}, "
+        f"maximum range: {check.max_range:.3f}"
+    )
+    click.echo("Histogram (1.96 std / TVU, cells count)")
+    hist_strs = [f"  {r : 4.1f}, {c : 8}" for r, c in check.histogram]
+    click.echo("\n".join(hist_strs))
+
+
+def _echo_profile(check) -> None:
+    """Report the stage timings of a check."""
+    performance = check.performance
+    click.echo("Profile")
+    click.echo(check.profiler.format())
+    click.echo(
+        f"Total: {performance['wall_time']:.3f} s, "
+        f"{format_rss(performance['peak_rss'])} MiB peak RSS"
+    )
+
+
+@cli.command(help=(
+    "Run the vertical statistics check on point cloud; the spread of the "
+    "soundings of each node against the TVU budget of its depth")
+)
+@_tvu_check_options
+@click.option(
+    '-mc', '--minimum-count',
+    type=click.IntRange(min=2),
+    default=5,
+    show_default=True,
+    help="Minimum soundings per cell for the cell to be evaluated."
+)
+@click.option(
+    '-od', '--output-directory',
+    type=click.Path(exists=False, dir_okay=True, file_okay=False, resolve_path=True),
+    help=(
+         "Specify an output directory if the grid of the vertical "
+         "statistics (count, mean, std, min and max bands) is to persist."
+    )
+)
+def vertical_check(
+        point_file: tuple[str, ...],
+        grid_file: Path,
+        tvu_a: float,
+        tvu_b: float,
+        minimum_percentage: float,
+        threads: int,
+        profile: bool,
+        timeout: Optional[float],
+        progress: bool,
+        minimum_count: int,
+        output_directory,
+):
+    """ Command runs the vertical statistics check only
+    """
+    try:
+        point_files = find_point_files(point_file)
+    except MbesPcError as err:
+        raise click.BadParameter(str(err), param_hint="'-pf' / '--point-file'")
+
+    click.echo(
+        f"Running vertical statistics check over {len(point_files)} point files"
+    )
+
+    v_check = VerticalStatisticsCheck(
+        point_cloud_file=point_files,
+        grid_file=Path(grid_file),
+        tvu_a=tvu_a,
+        tvu_b=tvu_b,
+        minimum_count=minimum_count,
+        minimum_percentage=minimum_percentage,
+        outdir=None if output_directory is None else Path(output_directory),
+        threads=threads,
+        timeout=timeout,
+    )
+
+    _run_tvu_check(v_check, "Vertical statistics check", progress)
+    _echo_vertical_statistics(v_check)
+
+    if profile:
+        _echo_profile(v_check)
+
+
+@cli.command(help=(
+    "Run the surface consistency check on point cloud; the difference of "
+    "the grid's surface to the mean of the soundings of each node against "
+    "the TVU budget of its depth")
+)
+@_tvu_check_options
+@click.option(
+    '-mc', '--minimum-count',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Minimum soundings per cell for the cell to be evaluated."
+)
+@click.option(
+    '-od', '--output-directory',
+    type=click.Path(exists=False, dir_okay=True, file_okay=False, resolve_path=True),
+    help=(
+         "Specify an output directory if the grid of the differences (mean "
+         "of the soundings less the surface) is to persist."
+    )
+)
+def surface_check(
+        point_file: tuple[str, ...],
+        grid_file: Path,
+        tvu_a: float,
+        tvu_b: float,
+        minimum_percentage: float,
+        threads: int,
+        profile: bool,
+        timeout: Optional[float],
+        progress: bool,
+        minimum_count: int,
+        output_directory,
+):
+    """ Command runs the surface consistency check only
+    """
+    try:
+        point_files = find_point_files(point_file)
+    except MbesPcError as err:
+        raise click.BadParameter(str(err), param_hint="'-pf' / '--point-file'")
+
+    click.echo(
+        f"Running surface consistency check over {len(point_files)} point files"
+    )
+
+    s_check = SurfaceConsistencyCheck(
+        point_cloud_file=point_files,
+        grid_file=Path(grid_file),
+        tvu_a=tvu_a,
+        tvu_b=tvu_b,
+        minimum_count=minimum_count,
+        minimum_percentage=minimum_percentage,
+        outdir=None if output_directory is None else Path(output_directory),
+        threads=threads,
+        timeout=timeout,
+    )
+
+    _run_tvu_check(s_check, "Surface consistency check", progress)
+
+    if s_check.evaluated_nodes:
+        click.echo(
+            f"Node differences; mean: {s_check.mean_difference:.3f}, "
+            f"RMS: {s_check.rms_difference:.3f}, "
+            f"maximum absolute: {s_check.max_abs_difference:.3f}"
+        )
+    if s_check.soundings:
+        click.echo(
+            f"Sounding residuals ({s_check.soundings}); "
+            f"mean: {s_check.mean_residual:.3f}, "
+            f"RMS: {s_check.rms_residual:.3f}"
+        )
+    click.echo("Histogram (|difference| / TVU, cells count)")
+    hist_strs = [f"  {r : 4.1f}, {c : 8}" for r, c in s_check.histogram]
     click.echo("\n".join(hist_strs))
 
+    if profile:
+        _echo_profile(s_check)
+
+
+@cli.group(help="Inspect and purge the density grid cache")
+@click.option(
+    '--cache-dir',
+    envvar="MBESPC_CACHE_DIR",
+    required=True,
+    type=click.Path(exists=False, dir_okay=True, file_okay=False, resolve_path=True),
+    help="Cache directory. Can also be set via MBESPC_CACHE_DIR."
+)
+@click.pass_context
+def cache(ctx, cache_dir):
+    ctx.obj = DensityCache(Path(cache_dir))
+
+
+@cache.command(name="info", help="List the cached density grids")
+@click.pass_obj
+def cache_info(density_cache: DensityCache):
+    entries = density_cache.entries()
+    for entry in entries:
+        inputs = entry.inputs()
+        n_files = len(inputs["point_files"])
+        click.echo(
+            f"{entry.key}  {entry.size / 2**20 : 10.1f} MiB  "
+            f"{inputs['engine']:>6}  {n_files} point files  "
+            f"{inputs['grid']['file']['path']}"
+        )
+
+    total = sum(entry.size for entry in entries)
+    click.echo(f"{len(entries)} entries, {total / 2**20 :.1f} MiB")
+
+
+@cache.command(name="purge", help="Remove cached density grids")
+@click.option(
+    '-k', '--key',
+    multiple=True,
+    help="Key of the entry to remove. May be repeated. Default is all entries."
+)
+@click.pass_obj
+def cache_purge(density_cache: DensityCache, key: tuple[str, ...]):
+    if key:
+        try:
+            removed = [k for k_ in key for k in density_cache.purge(k_)]
+        except MbesPcError as err:
+            raise click.BadParameter(str(err), param_hint="'-k' / '--key'")
+    else:
+        removed = density_cache.purge()
+
+    click.echo(f"Removed {len(removed)} entries")
+
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,126 @@
+"""
+Thread pooled scheduling of block wise raster processing.
+GDAL releases the GIL whilst decoding blocks, as does NumPy for most array
+operations, so reading and computing on several blocks concurrently keeps
+more than one core busy. Results are returned in block order, allowing the
+caller to write outputs and reduce partial results (in the calling thread)
+whilst the workers carry on with the following blocks.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Sequence
+import logging
+import os
+import threading
+
+import rasterio  # type: ignore[import]
+from rasterio.windows import Window  # type: ignore[import]
+
+LOG = logging.getLogger(__name__)
+
+
+def block_windows(pathname: Path) -> List[Window]:
+    """
+    The windows of the internal blocks of the first band of a raster.
+
+    :param pathname: Pathname to the raster file
+    :type pathname: class:`pathlib.Path`
+    :return: A list of windows, ordered row major
+    :rtype: list
+    """
+    with rasterio.open(str(pathname)) as src:
+        return [window for _, window in src.block_windows()]
+
+
+class BlockScheduler:
+    """
+    Applies a function to the blocks of one or more rasters using a
+    bounded pool of threads.
+    Each thread opens its own (read only) handle to every raster, as
+    dataset handles aren't safe to share between threads. At most
+    `max_pending` blocks are in flight at once, bounding the memory held
+    by results that are yet to be consumed.
+
+    Example::
+
+        with BlockScheduler([grid_pathname, density_pathname]) as scheduler:
+            for result in scheduler.map(func, windows):
+                ...
+
+    where `func(datasets, window)` receives this thread's datasets, in the
+    order of the pathnames.
+    """
+
+    def __init__(
+        self,
+        pathnames: Sequence[Path],
+        threads: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ) -> None:
+        self.pathnames = [str(pathname) for pathname in pathnames]
+        self.threads = threads or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._datasets: List[rasterio.DatasetReader] = []
+
+    def _thread_datasets(self) -> List[rasterio.DatasetReader]:
+        """The dataset handles of the calling thread, opened on first use."""
+        datasets = getattr(self._local, "datasets", None)
+        if datasets is None:
+            datasets = [rasterio.open(pathname) for pathname in self.pathnames]
+            self._local.datasets = datasets
+            with self._lock:
+                self._datasets.extend(datasets)
+
+        return datasets
+
+    def _apply(self, func: Callable[..., Any], window: Window) -> Any:
+        return func(self._thread_datasets(), window)
+
+    def map(
+        self,
+        func: Callable[[List[rasterio.DatasetReader], Window], Any],
+        windows: Iterable[Window],
+    ) -> Iterator[Any]:
+        """
+        Apply `func` to each window, yielding the results in the order of
+        `windows`. Blocks following the one being yielded continue to be
+        processed whilst the caller consumes the result. Blocks yet to
+        start are cancelled if the caller stops early (e.g. on error).
+
+        :param func: Function of the datasets and a window
+        :type func: callable
+        :param windows: The windows (blocks) to process
+        :type windows: iterable
+        :return: A generator of the results
+        :rtype: generator
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pending: Deque[Future] = deque()
+            try:
+                for window in windows:
+                    pending.append(executor.submit(self._apply, func, window))
+                    if len(pending) >= self.max_pending:
+                        yield pending.popleft().result()
+
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def close(self) -> None:
+        """Close the dataset handles of all threads."""
+        with self._lock:
+            for dataset in self._datasets:
+                dataset.close()
+            self._datasets = []
+
+    def __enter__(self) -> "BlockScheduler":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
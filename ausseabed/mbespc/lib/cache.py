@@ -0,0 +1,382 @@
+"""
+Persistent, size bounded cache of density grids.
+The density grid only depends on the point cloud files, the geometry and
+no-data mask of the base grid, and the engine used for the reprojection
+and binning. Entries are keyed by those inputs, allowing the check to be
+re-run with different thresholds without recalculating the density grid.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy
+import rasterio  # type: ignore[import]
+
+from ausseabed.mbespc.lib import errors
+
+LOG = logging.getLogger(__name__)
+
+# bump when the contents or layout of a cache entry changes
+CACHE_VERSION = 3
+
+# default upper bound of the total size of the cache (10 GiB)
+DEFAULT_MAX_BYTES = 10 * 2**30
+
+DENSITY_FILENAME = "density.tif"
+STATS_FILENAME = "stats.json"
+
+# keys are the sha256 hex digest of the inputs; see DensityCache.key
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def file_fingerprint(pathname: Path, content_hash: bool = False) -> Dict[str, Any]:
+    """
+    Identify a file by either its content (sha256), or by its
+    modification time and size.
+
+    :param pathname: Pathname to the file
+    :type pathname: class:`pathlib.Path`
+    :param content_hash: If True, hash the file contents
+    :type content_hash: bool
+    :return: A dict identifying the file
+    :rtype: dict
+    """
+    pathname = Path(pathname).resolve()
+    stat = pathname.stat()
+    fingerprint: Dict[str, Any] = {"path": str(pathname), "size": stat.st_size}
+
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(pathname, "rb") as src:
+            for block in iter(lambda: src.read(2**20), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    else:
+        fingerprint["mtime_ns"] = stat.st_mtime_ns
+
+    return fingerprint
+
+
+def grid_fingerprint(grid_pathname: Path, content_hash: bool = False) -> Dict[str, Any]:
+    """
+    Identify the geometry of a base grid (transform, shape, CRS and nodata).
+    The no-data mask is identified by the fingerprint of the grid file.
+
+    :param grid_pathname: Pathname to the base grid file
+    :type grid_pathname: class:`pathlib.Path`
+    :param content_hash: If True, hash the file contents
+    :type content_hash: bool
+    :return: A dict identifying the grid
+    :rtype: dict
+    """
+    with rasterio.open(str(grid_pathname)) as src:
+        geometry = {
+            "transform": list(src.transform)[:6],
+            "width": src.width,
+            "height": src.height,
+            "crs": src.crs.to_wkt() if src.crs else None,
+            "nodata": None if src.nodata is None else repr(src.nodata),
+        }
+
+    geometry["file"] = file_fingerprint(grid_pathname, content_hash)
+
+    return geometry
+
+
+class CacheEntry:
+    """A single cached density grid and its statistics."""
+
+    def __init__(self, pathname: Path):
+        self.pathname = pathname
+        self.key = pathname.name
+
+    @property
+    def density_pathname(self) -> Path:
+        return self.pathname / DENSITY_FILENAME
+
+    @property
+    def stats_pathname(self) -> Path:
+        return self.pathname / STATS_FILENAME
+
+    def statistics(self) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+        """
+        The histogram, bins and non-nodata cell count of the cached grid.
+        """
+        with open(self.stats_pathname, "r") as src:
+            stats = json.load(src)
+
+        hist = numpy.array(stats["hist"], dtype="int64")
+        bins = numpy.array(stats["bins"], dtype="int64")
+
+        return hist, bins, int(stats["cell_count"])
+
+    def inputs(self) -> Dict[str, Any]:
+        """The inputs the cached grid was derived from."""
+        with open(self.stats_pathname, "r") as src:
+            return json.load(src)["inputs"]
+
+    @property
+    def size(self) -> int:
+        """Size in bytes of the entry."""
+        return sum(p.stat().st_size for p in self.pathname.iterdir())
+
+    @property
+    def last_used(self) -> float:
+        """Time the entry was last used (seconds since the epoch)."""
+        return self.pathname.stat().st_mtime
+
+    def touch(self) -> None:
+        """Mark the entry as used."""
+        os.utime(self.pathname)
+
+
+class DensityCache:
+    """
+    On-disk cache of density grids with a least recently used eviction
+    policy bounded by the total size of the cache.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        content_hash: bool = False,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        # identify input files by content rather than mtime+size
+        self.content_hash = content_hash
+
+    def _entry(self, key: str) -> CacheEntry:
+        """
+        The entry of a key. Keys are validated, so an entry is always a
+        directory directly within the cache directory.
+
+        :raises MbesPcError: The key isn't a cache key
+        """
+        pathname = self.cache_dir / key
+        if (
+            KEY_PATTERN.fullmatch(key) is None
+            or pathname.resolve().parent != self.cache_dir.resolve()
+        ):
+            raise errors.MbesPcError(f"Invalid cache key: {key!r}")
+
+        return CacheEntry(pathname)
+
+    def key(
+        self,
+        grid_pathname: Path,
+        point_cloud_pathnames: Sequence[Path],
+        engine: str,
+        histogram_cap: Optional[int] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Derive the cache key for the given inputs.
+
+        :param grid_pathname: Pathname to the base grid file
+        :type grid_pathname: class:`pathlib.Path`
+        :param point_cloud_pathnames: Pathnames to the point cloud files
+        :type point_cloud_pathnames: list
+        :param engine: Name of the density engine
+        :type engine: str
+        :param histogram_cap: Cap of the exactly binned histogram densities
+            held within the entry's statistics
+        :type histogram_cap: int or None
+        :return: A tuple of the key and the inputs it was derived from
+        :rtype: tuple
+        """
+        inputs = {
+            "version": CACHE_VERSION,
+            "engine": engine,
+            "histogram_cap": histogram_cap,
+            "grid": grid_fingerprint(grid_pathname, self.content_hash),
+            "point_files": sorted(
+                (
+                    file_fingerprint(pathname, self.content_hash)
+                    for pathname in point_cloud_pathnames
+                ),
+                key=lambda f: f["path"],
+            ),
+        }
+        encoded = json.dumps(inputs, sort_keys=True).encode("utf-8")
+
+        return hashlib.sha256(encoded).hexdigest(), inputs
+
+    def entries(self) -> List[CacheEntry]:
+        """All complete entries, most recently used first."""
+        if not self.cache_dir.is_dir():
+            return []
+
+        # other directories within the cache directory are left alone
+        entries = [
+            CacheEntry(pth)
+            for pth in self.cache_dir.iterdir()
+            if KEY_PATTERN.fullmatch(pth.name)
+            and pth.is_dir()
+            and pth.joinpath(STATS_FILENAME).exists()
+        ]
+
+        return sorted(entries, key=lambda e: e.last_used, reverse=True)
+
+    def size(self) -> int:
+        """Total size in bytes of the cache."""
+        return sum(entry.size for entry in self.entries())
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Retrieve an entry, marking it as recently used.
+        Returns None if the key isn't cached.
+        """
+        entry = self._entry(key)
+        if not entry.stats_pathname.exists():
+            return None
+
+        entry.touch()
+        LOG.info(f"Using cached density grid: {entry.pathname}")
+
+        return entry
+
+    def _staging(self, key: str) -> Path:
+        """
+        A new directory, unique to the caller, in which to assemble an
+        entry before it is published. Its name isn't a key, so it's never
+        taken for an entry.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        return Path(
+            tempfile.mkdtemp(prefix=f".{key}.", suffix=".tmp", dir=self.cache_dir)
+        )
+
+    def reserve(self, key: str) -> Path:
+        """
+        Pathname at which to write the density grid of a new entry, so the
+        grid is encoded in place rather than copied into the cache.
+        Each reservation is a separate staging directory, so concurrent
+        runs with the same key never write to the same grid. The entry
+        doesn't exist until :meth:`put` is called, or the reservation is
+        discarded by :meth:`release`.
+        """
+        self._entry(key)
+
+        return self._staging(key) / DENSITY_FILENAME
+
+    def release(self, density_pathname: Path) -> None:
+        """
+        Discard a reservation (e.g. the density calculation failed).
+
+        :param density_pathname: The pathname returned by :meth:`reserve`
+        :type density_pathname: class:`pathlib.Path`
+        """
+        staging = Path(density_pathname).parent
+        if staging.parent == self.cache_dir and staging.name.startswith("."):
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def put(
+        self,
+        key: str,
+        inputs: Dict[str, Any],
+        density_pathname: Path,
+        hist: numpy.ndarray,
+        bins: numpy.ndarray,
+        cell_count: int,
+    ) -> CacheEntry:
+        """
+        Store a density grid and its statistics, then evict the least
+        recently used entries if the cache exceeds its size bound.
+        Grids written to the :meth:`reserve` pathname aren't copied.
+        The entry is assembled within a staging directory and published
+        by renaming it into place, so readers never see a partial entry.
+        Should a concurrent run publish the same entry first, its entry is
+        kept and this one discarded.
+        """
+        entry = self._entry(key)
+        staging = Path(density_pathname).parent
+        if not (
+            staging.parent == self.cache_dir
+            and staging.name.startswith(f".{key}.")
+        ):
+            staging = self._staging(key)
+            shutil.copy(density_pathname, staging / DENSITY_FILENAME)
+
+        stats = {
+            "inputs": inputs,
+            "hist": hist.tolist(),
+            "bins": bins.tolist(),
+            "cell_count": int(cell_count),
+            "created": time.time(),
+        }
+        with open(staging / STATS_FILENAME, "w") as outf:
+            json.dump(stats, outf)
+
+        # an incomplete entry (without stats) can only be a leftover
+        if entry.pathname.is_dir() and not entry.stats_pathname.exists():
+            shutil.rmtree(entry.pathname, ignore_errors=True)
+
+        try:
+            os.rename(staging, entry.pathname)
+        except OSError:
+            if not entry.stats_pathname.exists():
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            LOG.info(f"Density grid already cached by another run: {key}")
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=key)
+
+        return entry
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Remove the least recently used entries until the cache is within
+        its size bound. The entry identified by `keep` is never removed.
+
+        :return: The keys of the removed entries
+        :rtype: list
+        """
+        removed = []
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+
+        for entry in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            if entry.key == keep:
+                continue
+            total -= entry.size
+            shutil.rmtree(entry.pathname)
+            removed.append(entry.key)
+            LOG.info(f"Evicted cached density grid: {entry.key}")
+
+        return removed
+
+    def purge(self, key: Optional[str] = None) -> List[str]:
+        """
+        Remove a single entry, or all entries if `key` is None. Only the
+        directories of cache entries are removed, anything else within the
+        cache directory is left alone.
+
+        :raises MbesPcError: The key isn't a cache key
+        :return: The keys of the removed entries
+        :rtype: list
+        """
+        if key is not None:
+            entry = self._entry(key)
+            targets = [entry] if entry.pathname.is_dir() else []
+        else:
+            targets = self.entries()
+
+        removed = []
+        for entry in targets:
+            shutil.rmtree(entry.pathname)
+            removed.append(entry.key)
+
+        return removed
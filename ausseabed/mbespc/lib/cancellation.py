@@ -0,0 +1,58 @@
+"""
+Cooperative cancellation of long running checks.
+The workflow calls :meth:`Cancellation.check` at checkpoints between point
+chunks and raster blocks, which raises once the caller has asked the check
+to stop or the timeout has elapsed. The context managers of the workflow
+then clean up its temporary storage on the way out.
+"""
+
+from typing import Callable, Optional
+import logging
+import time
+
+from ausseabed.mbespc.lib import errors
+
+LOG = logging.getLogger(__name__)
+
+
+class Cancellation:
+    """
+    Cancellation state of a single run of a check.
+
+    :param is_stopped: Callable returning True once the check is to stop,
+        e.g. QAX's `is_stopped`
+    :type is_stopped: callable or None
+    :param timeout: Wall clock time (seconds), from the creation of the
+        cancellation, after which the check is stopped
+    :type timeout: float or None
+    """
+
+    def __init__(
+        self,
+        is_stopped: Optional[Callable[[], bool]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.is_stopped = is_stopped
+        self.timeout = timeout
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.monotonic() + timeout
+
+    @property
+    def active(self) -> bool:
+        """Whether the check can be cancelled at all."""
+        return self.is_stopped is not None or self._deadline is not None
+
+    def check(self) -> None:
+        """
+        Cancellation checkpoint.
+
+        :raises CheckCancelled: The check was asked to stop
+        :raises CheckTimeout: The timeout has elapsed
+        """
+        if self.is_stopped is not None and self.is_stopped():
+            raise errors.CheckCancelled("Check was stopped")
+
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            msg = f"Check exceeded the timeout of {self.timeout} seconds"
+            raise errors.CheckTimeout(msg)
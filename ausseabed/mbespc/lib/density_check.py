@@ -3,18 +3,56 @@ Resolution independent density check
 """
 
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import tempfile
 import json
 import geopandas
-import shutil
 import logging
+import numpy
+import rasterio  # type: ignore[import]
 
 from ausseabed.qajson.model import QajsonParam, QajsonOutputs, QajsonExecution
-from ausseabed.mbespc.lib import pdal_pipeline, utils
+from ausseabed.mbespc.lib import (
+    cache,
+    cancellation,
+    incremental,
+    pdal_pipeline,
+    pdal_stream,
+    numpy_density,
+    profiling,
+    progress,
+    storage,
+    tiling,
+    vector_sink,
+    errors,
+    utils,
+    vertical_statistics,
+    workers,
+)
+from ausseabed.mbespc.lib.vertical_check import VerticalStatisticsCheck
 
 LOG = logging.getLogger(__name__)
 
+# available engines for calculating the density grid
+# each engine module provides a `density` and a `density_tile` function
+DENSITY_ENGINES = {
+    "pdal": pdal_pipeline,
+    "pdal-stream": pdal_stream,
+    "numpy": numpy_density,
+}
+
+# "vector" outputs polygons of the low density cells,
+# "raster" outputs a 1-bit mask of the low density cells
+OUTPUT_MODES = ("vector", "raster")
+
+# relative weights of the stages reported to the progress callback
+PROGRESS_WEIGHTS = {
+    "points": 6.0,
+    "density": 2.0,
+    "statistics": 2.0,
+    "vectorise": 2.0,
+}
+
 
 class AlgorithmIndependentDensityCheck:
     # details used by the QAX plugin
@@ -24,21 +62,130 @@ class AlgorithmIndependentDensityCheck:
     input_params = [
         QajsonParam("Minimum Soundings per node", 5),
         QajsonParam("Minimum Soundings per node percentage", 95.0),
+        QajsonParam("Vectorise low density nodes", True),
+        *workers.input_params(),
     ]
 
     def __init__(
         self,
-        point_cloud_file: Path,
+        point_cloud_file: Union[Path, Sequence[Path]],
         grid_file: Path,
         minimum_count: int,
         minimum_count_percentage: float,
-        outdir: Optional[Path] = None
+        outdir: Optional[Path] = None,
+        engine: str = "pdal",
+        tile_size: Optional[int] = None,
+        processes: Optional[int] = None,
+        threads: Optional[int] = None,
+        cache_dir: Optional[Path] = None,
+        cache_max_bytes: int = cache.DEFAULT_MAX_BYTES,
+        vector_format: str = "fgb",
+        return_gdf: bool = False,
+        output_mode: str = "vector",
+        progress_callback: Optional[progress.ProgressCallback] = None,
+        is_stopped: Optional[Callable[[], bool]] = None,
+        timeout: Optional[float] = None,
+        histogram_cap: int = utils.HISTOGRAM_CAP,
+        coarse_levels: bool = False,
+        count_grid: Optional[Path] = None,
+        vertical_check: Optional[VerticalStatisticsCheck] = None,
     ) -> None:
-        self.point_cloud_file = point_cloud_file
+        if output_mode not in OUTPUT_MODES:
+            raise errors.MbesPcError(f"Unknown output mode: {output_mode}")
+        if vector_format not in vector_sink.VECTOR_SINKS:
+            raise errors.MbesPcError(f"Unknown vector format: {vector_format}")
+
+        if engine not in DENSITY_ENGINES:
+            raise errors.MbesPcError(f"Unknown density engine: {engine}")
+
+        if count_grid is not None and (engine != "numpy" or tile_size):
+            raise errors.MbesPcError(
+                "Incremental density updates require the numpy engine, "
+                "without tiling"
+            )
+
+        if vertical_check is not None and (tile_size or count_grid is not None):
+            raise errors.MbesPcError(
+                "Vertical statistics can't be evaluated alongside tiled or "
+                "incremental density calculations"
+            )
+
+        # the shared pass bins the points as the numpy engine does
+        if vertical_check is not None and engine != "numpy":
+            raise errors.MbesPcError(
+                "Vertical statistics can only be evaluated alongside the "
+                "numpy engine"
+            )
+
+        # a survey may consist of many point cloud files, the counts from
+        # all files are accumulated into the one density grid
+        if isinstance(point_cloud_file, (str, Path)):
+            self.point_cloud_files = [Path(point_cloud_file)]
+        else:
+            self.point_cloud_files = [Path(p) for p in point_cloud_file]
+
+        if not self.point_cloud_files:
+            raise errors.MbesPcError("No point cloud files given")
+
+        if vertical_check is not None and (
+            Path(vertical_check.grid_file) != Path(grid_file)
+            or vertical_check.point_cloud_files != self.point_cloud_files
+        ):
+            raise errors.MbesPcError(
+                "The vertical statistics check must share the point cloud "
+                "and grid files of the density check"
+            )
+
+        self.point_cloud_file = self.point_cloud_files[0]
         self.grid_file = grid_file
         self.minimum_count = minimum_count
         self.minimum_count_percentage = minimum_count_percentage
         self.outdir = outdir
+        # engine used to calculate the density grid; see DENSITY_ENGINES
+        self.engine = engine
+        # when defined, the density grid is calculated tile by tile using
+        # a pool of `processes` workers to bound memory use
+        self.tile_size = tile_size
+        self.processes = processes
+        # number of threads processing the blocks of the density grid
+        self.threads = threads
+        # when defined, density grids are cached (and re-used) within
+        # this directory, keyed by the point files and grid geometry
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        # format of the persisted low density polygons; see VECTOR_SINKS
+        self.vector_format = vector_format
+        # the low density polygons are streamed to file and only a count
+        # is retained, unless the GeoDataFrame is asked for
+        self.return_gdf = return_gdf
+        # "vector" vectorises the low density cells, "raster" skips the
+        # vectorisation and writes a 1-bit failure mask (when persisting)
+        self.output_mode = output_mode
+        # called with a progress.ProgressEvent as the points are read
+        # and the blocks of the density grid are processed
+        self.progress_callback = progress_callback
+        # the check is cancelled (raising errors.CheckCancelled) at the
+        # next point chunk or raster block once `is_stopped` returns True,
+        # or once a run exceeds `timeout` seconds
+        self.is_stopped = is_stopped
+        self.timeout = timeout
+        # densities below the cap are binned exactly within the histogram,
+        # larger densities are log2 binned; the cap is raised to the
+        # minimum count so the pass/fail counts are always exact
+        self.histogram_cap = histogram_cap
+        # persisted density grids include overviews summing the counts of
+        # each coarser level; when True, the threshold is also evaluated
+        # at each level (building the overviews of unpersisted grids too)
+        self.coarse_levels = coarse_levels
+        # when defined, the raw counts of the point files are kept within
+        # this GeoTIFF, and subsequent runs only bin the files not yet
+        # counted; see incremental.CountGrid
+        self.count_grid = count_grid
+        # when defined, the results of this vertical statistics check are
+        # populated from the same pass of the point files as the density
+        # grid, rather than the check reading the points again; see
+        # vertical_statistics.density_statistics
+        self.vertical_check = vertical_check
 
         # total number of non-nodata nodes in grid
         self.total_nodes: Optional[int] = None
@@ -50,12 +197,317 @@ class AlgorithmIndependentDensityCheck:
         # second tuple item is the number of grid cells that have this
         # density
         self.histogram: Optional[list[tuple[int, int]]] = None
+        # lower edge of the log2 binned tail of the histogram; densities
+        # in bins at or above it lie within [density, 2 * density)
+        self.histogram_tail: Optional[int] = None
+        # results of the threshold at the coarser resolutions of the
+        # density grid's overview levels (if `coarse_levels`)
+        self.coarse_results: Optional[List[ThresholdResult]] = None
         self.percentage: Optional[float] = None
         self.percentage_passed: Optional[float] = None
         self.percentage_failed: Optional[float] = None
 
+        # number of low density polygons
+        self.low_density_regions: Optional[int] = None
         self.gdf: Optional[geopandas.GeoDataFrame] = None
 
+        # per stage timings of the latest run; see profiling.Profiler
+        self.profiler = profiling.Profiler()
+        self.performance: Optional[Dict[str, Any]] = None
+        # progress of the latest run; see progress.Progress
+        self.progress = progress.Progress()
+
+    def _start_progress(self, vectorise: bool) -> progress.Progress:
+        """Progress of a run, weighting the stages it is expected to report."""
+        stages = ["density"] if self.tile_size else ["points", "density"]
+        if self.vertical_check is not None:
+            stages.append("statistics")
+        if vectorise:
+            stages.append("vectorise")
+
+        return progress.Progress(
+            self.progress_callback,
+            {stage: PROGRESS_WEIGHTS[stage] for stage in stages},
+            cancellation=cancellation.Cancellation(self.is_stopped, self.timeout),
+        )
+
+    def _density(
+        self,
+        out_pathname: Path,
+        failure_mask: Optional[utils.FailureMask] = None,
+        creation_options: Optional[Dict[str, Any]] = None,
+        histogram_cap: int = utils.HISTOGRAM_CAP,
+        overviews: Optional[utils.SumOverviews] = None,
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+        """
+        Calculate the density grid using the configured engine, or along
+        with the vertical statistics (binning the points as the numpy
+        engine does) when a vertical statistics check shares the pass.
+        """
+        if self.vertical_check is not None:
+            LOG.info("Calculating density along with the vertical statistics")
+            check = self.vertical_check
+            hist, bins, cell_count, summary = (
+                vertical_statistics.density_statistics(
+                    self.grid_file,
+                    self.point_cloud_files,
+                    out_pathname,
+                    check.output_pathname(),
+                    check.tvu_a,
+                    check.tvu_b,
+                    check.minimum_count,
+                    threads=self.threads,
+                    failure_mask=failure_mask,
+                    creation_options=creation_options,
+                    profiler=self.profiler,
+                    progress=self.progress,
+                    histogram_cap=histogram_cap,
+                    overviews=overviews,
+                )
+            )
+            check.summarise(summary)
+            # the stages of the shared pass are recorded by this check
+            check.profiler = self.profiler
+            return hist, bins, cell_count
+
+        LOG.info(f"Calculating density using the {self.engine} engine")
+        engine = DENSITY_ENGINES[self.engine]
+        if self.count_grid is not None:
+            result = incremental.density(
+                self.grid_file,
+                self.point_cloud_files,
+                out_pathname,
+                incremental.CountGrid(self.count_grid),
+                threads=self.threads,
+                failure_mask=failure_mask,
+                creation_options=creation_options,
+                profiler=self.profiler,
+                progress=self.progress,
+                histogram_cap=histogram_cap,
+                overviews=overviews,
+            )
+        elif self.tile_size is None:
+            result = engine.density(
+                self.grid_file,
+                self.point_cloud_files,
+                out_pathname,
+                failure_mask=failure_mask,
+                creation_options=creation_options,
+                threads=self.threads,
+                profiler=self.profiler,
+                progress=self.progress,
+                histogram_cap=histogram_cap,
+                overviews=overviews,
+            )
+        else:
+            result = tiling.density_tiled(
+                self.grid_file,
+                self.point_cloud_files,
+                out_pathname,
+                engine.density_tile,
+                self.tile_size,
+                self.processes,
+                failure_mask=failure_mask,
+                creation_options=creation_options,
+                profiler=self.profiler,
+                progress=self.progress,
+                histogram_cap=histogram_cap,
+                overviews=overviews,
+            )
+
+        return result
+
+    def _density_grid(
+        self,
+        tmpdir: Path,
+        outdir: Optional[Path] = None,
+        failure_mask: Optional[utils.FailureMask] = None,
+        histogram_cap: int = utils.HISTOGRAM_CAP,
+    ) -> Tuple[storage.DensityStore, numpy.ndarray, numpy.ndarray, int]:
+        """
+        Retrieve the density grid from the cache, or calculate it. The
+        cache is bypassed when updating a count grid, or when evaluating
+        the vertical statistics in the same pass.
+        The grid is encoded once, at the location given by the storage
+        plan: within the cache entry if a cache directory is defined,
+        otherwise within `outdir` if defined, otherwise in memory or
+        `tmpdir` depending on its size. Cached grids are linked (or
+        copied) to `outdir`.
+        Returns the density store, the histogram, bins and total of
+        non-nodata cells. The store is to be closed by the caller.
+        If defined, the failure mask is written in the same pass as the
+        density statistics (or from the cached density grid).
+        Persisted (and cached) grids include sum aggregated overviews,
+        as do all grids if `coarse_levels` is set.
+        """
+        destination = None if outdir is None else outdir / "density.tif"
+
+        # the count grid has to be updated with any new point files, and
+        # the vertical statistics need the points, so a cached density
+        # grid can't stand in for reading the points
+        bypass_cache = (
+            self.count_grid is not None or self.vertical_check is not None
+        )
+        if self.cache_dir is not None and bypass_cache:
+            LOG.info("Bypassing the density grid cache to read the points")
+
+        if self.cache_dir is None or bypass_cache:
+            store = storage.plan(self.grid_file, tmpdir, destination)
+            overviews = None
+            if destination is not None or self.coarse_levels:
+                overviews = utils.SumOverviews()
+            try:
+                hist, bins, cell_count = self._density(
+                    store.pathname,
+                    failure_mask,
+                    store.creation_options,
+                    histogram_cap,
+                    overviews,
+                )
+            except Exception:
+                # don't leave an incomplete grid amongst the outputs
+                store.close()
+                if destination is not None and destination.exists():
+                    destination.unlink()
+                raise
+            return store, hist, bins, cell_count
+
+        density_cache = cache.DensityCache(self.cache_dir, self.cache_max_bytes)
+        with self.profiler.stage("cache_lookup"):
+            key, inputs = density_cache.key(
+                self.grid_file,
+                self.point_cloud_files,
+                self.engine,
+                histogram_cap,
+            )
+            entry = density_cache.get(key)
+
+        if entry is not None:
+            hist, bins, cell_count = entry.statistics()
+            self.progress.skip("points")
+            if failure_mask is None:
+                self.progress.skip("density")
+            else:
+                with rasterio.open(str(entry.density_pathname)) as src:
+                    cells = src.width * src.height
+                with self.profiler.stage("failure_mask") as timing, \
+                        self.progress.stage("density", cells, "cells") as stage:
+                    utils.write_failure_mask(
+                        entry.density_pathname,
+                        failure_mask,
+                        self.threads,
+                        stage,
+                    )
+                    timing.add_items(cells, "cells")
+        else:
+            out_pathname = density_cache.reserve(key)
+            try:
+                hist, bins, cell_count = self._density(
+                    out_pathname,
+                    failure_mask,
+                    histogram_cap=histogram_cap,
+                    overviews=utils.SumOverviews(),
+                )
+            except Exception:
+                density_cache.release(out_pathname)
+                raise
+            with self.profiler.stage("cache_store"):
+                entry = density_cache.put(
+                    key, inputs, out_pathname, hist, bins, cell_count
+                )
+
+        if destination is not None:
+            with self.profiler.stage("link_outputs"):
+                storage.link_or_copy(entry.density_pathname, destination)
+
+        store = storage.DensityStore(
+            entry.density_pathname, utils.DENSITY_GTIFF_OPTIONS
+        )
+
+        return store, hist, bins, cell_count
+
+    def _output_directory(self) -> Optional[Path]:
+        """Directory for persisted outputs, created if required."""
+        if self.outdir is None:
+            return None
+
+        outdir = self.outdir / self.point_cloud_file.stem / self.name
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        return outdir
+
+    def _vector_sinks(
+        self,
+        outdir: Optional[Path],
+        min_soundings: Sequence[int],
+        suffix: bool = False,
+    ) -> Dict[int, List[vector_sink.VectorSink]]:
+        """
+        Sinks for the low density polygons of each threshold. The first sink
+        only counts the polygons, followed by a file sink if the outputs are
+        to persist, and lastly an in-memory sink if the GeoDataFrame is
+        asked for.
+        """
+        sinks: Dict[int, List[vector_sink.VectorSink]] = {}
+        for minimum_count in min_soundings:
+            sinks[minimum_count] = [vector_sink.VectorSink()]
+            if outdir is not None:
+                stem = "low-density-pixels"
+                if suffix:
+                    stem = f"{stem}-{minimum_count}"
+                sinks[minimum_count].append(
+                    vector_sink.from_format(self.vector_format, outdir, stem)
+                )
+            if self.return_gdf:
+                sinks[minimum_count].append(vector_sink.MemorySink())
+
+        return sinks
+
+    def _vectorise(
+        self,
+        store: storage.DensityStore,
+        cell_count: int,
+        outdir: Optional[Path],
+        min_soundings: Sequence[int],
+        suffix: bool = False,
+    ) -> Dict[int, List[vector_sink.VectorSink]]:
+        """
+        Vectorise the low density cells of each threshold in a single scan
+        of the density grid, returning the sinks of each threshold.
+        """
+        LOG.info("Converting low density pixels to vector")
+        sinks = self._vector_sinks(outdir, min_soundings, suffix)
+        with self.profiler.stage("vectorise") as timing:
+            utils.stream_low_density(
+                store.pathname, sinks, self.threads, self.profiler, self.progress
+            )
+            timing.add_items(cell_count, "cells")
+
+        return sinks
+
+    def _coarse_results(
+        self, store: storage.DensityStore, histogram_cap: int
+    ) -> List["ThresholdResult"]:
+        """
+        Evaluate the threshold at each overview level of the density grid.
+        A coarse cell holds the soundings of all its (non-nodata) cells.
+        """
+        results = []
+        with self.profiler.stage("coarse_levels"):
+            levels = utils.overview_statistics(store.pathname, histogram_cap)
+            for factor, stats in levels:
+                hist, _ = stats.histogram()
+                result = ThresholdResult.from_histogram(
+                    hist,
+                    stats.cell_count,
+                    self.minimum_count,
+                    self.minimum_count_percentage,
+                )
+                result.factor = factor
+                results.append(result)
+
+        return results
+
     def run(self):
         """
         Runs/executes the density check workflow.
@@ -68,49 +520,174 @@ class AlgorithmIndependentDensityCheck:
             * Resolution
             * CRS
             * No data value (assumed to be finite)
+        Raises errors.CheckCancelled if the check is stopped or times out
+        (see `is_stopped` and `timeout`), once the temporary storage has
+        been removed.
         """
-        with tempfile.TemporaryDirectory(suffix=".density-check") as tmpdir:
-            out_pathname = Path(tmpdir).joinpath("density.tif") 
+        self.profiler = profiling.Profiler()
+        self.progress = self._start_progress(self.output_mode == "vector")
+        outdir = self._output_directory()
 
-            LOG.info("Calculating density")
-            hist, bins, cell_count = pdal_pipeline.density(
-                self.grid_file, self.point_cloud_file, out_pathname
-            )  # noqa: E501
+        # raster output mode writes a failure mask in place of the polygons
+        failure_mask = None
+        if self.output_mode == "raster" and outdir is not None:
+            failure_mask = utils.FailureMask(
+                outdir / "low-density-mask.tif", self.minimum_count
+            )
 
-            LOG.info("Converting low density pixels to vector")
-            gdf = utils.vectorise_low_density(out_pathname, self.minimum_count)
+        histogram_cap = max(self.histogram_cap, self.minimum_count)
 
-            if self.outdir is not None:
-                outdir = self.outdir / self.point_cloud_file.stem / self.name
-                outdir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(suffix=".density-check") as tmpdir:
+            store, hist, bins, cell_count = self._density_grid(
+                Path(tmpdir), outdir, failure_mask, histogram_cap
+            )
 
-                _ = shutil.copy(out_pathname, outdir)
+            with store:
+                if self.output_mode == "vector":
+                    sinks = self._vectorise(
+                        store, cell_count, outdir, [self.minimum_count]
+                    )
+                    threshold_sinks = sinks[self.minimum_count]
 
-                gdf_pathname = outdir / "low-density-pixels.shp"
-                gdf.to_file(gdf_pathname, driver="ESRI Shapefile")
+                    self.low_density_regions = threshold_sinks[0].feature_count
+                    if self.return_gdf:
+                        self.gdf = threshold_sinks[-1].to_geodataframe()
 
-        failed_nodes = int(hist[0:self.minimum_count].sum())
-        percentage = float((failed_nodes / cell_count) * 100)
-        percentage_passed = 100 - percentage
-        passed = percentage_passed > self.minimum_count_percentage
+                if self.coarse_levels:
+                    self.coarse_results = self._coarse_results(
+                        store, histogram_cap
+                    )
+
+        result = ThresholdResult.from_histogram(
+            hist, cell_count, self.minimum_count, self.minimum_count_percentage
+        )
 
         # total number of non-nodata nodes in grid
         self.total_nodes = cell_count
 
         # total number of nodes that failed density check
-        self.failed_nodes = failed_nodes
-        self.percentage_failed = percentage
-        self.percentage_passed = percentage_passed
+        self.failed_nodes = result.failed_nodes
+        self.percentage_failed = result.percentage_failed
+        self.percentage_passed = result.percentage_passed
 
-        self.passed = passed
+        self.passed = result.passed
 
         # (density, number of cells that have that density)
         self.histogram = list(zip(bins.tolist(), hist.tolist()))
-
-        self.gdf = gdf
+        self.histogram_tail = histogram_cap
 
         LOG.info(cell_count)
-        LOG.info(passed)
-        LOG.info(percentage_passed)
-        LOG.info(percentage)
-        LOG.info(failed_nodes)
+        LOG.info(result.passed)
+        LOG.info(result.percentage_passed)
+        LOG.info(result.percentage_failed)
+        LOG.info(result.failed_nodes)
+
+        self.performance = self.profiler.to_dict()
+        self.progress.finish()
+
+    def sweep(
+        self,
+        thresholds: Sequence[Tuple[int, float]],
+        vectorise: bool = False,
+    ) -> List["ThresholdResult"]:
+        """
+        Evaluate several (minimum_count, minimum_count_percentage) pairs
+        from a single density grid calculation.
+        Pass/fail for each pair is derived from the histogram. If
+        `vectorise` is True, the low density cells for every pair are
+        vectorised in a single scan of the density grid.
+        The check attributes (total_nodes, histogram) are populated, whilst
+        the per threshold results are returned.
+
+        :param thresholds: A list of (minimum_count, percentage) tuples
+        :type thresholds: list
+        :param vectorise: If True, vectorise the low density cells
+        :type vectorise: bool
+        :raises CheckCancelled: The check was stopped or timed out
+        :return: A list of results, in the order of `thresholds`
+        :rtype: list
+        """
+        self.profiler = profiling.Profiler()
+        self.progress = self._start_progress(vectorise)
+        outdir = self._output_directory()
+
+        histogram_cap = max([self.histogram_cap, *(mc for mc, _ in thresholds)])
+
+        with tempfile.TemporaryDirectory(suffix=".density-check") as tmpdir:
+            store, hist, bins, cell_count = self._density_grid(
+                Path(tmpdir), outdir, histogram_cap=histogram_cap
+            )
+
+            results = [
+                ThresholdResult.from_histogram(
+                    hist, cell_count, minimum_count, percentage
+                )
+                for minimum_count, percentage in thresholds
+            ]
+
+            with store:
+                if vectorise:
+                    min_soundings = sorted({r.minimum_count for r in results})
+                    sinks = self._vectorise(
+                        store, cell_count, outdir, min_soundings, suffix=True
+                    )
+
+                    for result in results:
+                        threshold_sinks = sinks[result.minimum_count]
+                        result.low_density_regions = threshold_sinks[0].feature_count  # noqa: E501
+                        if self.return_gdf:
+                            result.gdf = threshold_sinks[-1].to_geodataframe()
+
+        self.total_nodes = cell_count
+        self.histogram = list(zip(bins.tolist(), hist.tolist()))
+        self.histogram_tail = histogram_cap
+        self.performance = self.profiler.to_dict()
+        self.progress.finish()
+
+        return results
+
+
+class ThresholdResult:
+    """
+    The outcome of evaluating a single (minimum_count,
+    minimum_count_percentage) pair against the density histogram.
+    """
+
+    def __init__(
+        self,
+        minimum_count: int,
+        minimum_count_percentage: float,
+        failed_nodes: int,
+        total_nodes: int,
+    ) -> None:
+        self.minimum_count = minimum_count
+        self.minimum_count_percentage = minimum_count_percentage
+        self.failed_nodes = failed_nodes
+        self.total_nodes = total_nodes
+        self.percentage_failed = float((failed_nodes / total_nodes) * 100)
+        self.percentage_passed = 100 - self.percentage_failed
+        self.passed = self.percentage_passed > minimum_count_percentage
+        # ratio of the resolution evaluated to that of the density grid
+        self.factor = 1
+        # number of low density polygons, and the polygons if requested
+        self.low_density_regions: Optional[int] = None
+        self.gdf: Optional[geopandas.GeoDataFrame] = None
+
+    @classmethod
+    def from_histogram(
+        cls,
+        hist: numpy.ndarray,
+        cell_count: int,
+        minimum_count: int,
+        minimum_count_percentage: float,
+    ):  # -> Self:
+        """
+        Evaluate the threshold from the histogram of the density grid.
+        The histogram's cap must be at least `minimum_count`, so the
+        failing densities are all binned exactly.
+        """
+        failed_nodes = int(hist[0:minimum_count].sum())
+
+        return cls(
+            minimum_count, minimum_count_percentage, failed_nodes, cell_count
+        )
@@ -1,2 +1,10 @@
 class MbesPcError(Exception):
     """Simple custom error for PDAL driver specifics."""
+
+
+class CheckCancelled(MbesPcError):
+    """The check was stopped before completing."""
+
+
+class CheckTimeout(CheckCancelled):
+    """The check exceeded its timeout."""
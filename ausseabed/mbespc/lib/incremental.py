@@ -0,0 +1,268 @@
+"""
+Incremental density grid updates for surveys that grow over time.
+Point counts are additive, so the raw (unmasked) counts of the point files
+binned so far are kept in a persistent count grid, along with a manifest
+identifying those files. Subsequent runs only bin the point files that
+aren't within the manifest, before the base grids' no-data mask is applied
+and the statistics are recalculated from the updated counts.
+The count grid is rebuilt from scratch if the geometry of the base grid
+changes, or if a point file previously counted has changed or is no longer
+part of the survey, as its points can't be subtracted.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import json
+import logging
+import os
+import tempfile
+
+import numpy
+import rasterio  # type: ignore[import]
+
+from ausseabed.mbespc.lib import cache, numpy_density, profiling, utils
+from ausseabed.mbespc.lib.progress import Progress
+
+LOG = logging.getLogger(__name__)
+
+# bump when the contents of the count grid or manifest change
+MANIFEST_VERSION = 1
+
+# GeoTIFF tag holding the manifest; kept within the count grid so that
+# the counts and the files they include are replaced atomically
+MANIFEST_TAG = "MBESPC_MANIFEST"
+
+# creation options for the count grid; re-encoded on every update, so
+# fast rather than small
+COUNT_GRID_GTIFF_OPTIONS = {
+    "compress": "zstd",
+    "zstd_level": 1,
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+    "predictor": 2,
+}
+
+
+def _geometry(dataset: rasterio.DatasetReader) -> Dict[str, Any]:
+    """The geometry of a grid the counts are aligned to."""
+    return {
+        "transform": list(dataset.transform)[:6],
+        "width": dataset.width,
+        "height": dataset.height,
+        "crs": dataset.crs.to_wkt() if dataset.crs else None,
+    }
+
+
+class CountGrid:
+    """
+    Persistent raw count grid, and the manifest of the point files whose
+    points it includes.
+    """
+
+    def __init__(self, pathname: Path) -> None:
+        self.pathname = Path(pathname)
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """The manifest of the count grid, or None if it doesn't exist."""
+        if not self.pathname.exists():
+            return None
+
+        with rasterio.open(str(self.pathname)) as src:
+            manifest = src.tags().get(MANIFEST_TAG)
+
+        if manifest is None:
+            return None
+
+        return json.loads(manifest)
+
+    def pending(
+        self,
+        grid_dataset: rasterio.DatasetReader,
+        point_cloud_pathnames: Sequence[Path],
+    ) -> Tuple[bool, List[Path]]:
+        """
+        Determine the point files yet to be counted.
+
+        :param grid_dataset: The base grid
+        :type grid_dataset: class:`rasterio.DatasetReader`
+        :param point_cloud_pathnames: Pathnames to all point files of
+            the survey
+        :type point_cloud_pathnames: list
+        :return: A tuple of whether the existing counts can be updated,
+            and the point files to bin (all files if they can't)
+        :rtype: tuple
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return False, list(point_cloud_pathnames)
+
+        reason = None
+        fingerprints = {
+            str(Path(pathname).resolve()): cache.file_fingerprint(pathname)
+            for pathname in point_cloud_pathnames
+        }
+        counted = {f["path"]: f for f in manifest["point_files"]}
+
+        if manifest["version"] != MANIFEST_VERSION:
+            reason = "the count grid version differs"
+        elif manifest["geometry"] != _geometry(grid_dataset):
+            reason = "the geometry of the base grid changed"
+        else:
+            for path, fingerprint in counted.items():
+                if fingerprints.get(path) != fingerprint:
+                    reason = f"counted point file {path} changed or was removed"
+                    break
+
+        if reason is not None:
+            LOG.warning(f"Rebuilding count grid {self.pathname}, as {reason}")
+            return False, list(point_cloud_pathnames)
+
+        pending = [
+            Path(pathname)
+            for pathname in point_cloud_pathnames
+            if str(Path(pathname).resolve()) not in counted
+        ]
+
+        return True, pending
+
+    def read(self, counts: numpy.ndarray) -> None:
+        """Read the existing counts into the count grid `counts`."""
+        with rasterio.open(str(self.pathname)) as src:
+            for _, window in src.block_windows():
+                rows, cols = window.toslices()
+                counts[rows, cols] = src.read(1, window=window)
+
+    def write(
+        self,
+        counts: numpy.ndarray,
+        grid_dataset: rasterio.DatasetReader,
+        point_cloud_pathnames: Sequence[Path],
+    ) -> None:
+        """
+        Replace the count grid and its manifest.
+
+        :param counts: The count grid, including all of the point files
+        :type counts: class:`numpy.ndarray`
+        :param grid_dataset: The base grid the counts are aligned to
+        :type grid_dataset: class:`rasterio.DatasetReader`
+        :param point_cloud_pathnames: Pathnames to the point files counted
+        :type point_cloud_pathnames: list
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "geometry": _geometry(grid_dataset),
+            "point_files": [
+                cache.file_fingerprint(pathname)
+                for pathname in point_cloud_pathnames
+            ],
+        }
+        kwargs = {
+            "driver": "GTiff",
+            "width": grid_dataset.width,
+            "height": grid_dataset.height,
+            "count": 1,
+            "dtype": counts.dtype.name,
+            "crs": grid_dataset.crs,
+            "transform": grid_dataset.transform,
+            **COUNT_GRID_GTIFF_OPTIONS,
+        }
+
+        self.pathname.parent.mkdir(parents=True, exist_ok=True)
+        tmp_pathname = self.pathname.with_suffix(".tmp.tif")
+        try:
+            with rasterio.open(str(tmp_pathname), "w", **kwargs) as outds:
+                for _, window in outds.block_windows():
+                    rows, cols = window.toslices()
+                    outds.write(counts[rows, cols], 1, window=window)
+                outds.update_tags(**{MANIFEST_TAG: json.dumps(manifest)})
+            os.replace(tmp_pathname, self.pathname)
+        finally:
+            if tmp_pathname.exists():
+                tmp_pathname.unlink()
+
+
+def density(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Path,
+    count_grid: CountGrid,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    threads: Optional[int] = None,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+    """
+    Workflow for updating the density grid with the point files that
+    aren't yet within the count grid, binned using NumPy and laspy.
+    The updated count grid replaces the existing one, and the density
+    grid is written from it as per :func:`numpy_density.density`.
+    The "points" progress stage only covers the points binned by the run.
+    Returns the same result as :func:`pdal_pipeline.density`.
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+
+    with tempfile.TemporaryDirectory(suffix=".density-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            update, pending = count_grid.pending(src, point_cloud_pathnames)
+            counts = numpy_density.allocate_counts(
+                src.height, src.width, Path(tmpdir)
+            )
+
+            if update:
+                with profiler.stage("read_counts") as timing:
+                    count_grid.read(counts)
+                    timing.add_items(counts.size, "cells")
+
+            LOG.info(
+                f"Binning {len(pending)} of {len(point_cloud_pathnames)} "
+                "point files into the count grid"
+            )
+            total_points = utils.header_point_count(pending) if pending else 0
+            with profiler.stage("bin_points") as timing, progress.stage(
+                "points", total_points, "points"
+            ) as stage:
+                n_points = numpy_density.bin_points(
+                    pending,
+                    src.crs,
+                    src.transform,
+                    counts,
+                    chunk_size,
+                    threads,
+                    stage,
+                )
+                timing.add_items(n_points, "points")
+
+            if pending or not update:
+                with profiler.stage("write_counts") as timing:
+                    count_grid.write(counts, src, point_cloud_pathnames)
+                    timing.add_items(counts.size, "cells")
+
+        LOG.info("Writing density grid with no data values")
+        with profiler.stage("write_density") as timing, progress.stage(
+            "density", counts.size, "cells"
+        ) as stage:
+            stats = numpy_density.write_density(
+                grid_dataset_pathname,
+                counts,
+                out_pathname,
+                failure_mask,
+                creation_options,
+                threads,
+                stage,
+                histogram_cap,
+                overviews,
+            )
+            timing.add_items(counts.size, "cells")
+
+        # release the memory map prior to the tmpdir cleanup
+        del counts
+
+    hist, bins = stats.histogram()
+
+    return hist, bins, stats.cell_count
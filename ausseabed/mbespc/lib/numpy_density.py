@@ -0,0 +1,590 @@
+"""
+Point density calculation using NumPy and laspy.
+An alternative to the PDAL pipeline (readers.las -> filters.reprojection ->
+writers.gdal) that bins points directly into a count grid aligned to the
+base grid, without any temporary rasters.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import logging
+import os
+
+import numpy
+import laspy
+import lazrs  # type: ignore[import]
+import pyproj
+import rasterio  # type: ignore[import]
+from rasterio.crs import CRS  # type: ignore[import] # pylint: disable=E0611
+from rasterio.windows import Window  # type: ignore[import]
+from affine import Affine
+
+from ausseabed.mbespc.lib import blocks, profiling, utils
+from ausseabed.mbespc.lib.progress import Progress, StageProgress
+
+LOG = logging.getLogger(__name__)
+
+# number of points read from the point cloud file per iteration
+CHUNK_SIZE = 1_000_000
+
+# only the coordinates are decompressed from LAZ files; the other fields
+# are skipped by the layered compression of point formats 6 to 10
+LAZ_SELECTION = (
+    laspy.DecompressionSelection.XY_RETURNS_CHANNEL
+    | laspy.DecompressionSelection.Z
+)
+
+# count grids larger than this (number of cells) are backed by a memory
+# mapped file rather than held in memory
+MAX_IN_MEMORY_CELLS = 2**28
+
+# nodata value and datatype consistent with pdal_writer.GdalWriter
+NODATA = -9999
+DTYPE = "int32"
+
+
+@lru_cache(maxsize=16)
+def _transformer(src_wkt: str, dst_wkt: str) -> pyproj.Transformer:
+    """Cached transformer for a given source and destination CRS."""
+    return pyproj.Transformer.from_crs(src_wkt, dst_wkt, always_xy=True)
+
+
+def laz_ranges(
+    header: laspy.LasHeader, chunk_size: int = CHUNK_SIZE
+) -> List[Tuple[int, int]]:
+    """
+    Split the points of a LAZ file into (start, stop) ranges that can be
+    decompressed independently. Each range starts on a chunk of the LAZ
+    chunk table and spans roughly `chunk_size` points, so seeking to a
+    range doesn't decompress the points preceding it.
+    Files with variable size chunks are a single range.
+
+    :param header: The header of the LAZ file
+    :type header: class:`laspy.LasHeader`
+    :param chunk_size: Approximate number of points per range
+    :type chunk_size: int
+    :return: The ranges of point indices
+    :rtype: list
+    """
+    n_points = int(header.point_count)
+    vlr = header.vlrs[header.vlrs.index("LasZipVlr")]
+    laz_vlr = lazrs.LazVlr(vlr.record_data)
+    if laz_vlr.uses_variable_size_chunks():
+        return [(0, n_points)]
+
+    laz_chunk = laz_vlr.chunk_size()
+    step = max(1, chunk_size // laz_chunk) * laz_chunk
+
+    return [
+        (start, min(start + step, n_points)) for start in range(0, n_points, step)
+    ]
+
+
+def _read_range(
+    pathname: Path, start: int, stop: int
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Decompress the coordinates of a range of points of a LAZ file."""
+    with laspy.open(
+        str(pathname),
+        laz_backend=laspy.LazBackend.Lazrs,
+        decompression_selection=LAZ_SELECTION,
+    ) as reader:
+        reader.seek(start)
+        points = reader.read_points(stop - start)
+
+    return numpy.asarray(points.x), numpy.asarray(points.y), numpy.asarray(points.z)
+
+
+def _read_laz(
+    pathname: Path, header: laspy.LasHeader, chunk_size: int, threads: int
+) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+    """
+    Decompress the ranges of a LAZ file using a pool of `threads`, each
+    with its own (single threaded) decompressor, yielding the coordinates
+    of each range in order. At most two ranges per thread are in flight,
+    so the file is never held in memory as a whole.
+    """
+    ranges = iter(laz_ranges(header, chunk_size))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending: deque = deque()
+        try:
+            for start, stop in ranges:
+                pending.append(executor.submit(_read_range, pathname, start, stop))
+                if len(pending) >= 2 * threads:
+                    break
+
+            while pending:
+                x, y, z = pending.popleft().result()
+                for start, stop in ranges:
+                    pending.append(
+                        executor.submit(_read_range, pathname, start, stop)
+                    )
+                    break
+                yield x, y, z
+        finally:
+            # the consumer stopped early (e.g. cancellation)
+            for future in pending:
+                future.cancel()
+
+
+def read_points(
+    pathname: Path,
+    crs: CRS,
+    chunk_size: int = CHUNK_SIZE,
+    threads: Optional[int] = None,
+) -> Iterator[Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]]:
+    """
+    Read a LAS/LAZ file in chunks, yielding the x, y, z coordinates
+    transformed to the given CRS.
+    Points without a defined CRS are assumed to be in the target CRS.
+    If `threads` is defined, the chunks of a LAZ file are decompressed
+    in parallel by that many threads (only the coordinates are
+    decompressed); otherwise laspy's default LAZ backend is used.
+
+    :param pathname: Pathname to the LAS/LAZ file
+    :type pathname: class:`pathlib.Path`
+    :param crs: The CRS to transform the coordinates into
+    :type crs: class:`rasterio.crs.CRS`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param threads: Number of threads decompressing a LAZ file
+    :type threads: int or None
+    :return: A generator yielding tuples of x, y, z coordinate arrays
+    :rtype: generator
+    """
+    dst_wkt = crs.to_wkt()
+
+    with laspy.open(str(pathname)) as reader:
+        header = reader.header
+        src_crs = header.parse_crs()
+        transformer = None
+        if src_crs is not None and src_crs != pyproj.CRS.from_wkt(dst_wkt):
+            transformer = _transformer(src_crs.to_wkt(), dst_wkt)
+
+        if threads is not None and header.are_points_compressed:
+            chunks = _read_laz(pathname, header, chunk_size, threads)
+        else:
+            chunks = (
+                (
+                    numpy.asarray(points.x),
+                    numpy.asarray(points.y),
+                    numpy.asarray(points.z),
+                )
+                for points in reader.chunk_iterator(chunk_size)
+            )
+
+        for x, y, z in chunks:
+            if transformer is not None:
+                x, y, z = transformer.transform(x, y, z)
+
+            yield x, y, z
+
+
+def cell_index(
+    x: numpy.ndarray,
+    y: numpy.ndarray,
+    transform: Affine,
+    width: int,
+    height: int,
+    return_inside: bool = False,
+) -> Union[numpy.ndarray, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Convert coordinates to the flat (row major) cell index of a grid.
+    Points falling outside of the grid are discarded.
+
+    :param x: The x coordinates
+    :type x: class:`numpy.ndarray`
+    :param y: The y coordinates
+    :type y: class:`numpy.ndarray`
+    :param transform: The affine transform of the grid
+    :type transform: class:`affine.Affine`
+    :param width: Number of columns in the grid
+    :type width: int
+    :param height: Number of rows in the grid
+    :type height: int
+    :param return_inside: If True, also return the mask of the points
+        inside the grid, to select the points' other fields
+    :type return_inside: bool
+    :return: The flat cell index of each point inside the grid, and the
+        mask of the points inside the grid if `return_inside`
+    :rtype: class:`numpy.ndarray` or tuple
+    """
+    col, row = ~transform * (x, y)
+    col = numpy.floor(col).astype("int64")
+    row = numpy.floor(row).astype("int64")
+
+    inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+    index = row[inside] * width + col[inside]
+
+    if return_inside:
+        return index, inside
+
+    return index
+
+
+def accumulate(counts: numpy.ndarray, index: numpy.ndarray) -> None:
+    """
+    Add the occurrences of each flat cell index to the count grid in place.
+    Uses bincount over the span of the indices covered by the chunk
+    (survey lines are spatially coherent), falling back to a sort based
+    count when the span is too sparse.
+
+    :param counts: The count grid to update
+    :type counts: class:`numpy.ndarray`
+    :param index: Flat cell index for each point
+    :type index: class:`numpy.ndarray`
+    """
+    if index.size == 0:
+        return
+
+    flat = counts.reshape(-1)
+    start = int(index.min())
+    span = int(index.max()) - start + 1
+
+    if span <= 4 * index.size:
+        binned = numpy.bincount(index - start, minlength=span)
+        flat[start: start + span] += binned.astype(flat.dtype, copy=False)
+    else:
+        uniq, binned = numpy.unique(index, return_counts=True)
+        flat[uniq] += binned.astype(flat.dtype, copy=False)
+
+
+def allocate_counts(
+    height: int, width: int, tmpdir: Optional[Path] = None
+) -> numpy.ndarray:
+    """
+    Allocate a zeroed count grid. Grids larger than `MAX_IN_MEMORY_CELLS`
+    are backed by a memory mapped file within `tmpdir`.
+
+    :param height: Number of rows in the grid
+    :type height: int
+    :param width: Number of columns in the grid
+    :type width: int
+    :param tmpdir: Directory to host the memory mapped file
+    :type tmpdir: class:`pathlib.Path` or None
+    :return: The count grid
+    :rtype: class:`numpy.ndarray`
+    """
+    if height * width <= MAX_IN_MEMORY_CELLS or tmpdir is None:
+        return numpy.zeros((height, width), dtype=DTYPE)
+
+    pathname = Path(tmpdir).joinpath("counts.dat")
+    LOG.info(f"Using memory mapped count grid: {pathname}")
+
+    return numpy.memmap(pathname, dtype=DTYPE, mode="w+", shape=(height, width))
+
+
+def count_points(
+    point_cloud_pathname: Path,
+    crs: CRS,
+    transform: Affine,
+    counts: numpy.ndarray,
+    chunk_size: int = CHUNK_SIZE,
+    lock: Optional[threading.Lock] = None,
+    stage_progress: Optional[StageProgress] = None,
+    decode_threads: Optional[int] = None,
+) -> int:
+    """
+    Bin the points of a point cloud file into the count grid.
+    When the count grid is shared between threads, `lock` guards
+    the update of the grid; reading and binning proceed concurrently.
+
+    :param point_cloud_pathname: Pathname to the LAS/LAZ file
+    :type point_cloud_pathname: class:`pathlib.Path`
+    :param crs: The CRS of the count grid
+    :type crs: class:`rasterio.crs.CRS`
+    :param transform: The affine transform of the count grid
+    :type transform: class:`affine.Affine`
+    :param counts: The count grid to update
+    :type counts: class:`numpy.ndarray`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param lock: Lock guarding updates to the count grid, or None
+    :type lock: class:`threading.Lock` or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :param decode_threads: Number of threads decompressing a LAZ file;
+        see :func:`read_points`
+    :type decode_threads: int or None
+    :return: The number of points read
+    :rtype: int
+    """
+    height, width = counts.shape
+
+    n_points = 0
+    for x, y, _ in read_points(
+        point_cloud_pathname, crs, chunk_size, decode_threads
+    ):
+        index = cell_index(x, y, transform, width, height)
+        if lock is None:
+            accumulate(counts, index)
+        else:
+            with lock:
+                accumulate(counts, index)
+        n_points += x.size
+        if stage_progress is not None:
+            stage_progress.update(x.size)
+
+    return n_points
+
+
+def bin_points(
+    point_cloud_pathnames: Sequence[Path],
+    crs: CRS,
+    transform: Affine,
+    counts: numpy.ndarray,
+    chunk_size: int = CHUNK_SIZE,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Bin the points of several point cloud files into the one count grid,
+    reading the files concurrently using a pool of `threads` (default is
+    the CPU count). Files are read by up to one thread each, and the
+    remaining threads are shared out to decompress the chunks of each LAZ
+    file in parallel (e.g. a single LAZ file is decompressed by all of
+    the threads).
+
+    :param point_cloud_pathnames: Pathnames to the LAS/LAZ files
+    :type point_cloud_pathnames: list
+    :param crs: The CRS of the count grid
+    :type crs: class:`rasterio.crs.CRS`
+    :param transform: The affine transform of the count grid
+    :type transform: class:`affine.Affine`
+    :param counts: The count grid to update
+    :type counts: class:`numpy.ndarray`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param threads: Number of threads reading and decompressing the files
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points read
+    :rtype: int
+    """
+    if not point_cloud_pathnames:
+        return 0
+
+    lock = threading.Lock()
+    threads = threads or os.cpu_count() or 1
+    file_threads = min(len(point_cloud_pathnames), threads)
+    decode_threads = max(1, threads // file_threads)
+    with ThreadPoolExecutor(max_workers=file_threads) as executor:
+        futures = [
+            executor.submit(
+                count_points,
+                pathname,
+                crs,
+                transform,
+                counts,
+                chunk_size,
+                lock,
+                stage_progress,
+                decode_threads,
+            )
+            for pathname in point_cloud_pathnames
+        ]
+        return sum(future.result() for future in futures)
+
+
+def write_density(
+    grid_dataset_pathname: Path,
+    counts: numpy.ndarray,
+    out_pathname: Path,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> utils.DensityStatistics:
+    """
+    Write the count grid to a GeoTIFF, applying the base grids' no-data mask
+    and accumulating the density statistics in the same pass.
+    Blocks of the base grid are read and masked by a pool of `threads`,
+    whilst the calling thread writes the blocks in order.
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param counts: The count grid
+    :type counts: class:`numpy.ndarray`
+    :param out_pathname: Pathname of the output density grid
+    :type out_pathname: class:`pathlib.Path`
+    :param failure_mask: If defined, the failure mask is written within
+        the same pass
+    :type failure_mask: class:`utils.FailureMask` or None
+    :param creation_options: GeoTIFF creation options. Default is
+        `utils.DENSITY_GTIFF_OPTIONS`
+    :type creation_options: dict or None
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the cells of each block
+    :type stage_progress: class:`progress.StageProgress` or None
+    :param histogram_cap: Densities at or above the cap are binned into
+        the log2 spaced tail of the histogram
+    :type histogram_cap: int
+    :param overviews: If defined, the sum aggregated overview levels are
+        written within the same pass
+    :type overviews: class:`utils.SumOverviews` or None
+    :return: The statistics of the density grid
+    :rtype: class:`utils.DensityStatistics`
+    """
+    stats = utils.DensityStatistics(histogram_cap)
+    if creation_options is None:
+        creation_options = utils.DENSITY_GTIFF_OPTIONS
+
+    def mask_block(datasets, window):
+        (src,) = datasets
+        rows, cols = window.toslices()
+        d_data = numpy.array(counts[rows, cols], dtype=DTYPE)
+        z_data = src.read(1, window=window)
+        valid = utils.mask_finite(z_data, src.nodata)
+        d_data[~valid] = NODATA
+        block_stats = utils.DensityStatistics(histogram_cap)
+        block_stats.update(d_data, valid)
+        return window, d_data, valid, block_stats
+
+    with blocks.BlockScheduler([grid_dataset_pathname], threads) as scheduler:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            kwargs = {
+                "driver": "GTiff",
+                "width": src.width,
+                "height": src.height,
+                "count": 1,
+                "dtype": DTYPE,
+                "crs": src.crs,
+                "transform": src.transform,
+                "nodata": NODATA,
+                **creation_options,
+                "num_threads": scheduler.threads,
+            }
+            with rasterio.open(str(out_pathname), "w", **kwargs) as outds:
+                windows = [window for _, window in outds.block_windows()]
+                if failure_mask is not None:
+                    failure_mask.open(src)
+                if overviews is not None:
+                    overviews.open(outds)
+                try:
+                    results = scheduler.map(mask_block, windows)
+                    for window, d_data, valid, block_stats in results:
+                        stats = stats.merge(block_stats)
+                        outds.write(d_data, 1, window=window)
+                        if failure_mask is not None:
+                            failure_mask.write(d_data, valid, window)
+                        if overviews is not None:
+                            overviews.write(d_data, valid, window)
+                        if stage_progress is not None:
+                            stage_progress.update(d_data.size)
+                finally:
+                    if failure_mask is not None:
+                        failure_mask.close()
+
+    if overviews is not None:
+        overviews.close()
+
+    return stats
+
+
+def density(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Path,
+    chunk_size: int = CHUNK_SIZE,
+    threads: Optional[int] = None,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+    """
+    Workflow for creating the density grid using NumPy and laspy.
+    Point cloud files are read, and LAZ files decompressed in parallel,
+    by a pool of `threads` (default is the CPU count); see
+    :func:`bin_points`. Their counts are summed into the one grid. The
+    same number of threads read the blocks whilst writing the density
+    grid.
+    If defined, the `profiler` records the binning and writing stages,
+    and `progress` reports the points binned ("points" stage) and the
+    cells written ("density" stage).
+    Returns the same result as :func:`pdal_pipeline.density`.
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
+    with tempfile.TemporaryDirectory(suffix=".density-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            counts = allocate_counts(src.height, src.width, Path(tmpdir))
+
+            LOG.info("Creating density grid")
+            with profiler.stage("bin_points") as timing, progress.stage(
+                "points", total_points, "points"
+            ) as stage:
+                n_points = bin_points(
+                    point_cloud_pathnames,
+                    src.crs,
+                    src.transform,
+                    counts,
+                    chunk_size,
+                    threads,
+                    stage,
+                )
+                timing.add_items(n_points, "points")
+            LOG.info(
+                f"Binned {n_points} points from "
+                f"{len(point_cloud_pathnames)} files"
+            )
+
+        LOG.info("Writing density grid with no data values")
+        with profiler.stage("write_density") as timing, progress.stage(
+            "density", counts.size, "cells"
+        ) as stage:
+            stats = write_density(
+                grid_dataset_pathname,
+                counts,
+                out_pathname,
+                failure_mask,
+                creation_options,
+                threads,
+                stage,
+                histogram_cap,
+                overviews,
+            )
+            timing.add_items(counts.size, "cells")
+
+        # release the memory map prior to the tmpdir cleanup
+        del counts
+
+    hist, bins = stats.histogram()
+
+    return hist, bins, stats.cell_count
+
+
+def density_tile(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    window: Window,
+    chunk_size: int = CHUNK_SIZE,
+) -> numpy.ndarray:
+    """
+    Calculate the point counts for a single tile (window) of the base grid.
+    Points outside of the tile bounds are discarded whilst binning, so only
+    a grid the size of the tile is allocated.
+    """
+    with rasterio.open(str(grid_dataset_pathname)) as src:
+        crs = src.crs
+        transform = src.window_transform(window)
+
+    counts = numpy.zeros((int(window.height), int(window.width)), dtype=DTYPE)
+    for pathname in point_cloud_pathnames:
+        count_points(pathname, crs, transform, counts, chunk_size)
+
+    return counts
@@ -38,3 +38,39 @@ class Reprojection:
         data = vars(self)
 
         return utils.sanitize_properties(data)
+
+
+class Crop:
+    """JSON Helper class for the PDAL crop filter."""
+
+    def __init__(self, bounds: str):
+        self.type = "filters.crop"
+        self.bounds = bounds
+
+    @classmethod
+    def from_bounds(
+        cls, xmin: float, ymin: float, xmax: float, ymax: float
+    ):  # -> Self:
+        """
+        Instantiate the Crop class given a bounding box.
+        """
+        bounds = f"([{xmin}, {xmax}], [{ymin}, {ymax}])"
+
+        return cls(bounds)
+
+    def to_json(self) -> str:
+        """
+        Export the PDAL filter type to JSON.
+        """
+        data = self.to_dict()
+
+        return json.dumps(data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Export the PDAL filter type to dict.
+        Private properties are ignored.
+        """
+        data = vars(self)
+
+        return utils.sanitize_properties(data)
@@ -1,78 +1,247 @@
 import json
 from pathlib import Path
 import tempfile
-from typing import Tuple, Optional
+from typing import Any, Dict, Iterator, List, Tuple, Optional, Sequence
 import logging
+import multiprocessing
 
 import numpy
 import rasterio  # type: ignore[import]
-from rasterio import shutil
+from rasterio.windows import Window  # type: ignore[import]
 import pdal  # type: ignore[import]
 
-from ausseabed.mbespc.lib import pdal_reader, pdal_filter, pdal_writer, errors, utils
+from ausseabed.mbespc.lib import (
+    pdal_reader,
+    pdal_filter,
+    pdal_writer,
+    errors,
+    profiling,
+    utils,
+)
+from ausseabed.mbespc.lib.progress import Progress
 
 LOG = logging.getLogger(__name__)
 
+# interval (seconds) between cancellation checkpoints whilst a pipeline
+# executes within a worker process
+POLL_INTERVAL = 0.5
+
+# maximum number of points per chunk when streaming a pipeline's points
+CHUNK_SIZE = 1_000_000
+
+
+def _reader_stages(point_cloud_pathnames: Sequence[Path]) -> List[Dict[str, Any]]:
+    """
+    Reader section of the pipeline. PDAL merges the output of consecutive
+    readers into the following stage, so multiple files are read into the
+    one grid without a pre-merged intermediate file.
+    """
+    return [
+        pdal_reader.PdalDriver.from_string(str(pathname)).to_dict()
+        for pathname in point_cloud_pathnames
+    ]
+
+
+def _execute(json_pipeline: str) -> int:
+    """Execute a pipeline in streaming mode, returning the number of points."""
+    pipeline = pdal.Pipeline(json_pipeline)
+    try:
+        return pipeline.execute_streaming()
+    except Exception as err:
+        msg = f"Error running pipeline: {json_pipeline}"
+        raise errors.MbesPcError(msg) from err
+
+
+def iterate(
+    json_pipeline: str, chunk_size: int = CHUNK_SIZE
+) -> Iterator[numpy.ndarray]:
+    """
+    Execute a pipeline in streaming mode, yielding the points in chunks
+    as structured arrays (one field per PDAL dimension, e.g. X, Y, Z).
+    Each chunk is handed over as PDAL produced it, and only one chunk is
+    held at a time, so the point cloud is never materialised as a whole.
+    Every stage of the pipeline must be streamable.
+
+    :param json_pipeline: The JSON pipeline definition
+    :type json_pipeline: str
+    :param chunk_size: Maximum number of points per chunk
+    :type chunk_size: int
+    :return: A generator yielding the chunks of points
+    :rtype: generator
+    """
+    pipeline = pdal.Pipeline(json_pipeline)
+    try:
+        for points in pipeline.iterator(chunk_size=chunk_size):
+            yield points
+    except Exception as err:
+        msg = f"Error streaming pipeline: {json_pipeline}"
+        raise errors.MbesPcError(msg) from err
+
+
+def execute(json_pipeline: str, progress: Optional[Progress] = None) -> int:
+    """
+    Execute a pipeline, returning the number of points processed.
+    PDAL can't be interrupted part way through a pipeline, so when the
+    workflow can be cancelled the pipeline executes within a worker
+    process, which is terminated at the first checkpoint following the
+    cancellation. Otherwise the pipeline executes in this process.
+
+    :param json_pipeline: The JSON pipeline definition
+    :type json_pipeline: str
+    :param progress: Progress of the workflow, providing the cancellation
+        checkpoints
+    :type progress: class:`progress.Progress` or None
+    :raises CheckCancelled: The workflow was cancelled
+    :return: The number of points processed
+    :rtype: int
+    """
+    if progress is None or not progress.cancellable:
+        return _execute(json_pipeline)
+
+    pool = multiprocessing.get_context("spawn").Pool(1)
+    try:
+        result = pool.apply_async(_execute, (json_pipeline,))
+        while not result.ready():
+            progress.checkpoint()
+            result.wait(POLL_INTERVAL)
+        return result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
 
 def density(
     grid_dataset_pathname: Path,
-    point_cloud_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
     out_pathname: Path,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    threads: Optional[int] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
 ) -> Tuple[numpy.ndarray, numpy.ndarray, int]:  # noqa: E501
     """
     Workflow for creating the density grid.
+    Counts from all point cloud files are accumulated into the one grid.
+    PDAL writes the raw counts to a temporary GeoTIFF (fast compression);
+    the no-data mask is then applied whilst encoding the grid once at
+    `out_pathname` with `creation_options`.
+    If defined, the failure mask is written whilst applying the no-data mask.
+    The no-data mask is applied using a pool of `threads` (default is the
+    CPU count).
+    If defined, the `profiler` records the pipeline (reading, reprojection
+    and gridding) and the no-data masking stages.
+    If defined, `progress` reports the points gridded ("points" stage) and
+    the cells masked ("density" stage). PDAL executes the pipeline as a
+    whole, so the points are only reported once the pipeline completes.
+    Densities at or above `histogram_cap` are binned into the log2 spaced
+    tail of the histogram; see :class:`utils.DensityStatistics`.
+    If defined, the sum aggregated `overviews` of the density grid are
+    built whilst applying the no-data mask.
     """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
     with tempfile.TemporaryDirectory(suffix=".density-calcs") as tmpdir:
         with rasterio.open(str(grid_dataset_pathname)) as src:
             # define reader section of the pipeline
-            reader = pdal_reader.PdalDriver.from_string(str(point_cloud_pathname))  # noqa: E501
+            readers = _reader_stages(point_cloud_pathnames)
 
             # reprojection
             # from_crs in this instance means build obj from crs
             projection = pdal_filter.Reprojection.from_crs(src.crs)
 
             # writer
-            tmp_pathname = Path(tmpdir).joinpath("density.tiledb")  # type: ignore[attr-defined] # pylint: disable=line-too-long # noqa: E501
+            tmp_pathname = Path(tmpdir).joinpath("counts.tif")  # type: ignore[attr-defined] # pylint: disable=line-too-long # noqa: E501
             writer = pdal_writer.GdalWriter.from_dataset(src, tmp_pathname)
+            writer.gdaldriver = "GTiff"
+            writer.gdalopts = pdal_writer.TEMP_GTIFF_GDALOPTS
 
             pipeline_stages = [
-                reader.to_dict(),
+                *readers,
                 projection.to_dict(),
                 writer.to_dict(),
             ]
 
             json_pipeline = json.dumps(pipeline_stages)
-            pipeline = pdal.Pipeline(json_pipeline)
 
             LOG.info("Creating density grid")
-            try:
-                pipeline.execute_streaming()
-            except Exception as err:
-                msg = f"Error running pipeline: {json_pipeline}"
-                raise errors.MbesPcError(msg) from err
-
-        # update density grid with no-data mask from base grid
-        LOG.info("Updating density grid with no data values")
-        maxv, cell_count = utils.update_density_no_data(
-            grid_dataset_pathname, tmp_pathname
-        )  # noqa: E501
+            with profiler.stage("pdal_pipeline") as timing, progress.stage(
+                "points", total_points, "points"
+            ) as stage:
+                n_points = execute(json_pipeline, progress)
+                timing.add_items(n_points, "points")
+                stage.update(n_points)
 
+        # update density grid with no-data mask from base grid, and
         # calculate histogram of point density (not probability density)
-        hist, bins = utils.histogram_point_density(tmp_pathname, maxv)
-
-        kwargs = {
-            "compress": "deflate",
-            "zlevel": 6,
-            "tiled": "yes",
-            "blockxsize": 256,
-            "blockysize": 256,
-            "predictor": 2,
-        }
-        shutil.copy(
-            tmp_pathname,
-            out_pathname,
-            driver="GTiff",
-            **kwargs,
-        )
+        # in the same pass over the density grid
+        LOG.info("Updating density grid with no data values")
+        with profiler.stage("reduce_density") as timing, progress.stage(
+            "density", src.width * src.height, "cells"
+        ) as stage:
+            stats = utils.reduce_density(
+                grid_dataset_pathname,
+                tmp_pathname,
+                failure_mask,
+                out_pathname,
+                creation_options,
+                threads,
+                stage,
+                histogram_cap,
+                overviews,
+            )
+            timing.add_items(src.width * src.height, "cells")
+        hist, bins = stats.histogram()
+        cell_count = stats.cell_count
 
     return hist, bins, cell_count
+
+
+def density_tile(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    window: Window,
+) -> numpy.ndarray:
+    """
+    Calculate the point counts for a single tile (window) of the base grid.
+    Points are cropped to the tile bounds prior to gridding, so the PDAL
+    writer only allocates a grid the size of the tile.
+    """
+    with tempfile.TemporaryDirectory(suffix=".density-tile") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            readers = _reader_stages(point_cloud_pathnames)
+            projection = pdal_filter.Reprojection.from_crs(src.crs)
+            crop = pdal_filter.Crop.from_bounds(*src.window_bounds(window))
+
+            tmp_pathname = Path(tmpdir).joinpath("density.tif")
+            writer = pdal_writer.GdalWriter.from_window(
+                src, window, tmp_pathname
+            )
+            # tile is temporary and small, so compression isn't warranted
+            writer.gdaldriver = "GTiff"
+            writer.gdalopts = []
+
+            pipeline_stages = [
+                *readers,
+                projection.to_dict(),
+                crop.to_dict(),
+                writer.to_dict(),
+            ]
+
+            json_pipeline = json.dumps(pipeline_stages)
+            execute(json_pipeline)
+
+        # crop filter with no points results in no output file
+        if not tmp_pathname.exists():
+            return numpy.zeros(
+                (int(window.height), int(window.width)), dtype="int32"
+            )
+
+        with rasterio.open(tmp_pathname) as ds:
+            counts = ds.read(1)
+
+    return counts
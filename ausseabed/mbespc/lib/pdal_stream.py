@@ -0,0 +1,353 @@
+"""
+Point density calculation by streaming the points of a PDAL pipeline into
+Python reducers.
+Rather than gridding within PDAL (writers.gdal) and reading back a
+temporary raster, the reader and filter stages run in streaming mode and
+each chunk of points is handed, as the structured array PDAL produced, to
+a set of reducers (e.g. counts, vertical statistics, coverage masks).
+Only one chunk per file is held at a time, so any reader or filter chain
+PDAL can stream is supported without materialising the point cloud.
+"""
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
+import os
+
+import numpy
+import rasterio  # type: ignore[import]
+from rasterio.crs import CRS  # type: ignore[import] # pylint: disable=E0611
+from rasterio.windows import Window  # type: ignore[import]
+from affine import Affine
+
+from ausseabed.mbespc.lib import (
+    numpy_density,
+    pdal_filter,
+    pdal_pipeline,
+    pdal_reader,
+    profiling,
+    utils,
+    vertical_statistics,
+)
+from ausseabed.mbespc.lib.progress import Progress, StageProgress
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = pdal_pipeline.CHUNK_SIZE
+
+
+class Reducer(ABC):
+    """
+    Reduces the chunks of points streamed from a pipeline into a result.
+    `reduce` turns a chunk into a partial result without touching any
+    shared state, so chunks of several pipelines can be reduced
+    concurrently; `merge` then folds the partial result into the reducer
+    (guarded by a lock when shared between threads).
+    """
+
+    @abstractmethod
+    def reduce(self, points: numpy.ndarray) -> Any:
+        """
+        Reduce a chunk of points to a partial result.
+
+        :param points: The chunk of points, with a field per dimension
+        :type points: class:`numpy.ndarray`
+        :return: The partial result of the chunk
+        """
+
+    @abstractmethod
+    def merge(self, partial: Any) -> None:
+        """
+        Fold the partial result of a chunk into the reducer.
+
+        :param partial: The partial result returned by `reduce`
+        """
+
+
+class CountReducer(Reducer):
+    """Bins the points into a count grid; see :mod:`numpy_density`."""
+
+    def __init__(self, transform: Affine, counts: numpy.ndarray) -> None:
+        self.transform = transform
+        self.counts = counts
+
+    def reduce(self, points: numpy.ndarray) -> numpy.ndarray:
+        height, width = self.counts.shape
+
+        return numpy_density.cell_index(
+            points["X"], points["Y"], self.transform, width, height
+        )
+
+    def merge(self, partial: numpy.ndarray) -> None:
+        numpy_density.accumulate(self.counts, partial)
+
+
+class StatisticsReducer(Reducer):
+    """
+    Accumulates the per cell vertical statistics of the points; see
+    :mod:`vertical_statistics`.
+    """
+
+    def __init__(
+        self, transform: Affine, statistics: vertical_statistics.CellStatistics
+    ) -> None:
+        self.transform = transform
+        self.statistics = statistics
+
+    def reduce(self, points: numpy.ndarray) -> vertical_statistics.CellPartials:
+        height, width = self.statistics.shape
+
+        return vertical_statistics.point_statistics(
+            points["X"], points["Y"], points["Z"], self.transform, width, height
+        )
+
+    def merge(self, partial: vertical_statistics.CellPartials) -> None:
+        self.statistics.update(partial)
+
+
+class CoverageReducer(Reducer):
+    """Flags the cells of a boolean grid holding at least one point."""
+
+    def __init__(self, transform: Affine, mask: numpy.ndarray) -> None:
+        self.transform = transform
+        self.mask = mask
+
+    def reduce(self, points: numpy.ndarray) -> numpy.ndarray:
+        height, width = self.mask.shape
+
+        return numpy_density.cell_index(
+            points["X"], points["Y"], self.transform, width, height
+        )
+
+    def merge(self, partial: numpy.ndarray) -> None:
+        self.mask.reshape(-1)[partial] = True
+
+
+def reduce_points(
+    json_pipeline: str,
+    reducers: Sequence[Reducer],
+    chunk_size: int = CHUNK_SIZE,
+    lock: Optional[threading.Lock] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Stream the points of a pipeline through the reducers, chunk by chunk.
+    When the reducers are shared between threads, `lock` guards merging
+    the partial results; reading and reducing proceed concurrently.
+
+    :param json_pipeline: The JSON pipeline definition; every stage must
+        be streamable
+    :type json_pipeline: str
+    :param reducers: The reducers each chunk of points is handed to
+    :type reducers: list
+    :param chunk_size: Maximum number of points per chunk
+    :type chunk_size: int
+    :param lock: Lock guarding the merges into the reducers, or None
+    :type lock: class:`threading.Lock` or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points streamed
+    :rtype: int
+    """
+    n_points = 0
+    for points in pdal_pipeline.iterate(json_pipeline, chunk_size):
+        partials = [reducer.reduce(points) for reducer in reducers]
+        if lock is None:
+            for reducer, partial in zip(reducers, partials):
+                reducer.merge(partial)
+        else:
+            with lock:
+                for reducer, partial in zip(reducers, partials):
+                    reducer.merge(partial)
+        n_points += points.size
+        if stage_progress is not None:
+            stage_progress.update(points.size)
+
+    return n_points
+
+
+def pipeline_stages(
+    point_cloud_pathname: Path,
+    crs: CRS,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Reader and filter stages streaming the points of a single file, in
+    the CRS of the grid, and optionally cropped to the given bounds.
+
+    :param point_cloud_pathname: Pathname to the point cloud file
+    :type point_cloud_pathname: class:`pathlib.Path`
+    :param crs: The CRS to reproject the points into
+    :type crs: class:`rasterio.crs.CRS`
+    :param bounds: If defined, the (left, bottom, right, top) bounds to
+        crop the points to
+    :type bounds: tuple or None
+    :return: The pipeline stages
+    :rtype: list
+    """
+    stages = [
+        pdal_reader.PdalDriver.from_string(str(point_cloud_pathname)).to_dict(),
+        pdal_filter.Reprojection.from_crs(crs).to_dict(),
+    ]
+    if bounds is not None:
+        stages.append(pdal_filter.Crop.from_bounds(*bounds).to_dict())
+
+    return stages
+
+
+def stream_points(
+    point_cloud_pathnames: Sequence[Path],
+    crs: CRS,
+    reducers: Sequence[Reducer],
+    chunk_size: int = CHUNK_SIZE,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Stream the points of several point cloud files through the one set
+    of reducers. Each file runs as its own pipeline, rather than merging
+    the readers within the one pipeline, so the files are streamed
+    concurrently by a pool of `threads` (default is one per file, up to
+    the CPU count).
+
+    :param point_cloud_pathnames: Pathnames to the point cloud files
+    :type point_cloud_pathnames: list
+    :param crs: The CRS to reproject the points into
+    :type crs: class:`rasterio.crs.CRS`
+    :param reducers: The reducers each chunk of points is handed to
+    :type reducers: list
+    :param chunk_size: Maximum number of points per chunk
+    :type chunk_size: int
+    :param threads: Number of pipelines run concurrently
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points streamed
+    :rtype: int
+    """
+    if not point_cloud_pathnames:
+        return 0
+
+    lock = threading.Lock()
+    file_threads = threads or min(len(point_cloud_pathnames), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=file_threads) as executor:
+        futures = [
+            executor.submit(
+                reduce_points,
+                json.dumps(pipeline_stages(pathname, crs)),
+                reducers,
+                chunk_size,
+                lock,
+                stage_progress,
+            )
+            for pathname in point_cloud_pathnames
+        ]
+        return sum(future.result() for future in futures)
+
+
+def density(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Path,
+    chunk_size: int = CHUNK_SIZE,
+    threads: Optional[int] = None,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+    """
+    Workflow for creating the density grid by streaming the PDAL pipeline
+    of each point cloud file into a count grid.
+    Unlike :func:`pdal_pipeline.density`, no temporary raster is written
+    and the points are reported ("points" stage) and cancellable chunk by
+    chunk. The count grid is then written as per
+    :func:`numpy_density.density`.
+    Returns the same result as :func:`pdal_pipeline.density`.
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
+    with tempfile.TemporaryDirectory(suffix=".density-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            counts = numpy_density.allocate_counts(
+                src.height, src.width, Path(tmpdir)
+            )
+            reducer = CountReducer(src.transform, counts)
+
+            LOG.info("Creating density grid")
+            with profiler.stage("stream_points") as timing, progress.stage(
+                "points", total_points, "points"
+            ) as stage:
+                n_points = stream_points(
+                    point_cloud_pathnames,
+                    src.crs,
+                    [reducer],
+                    chunk_size,
+                    threads,
+                    stage,
+                )
+                timing.add_items(n_points, "points")
+            LOG.info(
+                f"Streamed {n_points} points from "
+                f"{len(point_cloud_pathnames)} files"
+            )
+
+        LOG.info("Writing density grid with no data values")
+        with profiler.stage("write_density") as timing, progress.stage(
+            "density", counts.size, "cells"
+        ) as stage:
+            stats = numpy_density.write_density(
+                grid_dataset_pathname,
+                counts,
+                out_pathname,
+                failure_mask,
+                creation_options,
+                threads,
+                stage,
+                histogram_cap,
+                overviews,
+            )
+            timing.add_items(counts.size, "cells")
+
+        # release the memory map prior to the tmpdir cleanup
+        del reducer, counts
+
+    hist, bins = stats.histogram()
+
+    return hist, bins, stats.cell_count
+
+
+def density_tile(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    window: Window,
+    chunk_size: int = CHUNK_SIZE,
+) -> numpy.ndarray:
+    """
+    Calculate the point counts for a single tile (window) of the base grid.
+    Points are cropped to the tile bounds within the pipeline, so only
+    the points of the tile reach the count grid of the tile.
+    """
+    with rasterio.open(str(grid_dataset_pathname)) as src:
+        crs = src.crs
+        transform = src.window_transform(window)
+        bounds = src.window_bounds(window)
+
+    counts = numpy.zeros(
+        (int(window.height), int(window.width)), dtype=numpy_density.DTYPE
+    )
+    reducers = [CountReducer(transform, counts)]
+    for pathname in point_cloud_pathnames:
+        json_pipeline = json.dumps(pipeline_stages(pathname, crs, bounds))
+        reduce_points(json_pipeline, reducers, chunk_size)
+
+    return counts
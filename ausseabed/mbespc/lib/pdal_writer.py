@@ -4,9 +4,20 @@ from typing import List, Dict, Any
 # from typing import Self  # Self is avail >= py3.11
 
 import rasterio  # type: ignore[import]
+from rasterio.windows import Window  # type: ignore[import]
 
 from ausseabed.mbespc.lib import utils
 
+# GDAL creation options for temporary GeoTIFF count grids written by PDAL,
+# favouring write speed over size
+TEMP_GTIFF_GDALOPTS = [
+    "TILED=YES",
+    "BLOCKXSIZE=256",
+    "BLOCKYSIZE=256",
+    "COMPRESS=ZSTD",
+    "ZSTD_LEVEL=1",
+]
+
 
 class GdalWriter:
     """
@@ -67,6 +78,33 @@ class GdalWriter:
         )
         return obj
 
+    @classmethod
+    def from_window(
+        cls,
+        dataset: rasterio.DatasetReader,
+        window: Window,
+        out_pathname: Path,
+    ):  # -> Self:
+        """
+        Constructor for GdalWriter via a window (tile) of a rasterio dataset.
+        """
+        resolution = dataset.res[0]
+        crs = dataset.crs.to_string()
+        transform = dataset.window_transform(window)
+        height = int(window.height)
+        width = int(window.width)
+        origin_x, origin_y = transform * (0, height)
+        obj = cls(
+            str(out_pathname),
+            resolution,
+            origin_x,
+            origin_y,
+            width,
+            height,
+            crs,
+        )
+        return obj
+
     def to_json(self) -> str:
         """
         Export the PDAL writer type to JSON.
@@ -0,0 +1,169 @@
+"""
+Lightweight per stage instrumentation of the density check workflow.
+Records the wall time, CPU time, peak resident set size and the number of
+items processed (e.g. points or cells) by each stage.
+The peak resident set size is only available on POSIX platforms, and is
+reported as None elsewhere (e.g. Windows).
+"""
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import logging
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # e.g. Windows
+    resource = None  # type: ignore[assignment]
+
+LOG = logging.getLogger(__name__)
+
+
+def peak_rss(children: bool = False) -> Optional[int]:
+    """
+    Peak resident set size (bytes) of the current process, or of the
+    largest terminated child process if `children` is True. None where
+    the platform doesn't provide it.
+    """
+    if resource is None:
+        return None
+
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # reported in bytes on macOS, and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return int(maxrss)
+
+    return int(maxrss) * 1024
+
+
+def format_rss(rss: Optional[int]) -> str:
+    """A peak resident set size in MiB, or "n/a" if unavailable."""
+    return "n/a" if rss is None else f"{rss / 2**20:.1f}"
+
+
+def _children_cpu_time() -> float:
+    # zero on Windows, where the CPU time of children isn't reported
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class StageTiming:
+    """
+    Measurements of a single stage.
+    CPU time covers all threads of the process, plus any worker processes
+    that terminated during the stage. Peak RSS is the high water mark of
+    the process (and largest worker process) at the end of the stage.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss: Optional[int] = None
+        self.children_peak_rss: Optional[int] = None
+        # number of items (points, cells, features) processed
+        self.items: Optional[int] = None
+        # the type of items processed
+        self.unit: Optional[str] = None
+        # number of times the stage was entered
+        self.calls = 0
+
+    def add_items(self, items: int, unit: Optional[str] = None) -> None:
+        """Account for items processed by the stage."""
+        self.items = (self.items or 0) + int(items)
+        if unit is not None:
+            self.unit = unit
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Items processed per second of wall time."""
+        if self.items is None or self.wall_time <= 0:
+            return None
+
+        return self.items / self.wall_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss": self.peak_rss,
+            "children_peak_rss": self.children_peak_rss,
+            "items": self.items,
+            "unit": self.unit,
+            "throughput": self.throughput,
+            "calls": self.calls,
+        }
+
+
+class Profiler:
+    """
+    Collects the timings of the stages of a workflow, in the order the
+    stages are first entered. Re-entering a stage accumulates into the
+    existing timing, so repeated operations (e.g. writing each batch of
+    vectors) are reported as the one stage.
+
+    Example::
+
+        profiler = Profiler()
+        with profiler.stage("histogram") as timing:
+            ...
+            timing.add_items(cell_count, "cells")
+    """
+
+    def __init__(self) -> None:
+        self._stages: Dict[str, StageTiming] = {}
+        self._start = time.perf_counter()
+
+    @property
+    def stages(self) -> List[StageTiming]:
+        return list(self._stages.values())
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageTiming]:
+        """Time the enclosed block as the named stage."""
+        timing = self._stages.setdefault(name, StageTiming(name))
+        wall = time.perf_counter()
+        cpu = time.process_time() + _children_cpu_time()
+        try:
+            yield timing
+        finally:
+            timing.wall_time += time.perf_counter() - wall
+            timing.cpu_time += time.process_time() + _children_cpu_time() - cpu
+            timing.peak_rss = peak_rss()
+            timing.children_peak_rss = peak_rss(children=True)
+            timing.calls += 1
+            LOG.debug(f"Stage {name}: {timing.wall_time:.3f}s")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The timings of all stages, along with the wall time since the
+        profiler was created and the overall peak RSS.
+        """
+        return {
+            "stages": [timing.to_dict() for timing in self.stages],
+            "wall_time": time.perf_counter() - self._start,
+            "peak_rss": peak_rss(),
+            "children_peak_rss": peak_rss(children=True),
+        }
+
+    def format(self) -> str:
+        """A human readable table of the stage timings."""
+        lines = [
+            f"{'stage':<24} {'wall (s)':>10} {'cpu (s)':>10} "
+            f"{'peak RSS (MiB)':>15} {'items':>12} {'items/s':>12}"
+        ]
+        for timing in self.stages:
+            items = "" if timing.items is None else f"{timing.items}"
+            rate = timing.throughput
+            rate_str = "" if rate is None else f"{rate:.0f}"
+            lines.append(
+                f"{timing.name:<24} {timing.wall_time:>10.3f} "
+                f"{timing.cpu_time:>10.3f} "
+                f"{format_rss(timing.peak_rss):>15} {items:>12} {rate_str:>12}"
+            )
+
+        return "\n".join(lines)
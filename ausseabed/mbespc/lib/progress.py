@@ -0,0 +1,198 @@
+"""
+Progress reporting of the stages of the density check workflow.
+Each stage reports the number of items (points or cells) processed so far
+against the expected total, from which the overall fraction complete is
+derived using the relative weight of each stage. Long running stages
+report as they go, so a slow job can be told apart from a hung one.
+The same updates act as the checkpoints of cooperative cancellation.
+"""
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Set
+import logging
+import threading
+import time
+
+from ausseabed.mbespc.lib.cancellation import Cancellation
+
+LOG = logging.getLogger(__name__)
+
+# minimum interval (seconds) between the reports of a stage
+MIN_INTERVAL = 0.25
+
+
+class ProgressEvent(NamedTuple):
+    """The progress of a stage, as passed to the progress callback."""
+
+    # name of the stage, e.g. "points", "density" or "vectorise"
+    stage: str
+    # number of items processed so far
+    done: int
+    # expected number of items, or None if unknown
+    total: Optional[int]
+    # the type of items processed, e.g. "points" or "cells"
+    unit: str
+    # fraction (0 to 1) of the whole workflow complete
+    fraction: float
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+class StageProgress:
+    """
+    Counts the items processed by a single stage.
+    `update` is safe to call from several threads, and raises if the
+    workflow has been cancelled.
+    """
+
+    def __init__(
+        self,
+        progress: "Progress",
+        name: str,
+        total: Optional[int],
+        unit: str,
+    ) -> None:
+        self._progress = progress
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.done = 0
+
+    @property
+    def fraction(self) -> float:
+        """Fraction (0 to 1) of the stage complete; 0 if the total is unknown."""
+        if not self.total:
+            return 0.0
+
+        return min(1.0, self.done / self.total)
+
+    def update(self, items: int) -> None:
+        """Account for further items processed by the stage."""
+        self._progress._update(self, int(items))
+
+
+class Progress:
+    """
+    Reports the progress of the stages of a workflow to a callback.
+    The overall fraction complete weights each stage by `weights`; stages
+    without a weight (or all stages, if no weights are given) only
+    report their own progress. Reports of a stage are throttled to one
+    per `min_interval` seconds, aside from its start and end.
+    The start of each stage and each update is a `cancellation` checkpoint.
+
+    Example::
+
+        progress = Progress(callback, weights={"points": 3, "density": 1})
+        with progress.stage("points", total=n_points, unit="points") as stage:
+            for chunk in chunks:
+                ...
+                stage.update(len(chunk))
+    """
+
+    def __init__(
+        self,
+        callback: Optional[ProgressCallback] = None,
+        weights: Optional[Dict[str, float]] = None,
+        min_interval: float = MIN_INTERVAL,
+        cancellation: Optional[Cancellation] = None,
+    ) -> None:
+        self.callback = callback
+        self.cancellation = cancellation
+        self.weights = dict(weights or {})
+        self.min_interval = min_interval
+        self._completed: Set[str] = set()
+        self._finished = False
+        self._current: Optional[StageProgress] = None
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def fraction(self) -> float:
+        """Fraction (0 to 1) of the whole workflow complete."""
+        if self._finished:
+            return 1.0
+
+        current = self._current
+        total_weight = sum(self.weights.values())
+        if total_weight <= 0:
+            return 0.0 if current is None else current.fraction
+
+        weight = sum(
+            self.weights[name] for name in self._completed if name in self.weights
+        )
+        if current is not None and current.name not in self._completed:
+            weight += self.weights.get(current.name, 0.0) * current.fraction
+
+        return min(1.0, weight / total_weight)
+
+    @property
+    def cancellable(self) -> bool:
+        """Whether the workflow can be cancelled."""
+        return self.cancellation is not None and self.cancellation.active
+
+    def checkpoint(self) -> None:
+        """
+        Raise :class:`errors.CheckCancelled` if the workflow has been
+        cancelled (or has timed out).
+        """
+        if self.cancellation is not None:
+            self.cancellation.check()
+
+    def _report(self, stage: StageProgress) -> None:
+        self._last_report = time.monotonic()
+        if self.callback is None:
+            return
+
+        event = ProgressEvent(
+            stage.name, stage.done, stage.total, stage.unit, self.fraction
+        )
+        try:
+            self.callback(event)
+        except Exception:
+            # a failing progress display mustn't fail the check
+            LOG.exception("Error reporting progress")
+
+    def _update(self, stage: StageProgress, items: int) -> None:
+        self.checkpoint()
+        with self._lock:
+            stage.done += items
+            if time.monotonic() - self._last_report >= self.min_interval:
+                self._report(stage)
+
+    @contextmanager
+    def stage(
+        self, name: str, total: Optional[int] = None, unit: str = "items"
+    ) -> Iterator[StageProgress]:
+        """Report the progress of the enclosed block as the named stage."""
+        self.checkpoint()
+        stage = StageProgress(self, name, total, unit)
+        with self._lock:
+            self._current = stage
+            self._report(stage)
+
+        yield stage
+
+        with self._lock:
+            if stage.total is None:
+                stage.total = stage.done
+            self._completed.add(name)
+            self._report(stage)
+            self._current = None
+
+    def skip(self, *names: str) -> None:
+        """Mark weighted stages that aren't required (e.g. cached) as complete."""
+        with self._lock:
+            self._completed.update(names)
+
+    def finish(self) -> None:
+        """
+        Report the workflow as complete, including any weighted stages
+        that didn't run (e.g. as the density grid was cached).
+        """
+        with self._lock:
+            self._completed.update(self.weights)
+            self._finished = True
+            stage = StageProgress(self, "complete", 1, "stages")
+            stage.done = 1
+            self._report(stage)
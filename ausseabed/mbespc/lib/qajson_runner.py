@@ -0,0 +1,1168 @@
+"""
+Execution of the density, vertical statistics and surface consistency
+checks defined within a QAJSON document, shared by the QAX plugin and the
+`mbespc qajson` command.
+Each check is described by a picklable task, and the tasks are run within
+a bounded pool of worker processes. The outputs of each check are passed
+back as it completes, so the QAJSON can be updated incrementally.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import json
+import logging
+import math
+import multiprocessing
+import os
+import traceback
+
+import geopandas
+import rasterio  # type: ignore[import]
+from shapely import geometry
+
+from ausseabed.qajson.model import (
+    QajsonCheck,
+    QajsonExecution,
+    QajsonOutputs,
+    QajsonRoot,
+)
+from ausseabed.mbespc.lib.density_check import AlgorithmIndependentDensityCheck
+from ausseabed.mbespc.lib.errors import CheckCancelled
+from ausseabed.mbespc.lib.progress import ProgressCallback, ProgressEvent
+from ausseabed.mbespc.lib.surface_check import SurfaceConsistencyCheck
+from ausseabed.mbespc.lib.vertical_check import VerticalStatisticsCheck
+from ausseabed.mbespc.lib.utils import bin_label
+from ausseabed.mbespc.lib.workers import WORKER_MEMORY_PARAM, WORKERS_PARAM
+
+LOG = logging.getLogger(__name__)
+
+# estimated peak memory (bytes) per cell of the density grid when it is
+# calculated in one piece; the count grid along with the gridding engine's
+# working arrays
+BYTES_PER_CELL = 16
+
+# interval (seconds) between polling for stopped checks and progress
+POLL_INTERVAL = 0.5
+
+# called with the index of the task, and its outputs, as each check completes
+CompletionCallback = Callable[[int, QajsonOutputs], None]
+
+
+def _timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def param_value(check: QajsonCheck, param_name: str) -> Any:
+    """
+    Gets a parameter value from the QajsonCheck based on the parameter
+    name. Will return None if the parameter is not found.
+    """
+    param = next(
+        (p for p in check.inputs.params if p.name == param_name),
+        None,
+    )
+    if param is None:
+        return None
+
+    return param.value
+
+
+def load_qajson(pathname: Path) -> QajsonRoot:
+    """
+    Load a QAJSON document.
+
+    :param pathname: Pathname to the QAJSON file
+    :type pathname: class:`pathlib.Path`
+    :return: The QAJSON document
+    :rtype: class:`QajsonRoot`
+    """
+    with open(pathname) as src:
+        return QajsonRoot.from_dict(json.load(src))
+
+
+def write_qajson(qajson: QajsonRoot, pathname: Path) -> None:
+    """
+    Write a QAJSON document. The document is written alongside and then
+    renamed, so readers never see a partially written file.
+
+    :param qajson: The QAJSON document
+    :type qajson: class:`QajsonRoot`
+    :param pathname: Pathname of the QAJSON file
+    :type pathname: class:`pathlib.Path`
+    """
+    tmp_pathname = pathname.with_name(f".{pathname.name}.tmp")
+    with open(tmp_pathname, "w") as outf:
+        json.dump(qajson.to_dict(), outf, indent=4)
+
+    os.replace(tmp_pathname, pathname)
+
+
+def find_checks(qajson: QajsonRoot, check_id: str) -> List[QajsonCheck]:
+    """
+    The checks of a QAJSON document with the given id. All checks of this
+    tool are survey product checks, alongside checks implemented by other
+    tools (which are skipped).
+
+    :param qajson: The QAJSON document
+    :type qajson: class:`QajsonRoot`
+    :param check_id: The id of the check, e.g.
+        `AlgorithmIndependentDensityCheck.id`
+    :type check_id: str
+    :return: The checks
+    :rtype: list
+    """
+    if qajson.qa.survey_products is None:
+        return []
+
+    return [
+        check
+        for check in qajson.qa.survey_products.checks
+        if check.info.id == check_id
+    ]
+
+
+def density_checks(qajson: QajsonRoot) -> List[QajsonCheck]:
+    """The density checks of a QAJSON document; see :func:`find_checks`."""
+    return find_checks(qajson, AlgorithmIndependentDensityCheck.id)
+
+
+def vertical_statistics_checks(qajson: QajsonRoot) -> List[QajsonCheck]:
+    """
+    The vertical statistics checks of a QAJSON document; see
+    :func:`find_checks`.
+    """
+    return find_checks(qajson, VerticalStatisticsCheck.id)
+
+
+def surface_consistency_checks(qajson: QajsonRoot) -> List[QajsonCheck]:
+    """
+    The surface consistency checks of a QAJSON document; see
+    :func:`find_checks`.
+    """
+    return find_checks(qajson, SurfaceConsistencyCheck.id)
+
+
+def _input_files(
+    check: QajsonCheck,
+) -> Tuple[List[Path], Optional[Path], Optional[str]]:
+    """
+    The input files of a QajsonCheck; all point cloud files (the soundings
+    of which are accumulated into the one grid) and the first grid file,
+    along with a description of the inputs that are missing (if any).
+    """
+    point_files = []
+    grid_file = None
+    for f in check.inputs.files:
+        if f.file_type == 'Point Cloud':
+            point_files.append(Path(f.path))
+        if grid_file is None and f.file_type == 'Survey DTMs':
+            grid_file = Path(f.path)
+
+    error = None
+    if not point_files:
+        error = "Missing input point data"
+    if grid_file is None:
+        error = "Missing input depth data"
+
+    return point_files, grid_file, error
+
+
+class CheckTask:
+    """
+    The inputs of a single check, as resolved from a QajsonCheck. `error`
+    describes inputs that are missing, in which case the check is aborted
+    rather than run.
+    """
+
+    def __init__(
+        self,
+        point_files: Sequence[Path],
+        grid_file: Optional[Path],
+        outdir: Optional[Path] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self.point_files = list(point_files)
+        self.grid_file = grid_file
+        self.outdir = outdir
+        self.error = error
+
+    @property
+    def input_size(self) -> int:
+        """Total size (bytes) of the input files, for scheduling."""
+        pathnames = [*self.point_files]
+        if self.grid_file is not None:
+            pathnames.append(self.grid_file)
+
+        return sum(p.stat().st_size for p in pathnames if p.exists())
+
+
+class DensityCheckTask(CheckTask):
+    """
+    The inputs and parameters of a single density check, as resolved from
+    a QajsonCheck.
+    """
+
+    def __init__(
+        self,
+        point_files: Sequence[Path],
+        grid_file: Optional[Path],
+        minimum_count: int,
+        minimum_count_percentage: float,
+        output_mode: str = "vector",
+        outdir: Optional[Path] = None,
+        spatial_outputs_qajson: bool = False,
+        error: Optional[str] = None,
+        engine: str = "pdal",
+    ) -> None:
+        super().__init__(point_files, grid_file, outdir, error)
+        self.minimum_count = minimum_count
+        self.minimum_count_percentage = minimum_count_percentage
+        self.output_mode = output_mode
+        self.spatial_outputs_qajson = spatial_outputs_qajson
+        # engine used to calculate the density grid; see DENSITY_ENGINES
+        self.engine = engine
+
+    @classmethod
+    def from_qajson(
+        cls,
+        check: QajsonCheck,
+        outdir: Optional[Path] = None,
+        spatial_outputs_qajson: bool = False,
+        engine: str = "pdal",
+    ):  # -> Self:
+        """
+        Resolve the input files and parameters of a QajsonCheck.
+
+        :param check: The density check
+        :type check: class:`QajsonCheck`
+        :param outdir: Directory to persist the spatial outputs within
+        :type outdir: class:`pathlib.Path` or None
+        :param spatial_outputs_qajson: Include the spatial outputs within
+            the QAJSON outputs
+        :type spatial_outputs_qajson: bool
+        :param engine: Engine used to calculate the density grid
+        :type engine: str
+        :return: The task
+        :rtype: class:`DensityCheckTask`
+        """
+        # get the parameter values the check needs to run
+        minimum_count = int(param_value(check, 'Minimum Soundings per node'))
+        minimum_count_percentage = float(
+            param_value(check, 'Minimum Soundings per node percentage')
+        )
+        # not defined in QAJSON files predating the parameter, in which
+        # case the low density nodes are vectorised
+        vectorise = param_value(check, 'Vectorise low density nodes')
+        output_mode = "raster" if vectorise is False else "vector"
+
+        # get the input files the check needs to run. In this case we get
+        # all point cloud files (the counts of which are accumulated into
+        # the one density grid) and the first grid file
+        point_files, grid_file, error = _input_files(check)
+
+        return cls(
+            point_files,
+            grid_file,
+            minimum_count,
+            minimum_count_percentage,
+            output_mode,
+            outdir,
+            spatial_outputs_qajson,
+            error,
+            engine,
+        )
+
+
+class TvuCheckTask(CheckTask):
+    """
+    The inputs and parameters of a single check evaluating the nodes
+    against a TVU budget, as resolved from a QajsonCheck.
+    """
+
+    def __init__(
+        self,
+        point_files: Sequence[Path],
+        grid_file: Optional[Path],
+        tvu_a: float,
+        tvu_b: float,
+        minimum_count: int,
+        minimum_percentage: float,
+        outdir: Optional[Path] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        super().__init__(point_files, grid_file, outdir, error)
+        self.tvu_a = tvu_a
+        self.tvu_b = tvu_b
+        self.minimum_count = minimum_count
+        self.minimum_percentage = minimum_percentage
+
+    @classmethod
+    def from_qajson(
+        cls, check: QajsonCheck, outdir: Optional[Path] = None
+    ):  # -> Self:
+        """
+        Resolve the input files and parameters of a QajsonCheck.
+
+        :param check: The check
+        :type check: class:`QajsonCheck`
+        :param outdir: Directory to persist the output grid within
+        :type outdir: class:`pathlib.Path` or None
+        :return: The task
+        :rtype: class:`TvuCheckTask`
+        """
+        point_files, grid_file, error = _input_files(check)
+
+        return cls(
+            point_files,
+            grid_file,
+            float(param_value(check, 'Constant TVU (a)')),
+            float(param_value(check, 'Depth dependent TVU (b)')),
+            int(param_value(check, 'Minimum Soundings per node')),
+            float(param_value(check, 'Minimum nodes within TVU percentage')),
+            outdir,
+            error,
+        )
+
+
+class VerticalStatisticsTask(TvuCheckTask):
+    """A vertical statistics check; see :class:`VerticalStatisticsCheck`."""
+
+    check_class = VerticalStatisticsCheck
+
+
+class SurfaceConsistencyTask(TvuCheckTask):
+    """A surface consistency check; see :class:`SurfaceConsistencyCheck`."""
+
+    check_class = SurfaceConsistencyCheck
+
+
+def qajson_tasks(
+    qajson: QajsonRoot,
+    outdir: Optional[Path] = None,
+    spatial_outputs_qajson: bool = False,
+    engine: str = "pdal",
+) -> Tuple[List[QajsonCheck], List[CheckTask]]:
+    """
+    The checks of a QAJSON document implemented by this tool, and the
+    tasks running them (in the same order).
+
+    :param qajson: The QAJSON document
+    :type qajson: class:`QajsonRoot`
+    :param outdir: Directory to persist the spatial outputs within
+    :type outdir: class:`pathlib.Path` or None
+    :param spatial_outputs_qajson: Include the spatial outputs of the
+        density checks within the QAJSON outputs
+    :type spatial_outputs_qajson: bool
+    :param engine: Engine used to calculate the density grids
+    :type engine: str
+    :return: A tuple of the QajsonChecks and their tasks
+    :rtype: tuple
+    """
+    checks: List[QajsonCheck] = []
+    tasks: List[CheckTask] = []
+    for check in density_checks(qajson):
+        checks.append(check)
+        tasks.append(
+            DensityCheckTask.from_qajson(
+                check, outdir, spatial_outputs_qajson, engine
+            )
+        )
+    for check in vertical_statistics_checks(qajson):
+        checks.append(check)
+        tasks.append(VerticalStatisticsTask.from_qajson(check, outdir))
+    for check in surface_consistency_checks(qajson):
+        checks.append(check)
+        tasks.append(SurfaceConsistencyTask.from_qajson(check, outdir))
+
+    return checks, tasks
+
+
+def worker_settings(
+    checks: Sequence[QajsonCheck],
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The number of worker processes and the memory budget (bytes) of each
+    worker, as set by the worker parameters of the checks (see
+    :mod:`workers`). The checks share the one pool of workers, so the
+    largest value set by any check is used; None where no check sets it.
+
+    :param checks: The checks being run
+    :type checks: list
+    :return: A tuple of the number of workers and the memory budget
+    :rtype: tuple
+    """
+    n_workers = max(
+        (int(param_value(check, WORKERS_PARAM) or 0) for check in checks),
+        default=0,
+    )
+    memory = max(
+        (int(param_value(check, WORKER_MEMORY_PARAM) or 0) for check in checks),
+        default=0,
+    )
+
+    return n_workers or None, memory * 2**20 or None
+
+
+def spatial_outputs(
+    grid_file: Path, gdf: geopandas.GeoDataFrame
+) -> Dict[str, Any]:
+    """
+    Geometries of the grid bounds and the low density regions for display
+    in the QAX map viewer.
+
+    :param grid_file: Pathname to the base grid file
+    :type grid_file: class:`pathlib.Path`
+    :param gdf: The low density regions, in the CRS of the grid
+    :type gdf: class:`geopandas.GeoDataFrame`
+    :return: A dict with the "map" (grid bounds) and "extents" (low
+        density regions) as GeoJSON-like MultiPolygon mappings
+    :rtype: dict
+    """
+    # the qax viewer isn't designed to be an all bells viewing solution
+    # nor replace tools like QGIS, TuiView ...
+    # the vector geoms need to be simplified, and all geoms transformed
+    # to epsg:4326
+    # other plugins use a buffer of 5 pixel widths and then simplify
+
+    with rasterio.open(grid_file) as ds:
+        # bounds derived from input raster
+        gdf_box = geopandas.GeoDataFrame(
+            {"geometry": [geometry.box(*ds.bounds)]},
+            crs=ds.crs,
+        ).to_crs(epsg=4326)
+
+        # buffering; assuming square-ish pixels ...
+        distance = 5*ds.res[0]  # used for buffering and simplifying
+
+    buffered = gdf.buffer(distance)
+
+    # false means use the "Douglas-Peucker algorithm"
+    simplified_geom = buffered.simplify(
+        distance, preserve_topology=False
+    )
+    warped_geom = simplified_geom.to_crs(epsg=4326)
+
+    # qax map viewer requires MultiPolygon geoms
+    mp_box_geoms = geometry.MultiPolygon(gdf_box.geometry.values)
+    mp_pix_geoms = geometry.MultiPolygon(
+        warped_geom.geometry.values,
+    )
+
+    return {
+        'map': geometry.mapping(mp_box_geoms),
+        'extents': geometry.mapping(mp_pix_geoms),
+    }
+
+
+def tile_size_for_budget(grid_file: Path, memory_budget: int) -> Optional[int]:
+    """
+    Tile size (cells) keeping the density calculation of a grid within a
+    memory budget, or None if the whole grid fits within the budget.
+    Tiles are a multiple of the 256 block size, with two tiles in flight.
+
+    :param grid_file: Pathname to the base grid file
+    :type grid_file: class:`pathlib.Path`
+    :param memory_budget: Memory budget (bytes)
+    :type memory_budget: int
+    :return: The tile size, or None
+    :rtype: int or None
+    """
+    with rasterio.open(str(grid_file)) as src:
+        cells = src.width * src.height
+
+    if cells * BYTES_PER_CELL <= memory_budget:
+        return None
+
+    side = int(math.sqrt(memory_budget / (2 * BYTES_PER_CELL)))
+
+    return max(256, side // 256 * 256)
+
+
+def _aborted_outputs(error: str, start: Optional[str] = None) -> QajsonOutputs:
+    """Outputs of a check that didn't run to completion."""
+    outputs = QajsonOutputs()
+    outputs.execution = QajsonExecution(
+        start=start or _timestamp(),
+        end=_timestamp(),
+        status='aborted',
+        error=error,
+    )
+
+    return outputs
+
+
+def run_density_check(
+    task: DensityCheckTask,
+    progress_callback: Optional[ProgressCallback] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+    memory_budget: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> QajsonOutputs:
+    """
+    Run a density check, returning its QAJSON outputs. Errors are recorded
+    within the outputs rather than raised.
+
+    :param task: The check to run
+    :type task: class:`DensityCheckTask`
+    :param progress_callback: Called with the progress of the check
+    :type progress_callback: callable or None
+    :param is_stopped: Callable returning True once the check is to stop
+    :type is_stopped: callable or None
+    :param memory_budget: If defined, grids exceeding the budget (bytes)
+        are calculated one tile at a time
+    :type memory_budget: int or None
+    :param threads: Number of threads processing the blocks of the
+        density grid. Default is the CPU count
+    :type threads: int or None
+    :return: The outputs of the check
+    :rtype: class:`QajsonOutputs`
+    """
+    start_time = _timestamp()
+    if task.error is not None:
+        LOG.info(task.error)
+        LOG.info("Aborting Algorithm Independent Density Check")
+        return _aborted_outputs(task.error, start_time)
+
+    output_details = QajsonOutputs()
+    execution_details = QajsonExecution(
+        start=start_time,
+        end=None,
+        status='running',
+        error=None
+    )
+    output_details.execution = execution_details
+
+    try:
+        tile_size = None
+        if memory_budget is not None:
+            tile_size = tile_size_for_budget(task.grid_file, memory_budget)
+
+        density_check = AlgorithmIndependentDensityCheck(
+            grid_file=task.grid_file,
+            point_cloud_file=task.point_files,
+            minimum_count=task.minimum_count,
+            minimum_count_percentage=task.minimum_count_percentage,
+            outdir=task.outdir,
+            # the polygons are only needed in memory for the qajson outputs
+            return_gdf=task.spatial_outputs_qajson,
+            output_mode=task.output_mode,
+            engine=task.engine,
+            # tiles are calculated one at a time to stay within the budget
+            tile_size=tile_size,
+            processes=None if tile_size is None else 1,
+            threads=threads,
+            progress_callback=progress_callback,
+            is_stopped=is_stopped,
+        )
+
+        # now run the check
+        density_check.run()
+
+        execution_details.status = 'completed'
+    except CheckCancelled as ex:
+        # stopped by the user, the temporary files are already removed
+        LOG.info(str(ex))
+        execution_details.status = 'aborted'
+        execution_details.error = str(ex)
+    except Exception:
+        execution_details.status = 'failed'
+        execution_details.error = traceback.format_exc()
+    finally:
+        execution_details.end = _timestamp()
+
+    if execution_details.status != 'completed':
+        # no need to populate results as there are none
+        return output_details
+
+    _density_outputs(task, density_check, output_details)
+
+    return output_details
+
+
+def _density_outputs(
+    task: DensityCheckTask,
+    density_check: AlgorithmIndependentDensityCheck,
+    output_details: QajsonOutputs,
+) -> None:
+    """Add the results of a completed density check to its QAJSON outputs."""
+    # now add the result data to the qajson output details so that it's
+    # captured and presented to the user
+    if density_check.passed:
+        output_details.check_state = 'pass'
+    else:
+        output_details.check_state = 'fail'
+
+    output_details.messages = [
+        f'{density_check.percentage_passed:.1f}% of nodes were found to have a '
+        f'sounding count above {task.minimum_count}. This is required to'
+        f' be {task.minimum_count_percentage}% of all nodes'
+    ]
+
+    # use the data dict to stash some misc information generated by the check
+    data = {}
+    # need to convert the density values from ints to strings to support
+    # json serialisation; densities beyond the histogram's cap are labelled
+    # by the range of their (log2 spaced) bin
+    str_key_counts = [
+        (bin_label(d, density_check.histogram_tail), c)
+        for d, c in density_check.histogram
+    ]
+    data['chart'] = {
+        'type': 'histogram',
+        'data': str_key_counts
+    }
+
+    data['summary'] = {
+        'total_soundings': density_check.total_nodes,
+        'check_passed': density_check.passed,
+        'percentage_over_threshold': density_check.percentage_passed,
+        'under_threshold_soundings': density_check.percentage_failed,
+        'failed_nodes': density_check.failed_nodes,
+        'low_density_regions': density_check.low_density_regions,
+    }
+
+    if task.spatial_outputs_qajson and density_check.gdf is not None:
+        with density_check.profiler.stage("spatial_outputs") as timing:
+            data.update(spatial_outputs(task.grid_file, density_check.gdf))
+            timing.add_items(len(density_check.gdf), "features")
+
+    # per stage timing and memory use, to diagnose slow checks
+    data['performance'] = density_check.profiler.to_dict()
+
+    output_details.data = data
+
+
+def _vertical_statistics_data(check: VerticalStatisticsCheck) -> Dict[str, Any]:
+    """Summary of a vertical statistics check for the QAJSON outputs."""
+    return {
+        'total_nodes': check.total_nodes,
+        'evaluated_nodes': check.evaluated_nodes,
+        'check_passed': check.passed,
+        'percentage_within_tvu': check.percentage_passed,
+        'percentage_beyond_tvu': check.percentage_failed,
+        'failed_nodes': check.failed_nodes,
+        'max_std': check.max_std,
+        'max_range': check.max_range,
+    }
+
+
+def _surface_consistency_data(check: SurfaceConsistencyCheck) -> Dict[str, Any]:
+    """Summary of a surface consistency check for the QAJSON outputs."""
+    return {
+        'total_nodes': check.total_nodes,
+        'evaluated_nodes': check.evaluated_nodes,
+        'check_passed': check.passed,
+        'percentage_within_tvu': check.percentage_passed,
+        'percentage_beyond_tvu': check.percentage_failed,
+        'failed_nodes': check.failed_nodes,
+        'mean_difference': check.mean_difference,
+        'rms_difference': check.rms_difference,
+        'max_abs_difference': check.max_abs_difference,
+        'soundings': check.soundings,
+        'mean_residual': check.mean_residual,
+        'rms_residual': check.rms_residual,
+    }
+
+
+def run_tvu_check(
+    task: TvuCheckTask,
+    progress_callback: Optional[ProgressCallback] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+    threads: Optional[int] = None,
+) -> QajsonOutputs:
+    """
+    Run a check evaluating the nodes against a TVU budget (a vertical
+    statistics or surface consistency check), returning its QAJSON outputs.
+    Errors are recorded within the outputs rather than raised.
+
+    :param task: The check to run
+    :type task: class:`TvuCheckTask`
+    :param progress_callback: Called with the progress of the check
+    :type progress_callback: callable or None
+    :param is_stopped: Callable returning True once the check is to stop
+    :type is_stopped: callable or None
+    :param threads: Number of threads reading the point files and the
+        blocks of the grid. Default is the CPU count
+    :type threads: int or None
+    :return: The outputs of the check
+    :rtype: class:`QajsonOutputs`
+    """
+    start_time = _timestamp()
+    if task.error is not None:
+        LOG.info(task.error)
+        LOG.info(f"Aborting {task.check_class.name}")
+        return _aborted_outputs(task.error, start_time)
+
+    output_details = QajsonOutputs()
+    execution_details = QajsonExecution(
+        start=start_time,
+        end=None,
+        status='running',
+        error=None
+    )
+    output_details.execution = execution_details
+
+    try:
+        check = task.check_class(
+            point_cloud_file=task.point_files,
+            grid_file=task.grid_file,
+            tvu_a=task.tvu_a,
+            tvu_b=task.tvu_b,
+            minimum_count=task.minimum_count,
+            minimum_percentage=task.minimum_percentage,
+            outdir=task.outdir,
+            threads=threads,
+            progress_callback=progress_callback,
+            is_stopped=is_stopped,
+        )
+        check.run()
+
+        execution_details.status = 'completed'
+    except CheckCancelled as ex:
+        LOG.info(str(ex))
+        execution_details.status = 'aborted'
+        execution_details.error = str(ex)
+    except Exception:
+        execution_details.status = 'failed'
+        execution_details.error = traceback.format_exc()
+    finally:
+        execution_details.end = _timestamp()
+
+    if execution_details.status != 'completed':
+        return output_details
+
+    _tvu_outputs(task, check, output_details)
+
+    return output_details
+
+
+def _tvu_outputs(
+    task: TvuCheckTask, check, output_details: QajsonOutputs
+) -> None:
+    """Add the results of a completed TVU check to its QAJSON outputs."""
+    output_details.check_state = 'pass' if check.passed else 'fail'
+    if check.evaluated_nodes:
+        output_details.messages = [
+            f'{check.percentage_passed:.1f}% of the nodes with at least '
+            f'{task.minimum_count} soundings were found to be within the TVU '
+            f'(a={task.tvu_a}, b={task.tvu_b}). This is required to exceed '
+            f'{task.minimum_percentage}% of the evaluated nodes'
+        ]
+    else:
+        output_details.messages = [
+            f'No nodes were evaluated; none of the {check.total_nodes} nodes '
+            f'of the grid held at least {task.minimum_count} soundings. '
+            f'Check that the point files overlap the grid, and share its CRS'
+        ]
+
+    if isinstance(check, SurfaceConsistencyCheck):
+        summary = _surface_consistency_data(check)
+    else:
+        summary = _vertical_statistics_data(check)
+
+    # ratio of the spread of the soundings (or their difference to the
+    # surface) to the TVU
+    str_key_counts = [(f'{edge:.1f}', c) for edge, c in check.histogram]
+    output_details.data = {
+        'chart': {
+            'type': 'histogram',
+            'data': str_key_counts
+        },
+        'summary': summary,
+        'performance': check.profiler.to_dict(),
+    }
+
+
+def run_check(
+    task: CheckTask,
+    progress_callback: Optional[ProgressCallback] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+    memory_budget: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> QajsonOutputs:
+    """
+    Run the check of a task, returning its QAJSON outputs; see
+    :func:`run_density_check` and :func:`run_tvu_check`.
+    The memory budget only applies to density checks.
+    """
+    if isinstance(task, TvuCheckTask):
+        return run_tvu_check(task, progress_callback, is_stopped, threads)
+
+    return run_density_check(
+        task, progress_callback, is_stopped, memory_budget, threads
+    )
+
+
+def shared_tasks(tasks: Sequence[CheckTask]) -> Dict[int, int]:
+    """
+    The vertical statistics tasks sharing the point files and grid file of
+    a density task, which are run from the one pass of the point files
+    along with the density task (see :func:`run_shared_checks`). Only
+    density tasks using the numpy engine share their pass, as the shared
+    pass bins the points as the numpy engine does, and each shares it with
+    at most one vertical statistics task.
+
+    :param tasks: The checks to run
+    :type tasks: list
+    :return: The index of each density task sharing its pass, mapped to
+        the index of the vertical statistics task
+    :rtype: dict
+    """
+    shared: Dict[int, int] = {}
+    for index, task in enumerate(tasks):
+        if (
+            not isinstance(task, DensityCheckTask)
+            or task.error is not None
+            or task.engine != "numpy"
+        ):
+            continue
+
+        for other_index, other in enumerate(tasks):
+            if (
+                isinstance(other, VerticalStatisticsTask)
+                and other.error is None
+                and other_index not in shared.values()
+                and other.grid_file == task.grid_file
+                and other.point_files == task.point_files
+            ):
+                shared[index] = other_index
+                break
+
+    return shared
+
+
+def run_shared_checks(
+    density_task: DensityCheckTask,
+    vertical_task: VerticalStatisticsTask,
+    progress_callback: Optional[ProgressCallback] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+    memory_budget: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> Tuple[QajsonOutputs, QajsonOutputs]:
+    """
+    Run a density check and the vertical statistics check sharing its
+    inputs from a single pass of the point files (see
+    :func:`vertical_statistics.density_statistics`), returning the QAJSON
+    outputs of each. Errors are recorded within both outputs.
+    The shared pass isn't tiled, so when the grid exceeds the memory
+    budget the checks are run one after the other instead.
+
+    :param density_task: The density check to run
+    :type density_task: class:`DensityCheckTask`
+    :param vertical_task: The vertical statistics check to run
+    :type vertical_task: class:`VerticalStatisticsTask`
+    :param progress_callback: Called with the progress of both checks
+    :type progress_callback: callable or None
+    :param is_stopped: Callable returning True once the checks are to stop
+    :type is_stopped: callable or None
+    :param memory_budget: If defined, grids exceeding the budget (bytes)
+        are calculated one tile at a time
+    :type memory_budget: int or None
+    :param threads: Number of threads reading the point files and the
+        blocks of the grids. Default is the CPU count
+    :type threads: int or None
+    :return: A tuple of the density and vertical statistics outputs
+    :rtype: tuple
+    """
+    if memory_budget is not None and tile_size_for_budget(
+        density_task.grid_file, memory_budget
+    ) is not None:
+        LOG.info("Grid exceeds the memory budget, running the checks in turn")
+
+        # each check reports half of the progress
+        def on_progress(event: ProgressEvent, offset: float = 0.0) -> None:
+            if progress_callback is not None:
+                fraction = (offset + event.fraction) / 2
+                progress_callback(event._replace(fraction=fraction))
+
+        return (
+            run_density_check(
+                density_task, on_progress, is_stopped, memory_budget, threads
+            ),
+            run_tvu_check(
+                vertical_task,
+                lambda event: on_progress(event, 1.0),
+                is_stopped,
+                threads,
+            ),
+        )
+
+    start_time = _timestamp()
+    density_details = QajsonOutputs()
+    execution_details = QajsonExecution(
+        start=start_time,
+        end=None,
+        status='running',
+        error=None
+    )
+
+    try:
+        vertical_check = VerticalStatisticsCheck(
+            point_cloud_file=vertical_task.point_files,
+            grid_file=vertical_task.grid_file,
+            tvu_a=vertical_task.tvu_a,
+            tvu_b=vertical_task.tvu_b,
+            minimum_count=vertical_task.minimum_count,
+            minimum_percentage=vertical_task.minimum_percentage,
+            outdir=vertical_task.outdir,
+        )
+        density_check = AlgorithmIndependentDensityCheck(
+            grid_file=density_task.grid_file,
+            point_cloud_file=density_task.point_files,
+            minimum_count=density_task.minimum_count,
+            minimum_count_percentage=density_task.minimum_count_percentage,
+            outdir=density_task.outdir,
+            return_gdf=density_task.spatial_outputs_qajson,
+            output_mode=density_task.output_mode,
+            engine=density_task.engine,
+            threads=threads,
+            progress_callback=progress_callback,
+            is_stopped=is_stopped,
+            vertical_check=vertical_check,
+        )
+        density_check.run()
+
+        execution_details.status = 'completed'
+    except CheckCancelled as ex:
+        LOG.info(str(ex))
+        execution_details.status = 'aborted'
+        execution_details.error = str(ex)
+    except Exception:
+        execution_details.status = 'failed'
+        execution_details.error = traceback.format_exc()
+    finally:
+        execution_details.end = _timestamp()
+
+    # both checks share the one execution
+    vertical_details = QajsonOutputs()
+    density_details.execution = execution_details
+    vertical_details.execution = QajsonExecution(
+        start=execution_details.start,
+        end=execution_details.end,
+        status=execution_details.status,
+        error=execution_details.error,
+    )
+
+    if execution_details.status == 'completed':
+        _density_outputs(density_task, density_check, density_details)
+        _tvu_outputs(vertical_task, vertical_check, vertical_details)
+
+    return density_details, vertical_details
+
+
+def run_tasks(
+    tasks: Sequence[CheckTask],
+    progress_callback: Optional[ProgressCallback] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+    memory_budget: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> List[QajsonOutputs]:
+    """
+    Run a single task, or a density task along with the vertical
+    statistics task sharing its pass of the point files (see
+    :func:`shared_tasks`), returning the outputs of each task in order.
+    """
+    if len(tasks) == 1:
+        return [
+            run_check(
+                tasks[0], progress_callback, is_stopped, memory_budget, threads
+            )
+        ]
+
+    density_task, vertical_task = tasks
+
+    return list(
+        run_shared_checks(
+            density_task,  # type: ignore[arg-type]
+            vertical_task,  # type: ignore[arg-type]
+            progress_callback,
+            is_stopped,
+            memory_budget,
+            threads,
+        )
+    )
+
+
+def _run_in_worker(
+    indices: Sequence[int],
+    tasks: Sequence[CheckTask],
+    memory_budget: Optional[int],
+    threads: Optional[int],
+    stop_event,
+    fractions,
+) -> List[Dict[str, Any]]:
+    """
+    Run a task (or the tasks sharing a pass of the point files) within a
+    worker process. Progress and the request to stop are shared with the
+    parent process via a manager.
+    """
+
+    def on_progress(event: ProgressEvent) -> None:
+        for index in indices:
+            fractions[index] = event.fraction
+
+    outputs = run_tasks(
+        tasks, on_progress, stop_event.is_set, memory_budget, threads
+    )
+
+    return [output.to_dict() for output in outputs]
+
+
+def schedule(tasks: Sequence[CheckTask]) -> List[int]:
+    """
+    Order in which to start the tasks; largest inputs first, so the
+    longest running checks don't start last and leave the other workers
+    idle whilst they complete.
+
+    :param tasks: The checks to run
+    :type tasks: list
+    :return: The indices of the tasks, in the order to start them
+    :rtype: list
+    """
+    sizes = [task.input_size for task in tasks]
+
+    return sorted(range(len(tasks)), key=lambda index: -sizes[index])
+
+
+def run_checks(
+    tasks: Sequence[CheckTask],
+    workers: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+    on_complete: Optional[CompletionCallback] = None,
+    progress_callback: Optional[Callable[[float], None]] = None,
+    is_stopped: Optional[Callable[[], bool]] = None,
+) -> List[QajsonOutputs]:
+    """
+    Run several checks concurrently, each within one of a pool of
+    `workers` processes. The threads of each worker are limited to its
+    share of the CPUs. Tasks are started largest inputs first (see
+    :func:`schedule`). A vertical statistics task sharing the inputs of a
+    density task runs along with it, from the one pass of the point files
+    (see :func:`shared_tasks`).
+
+    :param tasks: The checks to run
+    :type tasks: list
+    :param workers: Number of worker processes. Default is the CPU count.
+        A single worker (or task) runs within this process
+    :type workers: int or None
+    :param memory_budget: Memory budget (bytes) of each worker, beyond
+        which density grids are calculated one tile at a time
+    :type memory_budget: int or None
+    :param on_complete: Called with the task index and its outputs as
+        each check completes
+    :type on_complete: callable or None
+    :param progress_callback: Called with the fraction (0 to 1) of all
+        the checks complete
+    :type progress_callback: callable or None
+    :param is_stopped: Callable returning True once the checks are to stop
+    :type is_stopped: callable or None
+    :return: The outputs of each task, in the order of `tasks`
+    :rtype: list
+    """
+    results: List[Optional[QajsonOutputs]] = [None] * len(tasks)
+    shared = shared_tasks(tasks)
+    # the indices of the tasks run together, in the order to start them
+    groups = [
+        [index] if index not in shared else [index, shared[index]]
+        for index in schedule(tasks)
+        if index not in shared.values()
+    ]
+    workers = min(workers or os.cpu_count() or 1, max(len(groups), 1))
+
+    def complete(index: int, outputs: QajsonOutputs) -> None:
+        results[index] = outputs
+        if on_complete is not None:
+            on_complete(index, outputs)
+
+    if workers == 1:
+        done_tasks = 0
+        for group in groups:
+            if is_stopped is not None and is_stopped():
+                for index in group:
+                    complete(index, _aborted_outputs("Check was stopped"))
+                done_tasks += len(group)
+                continue
+
+            # the progress of each check is reported as a fraction of
+            # all the checks
+            def on_progress(
+                event: ProgressEvent, done=done_tasks, size=len(group)
+            ) -> None:
+                if progress_callback is not None:
+                    progress_callback(
+                        (done + size * event.fraction) / len(tasks)
+                    )
+
+            outputs = run_tasks(
+                [tasks[index] for index in group],
+                on_progress,
+                is_stopped,
+                memory_budget,
+            )
+            for index, output in zip(group, outputs):
+                complete(index, output)
+            done_tasks += len(group)
+            if progress_callback is not None:
+                progress_callback(done_tasks / len(tasks))
+
+        return results  # type: ignore[return-value]
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")
+    LOG.info(f"Running {len(tasks)} checks using {workers} workers")
+
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers, mp_context=context
+    ) as executor:
+        stop_event = manager.Event()
+        fractions = manager.dict()
+        futures = {
+            executor.submit(
+                _run_in_worker,
+                group,
+                [tasks[index] for index in group],
+                memory_budget,
+                threads,
+                stop_event,
+                fractions,
+            ): group
+            for group in groups
+        }
+        pending = set(futures)
+
+        while pending:
+            done, pending = wait(
+                pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED
+            )
+
+            if is_stopped is not None and is_stopped() and not stop_event.is_set():
+                LOG.info("Stopping the running checks")
+                stop_event.set()
+                for future in pending:
+                    future.cancel()
+
+            for future in done:
+                group = futures[future]
+                for position, index in enumerate(group):
+                    fractions[index] = 1.0
+                    if future.cancelled():
+                        outputs = _aborted_outputs("Check was stopped")
+                    elif future.exception() is not None:
+                        # e.g. the worker was killed for exhausting the
+                        # memory
+                        error = f"Worker failed: {future.exception()!r}"
+                        outputs = _aborted_outputs(error)
+                        outputs.execution.status = 'failed'
+                    else:
+                        outputs = QajsonOutputs.from_dict(
+                            future.result()[position]
+                        )
+                    complete(index, outputs)
+
+            if progress_callback is not None:
+                done_fraction = sum(fractions.values())
+                progress_callback(done_fraction / len(tasks))
+
+    return results  # type: ignore[return-value]
@@ -0,0 +1,125 @@
+"""
+Storage plan for the density grid.
+The density grid is encoded once, directly at its final destination:
+    * the output directory, when the outputs are to persist
+    * the cache entry, when a cache directory is defined
+    * memory, for small grids that aren't persisted
+    * a temporary file using a fast compression preset otherwise
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Optional
+import logging
+import os
+import shutil
+
+import rasterio  # type: ignore[import]
+from rasterio.io import MemoryFile  # type: ignore[import]
+
+from ausseabed.mbespc.lib import utils
+
+LOG = logging.getLogger(__name__)
+
+# grids with at most this number of cells (256 MiB of int32) are kept in
+# memory when they aren't persisted
+MAX_IN_MEMORY_CELLS = 2**26
+
+# creation options for density grids held in memory; compression would
+# only cost time
+MEMORY_GTIFF_OPTIONS = {
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+}
+
+# creation options for temporary density grids; fast rather than small
+TEMP_GTIFF_OPTIONS = {
+    "compress": "zstd",
+    "zstd_level": 1,
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+    "predictor": 2,
+}
+
+
+class DensityStore:
+    """
+    Destination of the density grid, and the creation options to encode
+    it with. In-memory grids are released on close.
+    """
+
+    def __init__(
+        self,
+        pathname: Path,
+        creation_options: Dict[str, Any],
+        memfile: Optional[MemoryFile] = None,
+    ) -> None:
+        self.pathname = pathname
+        self.creation_options = creation_options
+        self._memfile = memfile
+
+    @property
+    def in_memory(self) -> bool:
+        return self._memfile is not None
+
+    def close(self) -> None:
+        """Release the in-memory grid, if any."""
+        if self._memfile is not None:
+            self._memfile.close()
+            self._memfile = None
+
+    def __enter__(self) -> "DensityStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def plan(
+    grid_dataset_pathname: Path,
+    tmpdir: Path,
+    destination: Optional[Path] = None,
+    max_in_memory_cells: int = MAX_IN_MEMORY_CELLS,
+) -> DensityStore:
+    """
+    Decide where the density grid is written.
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param tmpdir: Directory for temporary grids
+    :type tmpdir: class:`pathlib.Path`
+    :param destination: Final (persisted) pathname of the density grid,
+        or None if the grid isn't persisted
+    :type destination: class:`pathlib.Path` or None
+    :param max_in_memory_cells: Largest grid kept in memory
+    :type max_in_memory_cells: int
+    :return: The density store
+    :rtype: class:`DensityStore`
+    """
+    if destination is not None:
+        return DensityStore(destination, utils.DENSITY_GTIFF_OPTIONS)
+
+    with rasterio.open(str(grid_dataset_pathname)) as src:
+        cells = src.width * src.height
+
+    if cells <= max_in_memory_cells:
+        memfile = MemoryFile(filename="density.tif")
+        LOG.info(f"Holding density grid in memory: {memfile.name}")
+        return DensityStore(Path(memfile.name), MEMORY_GTIFF_OPTIONS, memfile)
+
+    return DensityStore(Path(tmpdir).joinpath("density.tif"), TEMP_GTIFF_OPTIONS)
+
+
+def link_or_copy(src_pathname: Path, dst_pathname: Path) -> None:
+    """
+    Hard link a file to a new location, copying it if the two locations
+    don't share a filesystem. Either way, the grid isn't re-encoded.
+    """
+    if dst_pathname.exists():
+        dst_pathname.unlink()
+
+    try:
+        os.link(src_pathname, dst_pathname)
+    except OSError:
+        shutil.copy(src_pathname, dst_pathname)
@@ -0,0 +1,90 @@
+"""
+Surface consistency check; the difference of the base grid's surface to
+the mean of the soundings of each node, against the total vertical
+uncertainty (TVU) of the node's depth
+"""
+
+from typing import Optional
+import logging
+
+from ausseabed.qajson.model import QajsonParam
+from ausseabed.mbespc.lib import surface_consistency, tvu_check, workers
+
+LOG = logging.getLogger(__name__)
+
+# relative weights of the stages reported to the progress callback
+PROGRESS_WEIGHTS = {
+    "points": 6.0,
+    "surface": 2.0,
+}
+
+
+class SurfaceConsistencyCheck(tvu_check.TvuCheck):
+    # details used by the QAX plugin
+    id = "d20be80a-8717-4b63-a49b-6e4454acbb97"
+    name = "Surface Consistency Check"
+    version = "1"
+    input_params = [
+        # IHO S-44 Order 1a
+        QajsonParam("Constant TVU (a)", 0.5),
+        QajsonParam("Depth dependent TVU (b)", 0.013),
+        QajsonParam("Minimum Soundings per node", 1),
+        QajsonParam("Minimum nodes within TVU percentage", 95.0),
+        *workers.input_params(),
+    ]
+
+    progress_weights = PROGRESS_WEIGHTS
+    least_minimum_count = 1
+    default_minimum_count = 1
+    # the differences; mean of the soundings less the surface
+    output_filename = "surface-difference.tif"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+        # mean (bias), root mean square and maximum absolute difference of
+        # the evaluated nodes
+        self.mean_difference: Optional[float] = None
+        self.rms_difference: Optional[float] = None
+        self.max_abs_difference: Optional[float] = None
+        # number, mean and root mean square of the residuals of all
+        # soundings joined to the surface
+        self.soundings: Optional[int] = None
+        self.mean_residual: Optional[float] = None
+        self.rms_residual: Optional[float] = None
+
+    def _evaluate(self) -> None:
+        """
+        The residuals of the soundings to the surface of the grid file are
+        accumulated in a single pass of the point cloud files, and the
+        nodes with at least the minimum count are evaluated against the TVU
+        of their surface depth.
+        """
+        summary, points = surface_consistency.surface_consistency(
+            self.grid_file,
+            self.point_cloud_files,
+            self.output_pathname(),
+            self.tvu_a,
+            self.tvu_b,
+            self.minimum_count,
+            threads=self.threads,
+            profiler=self.profiler,
+            progress=self.progress,
+        )
+
+        self.summarise(summary)
+        self.soundings = points.count
+        self.mean_residual = points.mean
+        self.rms_residual = points.rms
+
+    def summarise(self, summary: surface_consistency.SurfaceSummary) -> None:
+        """
+        Populate the results of the check from the evaluation of the nodes.
+
+        :param summary: The evaluation of the nodes
+        :type summary: class:`surface_consistency.SurfaceSummary`
+        """
+        super().summarise(summary)
+        self.mean_difference = summary.mean_difference
+        self.rms_difference = summary.rms_difference
+        self.max_abs_difference = summary.max_abs_difference
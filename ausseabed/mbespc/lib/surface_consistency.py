@@ -0,0 +1,599 @@
+"""
+Consistency of the base grid's surface with the soundings, using NumPy and
+laspy.
+Each chunk of points is joined to the cells of the base grid using index
+arithmetic against the blocks of the grid its cells touch, keeping the most
+recently used blocks for the following chunks (survey lines are spatially
+coherent), giving the residual of each sounding to the surface. Only the count and sum of the residuals of each cell are kept, so
+memory is bounded by the size of the grid (memory mapped when large) rather
+than the number of points. The difference of each cell is the mean of its
+soundings less the surface value, and is evaluated against the total
+vertical uncertainty (TVU) of the surface's depth.
+Soundings and the surface are assumed to share the vertical datum and sign
+convention.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+import logging
+import math
+import os
+import tempfile
+import threading
+
+import numpy
+import rasterio  # type: ignore[import]
+from rasterio.windows import Window  # type: ignore[import]
+
+from ausseabed.mbespc.lib import blocks, numpy_density, profiling, utils
+from ausseabed.mbespc.lib.progress import Progress, StageProgress
+from ausseabed.mbespc.lib.tiling import tile_windows
+from ausseabed.mbespc.lib.vertical_statistics import (
+    RATIO_EDGES,
+    total_vertical_uncertainty,
+)
+
+LOG = logging.getLogger(__name__)
+
+# residual grids larger than this (number of cells) are backed by memory
+# mapped files rather than held in memory; each cell takes 12 bytes
+MAX_IN_MEMORY_CELLS = 2**26
+
+# the base grid is read in square blocks of this many rows and columns to
+# join the soundings, keeping the most recently used blocks; 16 blocks of
+# float64 values take 8 MiB
+BLOCK_SIZE = 256
+MAX_CACHED_BLOCKS = 16
+
+# differences can take any finite value, so cells without soundings are NaN
+NODATA = numpy.nan
+DTYPE = "float32"
+
+SURFACE_GTIFF_OPTIONS = {
+    "compress": "deflate",
+    "zlevel": 6,
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+    "predictor": 3,
+}
+
+
+class SurfaceBlocks:
+    """
+    Surface values of the base grid, read in square blocks of `block_size`
+    cells as the cells being looked up touch them. The most recently used
+    `max_blocks` blocks are kept, so consecutive chunks of a survey line
+    rarely read a block again. No-data cells are NaN.
+    """
+
+    def __init__(
+        self,
+        dataset: rasterio.DatasetReader,
+        block_size: int = BLOCK_SIZE,
+        max_blocks: int = MAX_CACHED_BLOCKS,
+    ) -> None:
+        self.dataset = dataset
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.block_cols = -(-dataset.width // block_size)
+        self.blocks: "OrderedDict[int, numpy.ndarray]" = OrderedDict()
+        # number of blocks read from the base grid
+        self.reads = 0
+
+    def _block(self, block_id: int) -> numpy.ndarray:
+        data = self.blocks.get(block_id)
+        if data is not None:
+            self.blocks.move_to_end(block_id)
+            return data
+
+        block_row, block_col = divmod(block_id, self.block_cols)
+        row_off = block_row * self.block_size
+        col_off = block_col * self.block_size
+        window = Window(
+            col_off,
+            row_off,
+            min(self.block_size, self.dataset.width - col_off),
+            min(self.block_size, self.dataset.height - row_off),
+        )
+        raw = self.dataset.read(1, window=window)
+        valid = utils.mask_finite(raw, self.dataset.nodata)
+        data = numpy.where(valid, raw, numpy.nan).astype("float64")
+        self.reads += 1
+
+        self.blocks[block_id] = data
+        if len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+
+        return data
+
+    def lookup(self, row: numpy.ndarray, col: numpy.ndarray) -> numpy.ndarray:
+        """
+        The surface values of the base grid at the given cells, grouped by
+        the blocks they fall within so each block is read at most once.
+
+        :param row: Row index of each cell
+        :type row: class:`numpy.ndarray`
+        :param col: Column index of each cell
+        :type col: class:`numpy.ndarray`
+        :return: The surface value of each cell
+        :rtype: class:`numpy.ndarray`
+        """
+        values = numpy.full(row.size, numpy.nan)
+        if row.size == 0:
+            return values
+
+        block_id = (row // self.block_size) * self.block_cols + (
+            col // self.block_size
+        )
+        order = numpy.argsort(block_id, kind="stable")
+        block_ids, starts = numpy.unique(block_id[order], return_index=True)
+        ends = numpy.append(starts[1:], order.size)
+        for bid, start, end in zip(block_ids.tolist(), starts, ends):
+            selected = order[start:end]
+            block_row, block_col = divmod(bid, self.block_cols)
+            values[selected] = self._block(bid)[
+                row[selected] - block_row * self.block_size,
+                col[selected] - block_col * self.block_size,
+            ]
+
+        return values
+
+
+class PointResiduals:
+    """
+    Moments of the residuals of all soundings joined to a valid
+    cell of the surface. Residuals are small relative to depths, so their
+    sum of squares is accumulated directly.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.max_abs = 0.0
+
+    def update(self, residuals: numpy.ndarray) -> None:
+        """Account for the residuals of a chunk of soundings."""
+        if residuals.size == 0:
+            return
+
+        self.count += int(residuals.size)
+        self.total += float(residuals.sum())
+        self.total_squares += float(numpy.square(residuals).sum())
+        self.max_abs = max(self.max_abs, float(numpy.abs(residuals).max()))
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    @property
+    def rms(self) -> Optional[float]:
+        return math.sqrt(self.total_squares / self.count) if self.count else None
+
+
+class CellResiduals:
+    """
+    Per cell count and sum of the residuals of the soundings to the
+    surface. Grids larger than `MAX_IN_MEMORY_CELLS` are backed by memory
+    mapped files within `tmpdir`.
+    """
+
+    def __init__(
+        self, height: int, width: int, tmpdir: Optional[Path] = None
+    ) -> None:
+        self.shape = (height, width)
+        cells = height * width
+        if cells > MAX_IN_MEMORY_CELLS and tmpdir is not None:
+            LOG.info(f"Using memory mapped residual grids: {tmpdir}")
+            self.count = numpy.memmap(
+                Path(tmpdir).joinpath("count.dat"),
+                dtype="int32",
+                mode="w+",
+                shape=(cells,),
+            )
+            self.total = numpy.memmap(
+                Path(tmpdir).joinpath("total.dat"),
+                dtype="float64",
+                mode="w+",
+                shape=(cells,),
+            )
+        else:
+            self.count = numpy.zeros(cells, dtype="int32")
+            self.total = numpy.zeros(cells, dtype="float64")
+        self.points = PointResiduals()
+
+    def update(self, index: numpy.ndarray, residuals: numpy.ndarray) -> None:
+        """
+        Add the residuals of a chunk of soundings to their cells in place.
+        As per :func:`numpy_density.accumulate`, bincount is used over the
+        span of the indices unless the span is too sparse.
+
+        :param index: Flat cell index for each sounding
+        :type index: class:`numpy.ndarray`
+        :param residuals: Residual of each sounding to the surface
+        :type residuals: class:`numpy.ndarray`
+        """
+        self.points.update(residuals)
+        if index.size == 0:
+            return
+
+        start = int(index.min())
+        span = int(index.max()) - start + 1
+
+        if span <= 4 * index.size:
+            cells = slice(start, start + span)
+            count = numpy.bincount(index - start, minlength=span)
+            total = numpy.bincount(index - start, residuals, minlength=span)
+        else:
+            cells, inverse, count = numpy.unique(
+                index, return_inverse=True, return_counts=True
+            )
+            total = numpy.bincount(inverse, residuals, minlength=cells.size)
+
+        self.count[cells] += count.astype("int32", copy=False)
+        self.total[cells] += total
+
+    def read(self, rows: slice, cols: slice) -> Dict[str, numpy.ndarray]:
+        """
+        The count of the soundings, and the mean of their residuals (NaN
+        without soundings), of a window of cells.
+        """
+        height, width = self.shape
+        count = self.count.reshape(height, width)[rows, cols].astype("int64")
+        total = self.total.reshape(height, width)[rows, cols]
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            difference = total / count
+        difference[count == 0] = numpy.nan
+
+        return {"count": count, "difference": difference}
+
+
+class SurfaceSummary:
+    """
+    Mergeable partial result of evaluating the surface differences.
+    Nodes are evaluated if they're valid within the base grid and hold at
+    least the minimum count of soundings; a node fails if the absolute
+    difference of the mean of its soundings to the surface exceeds the TVU
+    of the surface's depth.
+    """
+
+    def __init__(self) -> None:
+        self.total_nodes = 0
+        self.evaluated_nodes = 0
+        self.failed_nodes = 0
+        # sums of the differences of the evaluated nodes
+        self.difference_total = 0.0
+        self.difference_squares = 0.0
+        self.max_abs_difference = 0.0
+        # histogram of the ratio of the absolute difference to the TVU
+        self.ratio_hist = numpy.zeros(RATIO_EDGES.size, dtype="int64")
+
+    def update(
+        self,
+        difference: numpy.ndarray,
+        count: numpy.ndarray,
+        surface: numpy.ndarray,
+        valid: numpy.ndarray,
+        tvu_a: float,
+        tvu_b: float,
+        minimum_count: int,
+    ) -> None:
+        """
+        Evaluate a block of differences.
+
+        :param difference: Mean of the soundings less the surface
+        :type difference: class:`numpy.ndarray`
+        :param count: Number of soundings of each cell
+        :type count: class:`numpy.ndarray`
+        :param surface: The surface values
+        :type surface: class:`numpy.ndarray`
+        :param valid: Boolean mask identifying the non-nodata cells
+        :type valid: class:`numpy.ndarray`
+        :param tvu_a: Depth independent TVU coefficient
+        :type tvu_a: float
+        :param tvu_b: Depth dependent TVU coefficient
+        :type tvu_b: float
+        :param minimum_count: Minimum soundings for a node to be evaluated
+        :type minimum_count: int
+        """
+        self.total_nodes += int(valid.sum())
+
+        evaluated = valid & (count >= minimum_count)
+        diff = difference[evaluated]
+        if diff.size == 0:
+            return
+
+        tvu = total_vertical_uncertainty(surface[evaluated], tvu_a, tvu_b)
+        ratio = numpy.abs(diff) / tvu
+
+        self.evaluated_nodes += diff.size
+        self.failed_nodes += int((ratio > 1).sum())
+        self.difference_total += float(diff.sum())
+        self.difference_squares += float(numpy.square(diff).sum())
+        self.max_abs_difference = max(
+            self.max_abs_difference, float(numpy.abs(diff).max())
+        )
+        bins = numpy.searchsorted(RATIO_EDGES, ratio, side="right") - 1
+        self.ratio_hist += numpy.bincount(bins, minlength=RATIO_EDGES.size)
+
+    def merge(self, other: "SurfaceSummary") -> "SurfaceSummary":
+        """
+        Combine two partial results into a new result.
+
+        :param other: The partial result to combine with
+        :type other: class:`SurfaceSummary`
+        :return: The combined summary
+        :rtype: class:`SurfaceSummary`
+        """
+        result = SurfaceSummary()
+        result.total_nodes = self.total_nodes + other.total_nodes
+        result.evaluated_nodes = self.evaluated_nodes + other.evaluated_nodes
+        result.failed_nodes = self.failed_nodes + other.failed_nodes
+        result.difference_total = self.difference_total + other.difference_total
+        result.difference_squares = (
+            self.difference_squares + other.difference_squares
+        )
+        result.max_abs_difference = max(
+            self.max_abs_difference, other.max_abs_difference
+        )
+        result.ratio_hist = self.ratio_hist + other.ratio_hist
+
+        return result
+
+    @property
+    def mean_difference(self) -> Optional[float]:
+        """Mean difference of the evaluated nodes; the bias of the surface."""
+        if not self.evaluated_nodes:
+            return None
+
+        return self.difference_total / self.evaluated_nodes
+
+    @property
+    def rms_difference(self) -> Optional[float]:
+        """Root mean square difference of the evaluated nodes."""
+        if not self.evaluated_nodes:
+            return None
+
+        return math.sqrt(self.difference_squares / self.evaluated_nodes)
+
+
+def accumulate_residuals(
+    point_cloud_pathname: Path,
+    grid_dataset_pathname: Path,
+    residuals: CellResiduals,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    lock: Optional[threading.Lock] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Accumulate the residuals of the points of a point cloud file to the
+    surface of the base grid. Soundings of no-data cells are discarded.
+    Each call opens its own handle to the base grid, so files can be read
+    concurrently, whilst `lock` (if defined) guards the shared residuals.
+
+    :param point_cloud_pathname: Pathname to the LAS/LAZ file
+    :type point_cloud_pathname: class:`pathlib.Path`
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param residuals: The residuals to update
+    :type residuals: class:`CellResiduals`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param lock: Lock guarding updates to the residuals, or None
+    :type lock: class:`threading.Lock` or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points read
+    :rtype: int
+    """
+    height, width = residuals.shape
+
+    n_points = 0
+    with rasterio.open(str(grid_dataset_pathname)) as src:
+        surface = SurfaceBlocks(src)
+        chunks = numpy_density.read_points(point_cloud_pathname, src.crs, chunk_size)
+        for x, y, z in chunks:
+            index, inside = numpy_density.cell_index(
+                x, y, src.transform, width, height, return_inside=True
+            )
+            row, col = numpy.divmod(index, width)
+
+            residual = numpy.asarray(z)[inside] - surface.lookup(row, col)
+            joined = numpy.isfinite(residual)
+            index = index[joined]
+            if lock is None:
+                residuals.update(index, residual[joined])
+            else:
+                with lock:
+                    residuals.update(index, residual[joined])
+            n_points += x.size
+            if stage_progress is not None:
+                stage_progress.update(x.size)
+
+    return n_points
+
+
+def write_differences(
+    grid_dataset_pathname: Path,
+    residuals: CellResiduals,
+    out_pathname: Optional[Path],
+    tvu_a: float,
+    tvu_b: float,
+    minimum_count: int,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> SurfaceSummary:
+    """
+    Evaluate the differences of the nodes of the base grid, and write them
+    (if `out_pathname` is defined) as a GeoTIFF of the mean of each cell's
+    soundings less the surface value. Blocks are read and evaluated by a
+    pool of `threads`, whilst the calling thread writes the blocks in order.
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param residuals: The accumulated residuals
+    :type residuals: class:`CellResiduals`
+    :param out_pathname: Pathname of the output difference grid, or None
+    :type out_pathname: class:`pathlib.Path` or None
+    :param tvu_a: Depth independent TVU coefficient
+    :type tvu_a: float
+    :param tvu_b: Depth dependent TVU coefficient
+    :type tvu_b: float
+    :param minimum_count: Minimum soundings for a node to be evaluated
+    :type minimum_count: int
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the cells of each block
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The evaluation of the nodes
+    :rtype: class:`SurfaceSummary`
+    """
+    summary = SurfaceSummary()
+
+    def evaluate_block(datasets, window):
+        (src,) = datasets
+        rows, cols = window.toslices()
+        surface = src.read(1, window=window)
+        valid = utils.mask_finite(surface, src.nodata)
+        block = residuals.read(rows, cols)
+        block_summary = SurfaceSummary()
+        block_summary.update(
+            block["difference"],
+            block["count"],
+            surface,
+            valid,
+            tvu_a,
+            tvu_b,
+            minimum_count,
+        )
+        data = block["difference"].astype(DTYPE)
+        data[~valid] = NODATA
+        return window, data, block_summary
+
+    with blocks.BlockScheduler([grid_dataset_pathname], threads) as scheduler:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            kwargs: Dict[str, Any] = {
+                "driver": "GTiff",
+                "width": src.width,
+                "height": src.height,
+                "count": 1,
+                "dtype": DTYPE,
+                "crs": src.crs,
+                "transform": src.transform,
+                "nodata": NODATA,
+                **SURFACE_GTIFF_OPTIONS,
+                "num_threads": scheduler.threads,
+            }
+            windows = tile_windows(src.width, src.height, 256)
+
+        outds = None
+        if out_pathname is not None:
+            outds = rasterio.open(str(out_pathname), "w", **kwargs)
+        try:
+            for window, data, block_summary in scheduler.map(
+                evaluate_block, windows
+            ):
+                summary = summary.merge(block_summary)
+                if outds is not None:
+                    outds.write(data, 1, window=window)
+                if stage_progress is not None:
+                    stage_progress.update(window.width * window.height)
+        finally:
+            if outds is not None:
+                outds.close()
+
+    return summary
+
+
+def surface_consistency(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Optional[Path],
+    tvu_a: float,
+    tvu_b: float,
+    minimum_count: int,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    threads: Optional[int] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+) -> Tuple[SurfaceSummary, PointResiduals]:
+    """
+    Workflow for evaluating the consistency of the base grid's surface with
+    the soundings. Point cloud files are read concurrently by a pool of
+    `threads` (default is one per file, up to the CPU count). If defined,
+    the `profiler` records the join and evaluation stages, and `progress`
+    reports the points read ("points" stage) and the cells evaluated
+    ("surface" stage).
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param point_cloud_pathnames: Pathnames to the LAS/LAZ files
+    :type point_cloud_pathnames: list
+    :param out_pathname: Pathname of the output difference grid, or None
+    :type out_pathname: class:`pathlib.Path` or None
+    :param tvu_a: Depth independent TVU coefficient
+    :type tvu_a: float
+    :param tvu_b: Depth dependent TVU coefficient
+    :type tvu_b: float
+    :param minimum_count: Minimum soundings for a node to be evaluated
+    :type minimum_count: int
+    :return: The evaluation of the nodes, and the moments of the residuals
+        of all soundings joined to the surface
+    :rtype: tuple
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
+    with tempfile.TemporaryDirectory(suffix=".surface-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            residuals = CellResiduals(src.height, src.width, Path(tmpdir))
+
+        with profiler.stage("join_points") as timing, progress.stage(
+            "points", total_points, "points"
+        ) as stage:
+            lock = threading.Lock()
+            file_threads = threads or min(
+                len(point_cloud_pathnames), os.cpu_count() or 1
+            )
+            with ThreadPoolExecutor(max_workers=file_threads) as executor:
+                futures = [
+                    executor.submit(
+                        accumulate_residuals,
+                        pathname,
+                        grid_dataset_pathname,
+                        residuals,
+                        chunk_size,
+                        lock,
+                        stage,
+                    )
+                    for pathname in point_cloud_pathnames
+                ]
+                n_points = sum(future.result() for future in futures)
+            timing.add_items(n_points, "points")
+
+        cells = residuals.count.size
+        with profiler.stage("write_differences") as timing, progress.stage(
+            "surface", cells, "cells"
+        ) as stage:
+            summary = write_differences(
+                grid_dataset_pathname,
+                residuals,
+                out_pathname,
+                tvu_a,
+                tvu_b,
+                minimum_count,
+                threads,
+                stage,
+            )
+            timing.add_items(cells, "cells")
+
+        points = residuals.points
+        # release the memory maps prior to the tmpdir cleanup
+        del residuals
+
+    return summary, points
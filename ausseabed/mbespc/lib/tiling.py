@@ -0,0 +1,274 @@
+"""
+Memory bounded, tiled density computation.
+The base grid is split into tiles, each tile's point counts are calculated
+in a separate worker process, and the results are stitched into the final
+density grid. Peak memory is bounded by the tile size and the number of
+workers rather than the size of the base grid.
+Each tile only reads the point files whose header bounds intersect the
+tile, so a survey of many lines is read about once in total rather than
+once per tile. A single file spanning every tile is still read by every
+tile; larger tiles reduce the repeated reads.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+import os
+
+import numpy
+import rasterio  # type: ignore[import]
+from rasterio.windows import Window  # type: ignore[import]
+from affine import Affine
+
+from ausseabed.mbespc.lib import profiling, utils
+from ausseabed.mbespc.lib.progress import Progress
+
+LOG = logging.getLogger(__name__)
+
+# default tile size (number of cells along each axis)
+# a multiple of the 256 block size used by the density grid
+TILE_SIZE = 4096
+
+# nodata value and datatype consistent with pdal_writer.GdalWriter
+NODATA = -9999
+DTYPE = "int32"
+
+
+def tile_windows(width: int, height: int, tile_size: int) -> List[Window]:
+    """
+    Split a grid of the given dimensions into square tiles.
+    Tiles along the right and bottom edges are truncated to the grid.
+
+    :param width: Number of columns in the grid
+    :type width: int
+    :param height: Number of rows in the grid
+    :type height: int
+    :param tile_size: Number of cells along each axis of a tile
+    :type tile_size: int
+    :return: A list of windows, ordered row major
+    :rtype: list
+    """
+    windows = []
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            windows.append(
+                Window(
+                    col_off,
+                    row_off,
+                    min(tile_size, width - col_off),
+                    min(tile_size, height - row_off),
+                )
+            )
+
+    return windows
+
+
+def tile_point_files(
+    windows: Sequence[Window],
+    transform: Affine,
+    point_cloud_pathnames: Sequence[Path],
+    file_bounds: Sequence[Tuple[float, float, float, float]],
+) -> List[List[Path]]:
+    """
+    The point files whose bounds intersect each tile (window) of the grid.
+
+    :param windows: The tiles of the grid
+    :type windows: list
+    :param transform: The affine transform of the grid
+    :type transform: class:`affine.Affine`
+    :param point_cloud_pathnames: Pathnames to the point cloud files
+    :type point_cloud_pathnames: list
+    :param file_bounds: The (left, bottom, right, top) bounds of each
+        file, in the CRS of the grid; see :func:`utils.header_bounds`
+    :type file_bounds: list
+    :return: The point files of each tile, in the order of `windows`
+    :rtype: list
+    """
+    tile_files = []
+    for window in windows:
+        left, bottom, right, top = rasterio.windows.bounds(window, transform)
+        tile_files.append(
+            [
+                pathname
+                for pathname, (f_left, f_bottom, f_right, f_top) in zip(
+                    point_cloud_pathnames, file_bounds
+                )
+                # points on the tile edges may fall within the tile
+                if f_left <= right and f_right >= left
+                and f_bottom <= top and f_top >= bottom
+            ]
+        )
+
+    return tile_files
+
+
+def compute_tiles(
+    density_tile: Callable[[Path, Sequence[Path], Window], numpy.ndarray],
+    grid_dataset_pathname: Path,
+    tiles: Sequence[Tuple[Window, Sequence[Path]]],
+    processes: Optional[int] = None,
+) -> Iterator[Tuple[Window, numpy.ndarray]]:
+    """
+    Calculate the counts of each tile within a pool of worker processes,
+    yielding (window, counts) tuples in order of completion. Each tile is
+    given as its window and the point files intersecting it; tiles without
+    any point files are zero, without a worker reading anything.
+    At most twice the number of workers tiles are in flight at once.
+    Tiles yet to start are cancelled if the caller stops early.
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        max_pending = 2 * processes
+        pending: Dict[Future, Window] = {}
+        remaining = iter(tiles)
+
+        try:
+            while True:
+                for window, pathnames in remaining:
+                    if not pathnames:
+                        yield window, numpy.zeros(
+                            (int(window.height), int(window.width)), dtype=DTYPE
+                        )
+                        continue
+
+                    future = executor.submit(
+                        density_tile,
+                        grid_dataset_pathname,
+                        pathnames,
+                        window,
+                    )
+                    pending[future] = window
+                    if len(pending) >= max_pending:
+                        break
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = pending.pop(future)
+                    yield window, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def density_tiled(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Path,
+    density_tile: Callable[[Path, Sequence[Path], Window], numpy.ndarray],
+    tile_size: int = TILE_SIZE,
+    processes: Optional[int] = None,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray, int]:
+    """
+    Workflow for creating the density grid one tile at a time.
+    Each tile is calculated by `density_tile` within a pool of worker
+    processes, from the point files whose header bounds intersect the
+    tile; as tiles complete, the base grids' no-data mask is applied
+    and the tile is written to the output GeoTIFF.
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param point_cloud_pathnames: Pathnames to the point cloud files
+    :type point_cloud_pathnames: list
+    :param out_pathname: Pathname of the output density grid
+    :type out_pathname: class:`pathlib.Path`
+    :param density_tile: Picklable function computing the counts of a tile
+    :type density_tile: callable
+    :param tile_size: Number of cells along each axis of a tile
+    :type tile_size: int
+    :param processes: Number of worker processes. Default is the CPU count
+    :type processes: int or None
+    :param failure_mask: If defined, the failure mask is written as tiles
+        complete
+    :type failure_mask: class:`utils.FailureMask` or None
+    :param creation_options: GeoTIFF creation options. Default is
+        `utils.DENSITY_GTIFF_OPTIONS`
+    :type creation_options: dict or None
+    :param profiler: If defined, records the tiled density stage
+    :type profiler: class:`profiling.Profiler` or None
+    :param progress: If defined, reports the cells of each completed tile
+        as the "density" stage
+    :type progress: class:`progress.Progress` or None
+    :param histogram_cap: Densities at or above the cap are binned into
+        the log2 spaced tail of the histogram
+    :type histogram_cap: int
+    :param overviews: If defined, the sum aggregated overview levels are
+        built as tiles complete
+    :type overviews: class:`utils.SumOverviews` or None
+    :return: A tuple of the histogram, bins and the non-nodata cell count
+    :rtype: tuple
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    stats = utils.DensityStatistics(histogram_cap)
+    if creation_options is None:
+        creation_options = utils.DENSITY_GTIFF_OPTIONS
+
+    with rasterio.open(str(grid_dataset_pathname)) as src:
+        windows = tile_windows(src.width, src.height, tile_size)
+        file_bounds = [
+            utils.header_bounds(pathname, src.crs)
+            for pathname in point_cloud_pathnames
+        ]
+        tile_files = tile_point_files(
+            windows, src.transform, point_cloud_pathnames, file_bounds
+        )
+        kwargs = {
+            "driver": "GTiff",
+            "width": src.width,
+            "height": src.height,
+            "count": 1,
+            "dtype": DTYPE,
+            "crs": src.crs,
+            "transform": src.transform,
+            "nodata": NODATA,
+            **creation_options,
+        }
+
+        LOG.info(f"Creating density grid from {len(windows)} tiles")
+        with profiler.stage("density_tiles") as timing, progress.stage(
+            "density", src.width * src.height, "cells"
+        ) as stage, rasterio.open(str(out_pathname), "w", **kwargs) as outds:
+            if failure_mask is not None:
+                failure_mask.open(src)
+            if overviews is not None:
+                overviews.open(outds)
+            try:
+                tiles = compute_tiles(
+                    density_tile,
+                    grid_dataset_pathname,
+                    list(zip(windows, tile_files)),
+                    processes,
+                )
+                for window, counts in tiles:
+                    d_data = counts.astype(DTYPE, copy=False)
+                    z_data = src.read(1, window=window)
+                    valid = utils.mask_finite(z_data, src.nodata)
+                    d_data[~valid] = NODATA
+                    stats.update(d_data, valid)
+                    outds.write(d_data, 1, window=window)
+                    if failure_mask is not None:
+                        failure_mask.write(d_data, valid, window)
+                    if overviews is not None:
+                        overviews.write(d_data, valid, window)
+                    timing.add_items(d_data.size, "cells")
+                    stage.update(d_data.size)
+            finally:
+                if failure_mask is not None:
+                    failure_mask.close()
+
+    if overviews is not None:
+        overviews.close()
+
+    hist, bins = stats.histogram()
+
+    return hist, bins, stats.cell_count
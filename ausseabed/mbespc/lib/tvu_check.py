@@ -0,0 +1,187 @@
+"""
+Base of the checks evaluating the nodes of a grid against the total
+vertical uncertainty (TVU) budget of their depth
+"""
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Union
+import logging
+
+from ausseabed.mbespc.lib import (
+    cancellation,
+    errors,
+    profiling,
+    progress,
+    vertical_statistics,
+)
+
+LOG = logging.getLogger(__name__)
+
+
+class TvuCheck(ABC):
+    """
+    Evaluates the nodes of the grid file with at least the minimum count of
+    soundings against the TVU budget of their depth, passing when the
+    percentage of the evaluated nodes within the TVU exceeds the minimum
+    percentage.
+    Subclasses provide the workflow (`_evaluate`) and the fields of its
+    summary (`summarise`), along with the following class attributes.
+    """
+
+    # details used by the QAX plugin
+    name: str
+    # relative weights of the stages reported to the progress callback
+    progress_weights: Dict[str, float] = {}
+    # fewest soundings per node the check can evaluate, and the default
+    least_minimum_count = 1
+    default_minimum_count = 1
+    # name of the grid persisted within the output directory
+    output_filename: str
+
+    def __init__(
+        self,
+        point_cloud_file: Union[Path, Sequence[Path]],
+        grid_file: Path,
+        tvu_a: float = 0.5,
+        tvu_b: float = 0.013,
+        minimum_count: Optional[int] = None,
+        minimum_percentage: float = 95.0,
+        outdir: Optional[Path] = None,
+        threads: Optional[int] = None,
+        progress_callback: Optional[progress.ProgressCallback] = None,
+        is_stopped: Optional[Callable[[], bool]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        if minimum_count is None:
+            minimum_count = self.default_minimum_count
+        if minimum_count < self.least_minimum_count:
+            raise errors.MbesPcError(
+                f"Minimum count must be at least {self.least_minimum_count}, "
+                f"not {minimum_count}"
+            )
+
+        if isinstance(point_cloud_file, (str, Path)):
+            self.point_cloud_files = [Path(point_cloud_file)]
+        else:
+            self.point_cloud_files = [Path(p) for p in point_cloud_file]
+
+        if not self.point_cloud_files:
+            raise errors.MbesPcError("No point cloud files given")
+
+        self.point_cloud_file = self.point_cloud_files[0]
+        self.grid_file = grid_file
+        # TVU budget; sqrt(a^2 + (b * depth)^2)
+        self.tvu_a = tvu_a
+        self.tvu_b = tvu_b
+        # nodes with fewer soundings aren't evaluated
+        self.minimum_count = minimum_count
+        # percentage of the evaluated nodes that must be exceeded within
+        # the TVU budget (as for the density check's minimum percentage)
+        self.minimum_percentage = minimum_percentage
+        # when defined, the check's grid (see `output_filename`) is
+        # persisted within this directory
+        self.outdir = outdir
+        # number of threads reading the point files and the grid blocks
+        self.threads = threads
+        # see AlgorithmIndependentDensityCheck
+        self.progress_callback = progress_callback
+        self.is_stopped = is_stopped
+        self.timeout = timeout
+
+        # total number of non-nodata nodes in grid
+        self.total_nodes: Optional[int] = None
+        # nodes with at least the minimum count of soundings
+        self.evaluated_nodes: Optional[int] = None
+        # evaluated nodes beyond the TVU
+        self.failed_nodes: Optional[int] = None
+        # a check that evaluates no nodes fails, and its percentages are
+        # left undefined
+        self.passed: Optional[bool] = None
+        self.percentage_passed: Optional[float] = None
+        self.percentage_failed: Optional[float] = None
+        # histogram - list of tuples of the lower edge of the ratio to the
+        # TVU, and the number of nodes
+        self.histogram: Optional[list[tuple[float, int]]] = None
+
+        self.profiler = profiling.Profiler()
+        self.performance: Optional[Dict[str, Any]] = None
+        self.progress = progress.Progress()
+
+    def _output_directory(self) -> Optional[Path]:
+        """Directory for persisted outputs, created if required."""
+        if self.outdir is None:
+            return None
+
+        outdir = self.outdir / self.point_cloud_file.stem / self.name
+        outdir.mkdir(parents=True, exist_ok=True)
+
+        return outdir
+
+    def output_pathname(self) -> Optional[Path]:
+        """Pathname of the persisted grid, or None."""
+        outdir = self._output_directory()
+        if outdir is None:
+            return None
+
+        return outdir / self.output_filename
+
+    def run(self):
+        """
+        Runs/executes the check workflow.
+        Raises errors.CheckCancelled if the check is stopped or times out.
+        """
+        self.profiler = profiling.Profiler()
+        self.progress = progress.Progress(
+            self.progress_callback,
+            self.progress_weights,
+            cancellation=cancellation.Cancellation(self.is_stopped, self.timeout),
+        )
+
+        self._evaluate()
+
+        self.performance = self.profiler.to_dict()
+        self.progress.finish()
+
+    @abstractmethod
+    def _evaluate(self) -> None:
+        """Runs the workflow of the check, and summarises its results."""
+
+    def summarise(self, summary: Any) -> None:
+        """
+        Populate the results of the check from the evaluation of the nodes.
+
+        :param summary: The evaluation of the nodes; providing the
+            `total_nodes`, `evaluated_nodes`, `failed_nodes` and
+            `ratio_hist` of the nodes
+        """
+        self.total_nodes = summary.total_nodes
+        self.evaluated_nodes = summary.evaluated_nodes
+        self.failed_nodes = summary.failed_nodes
+        if summary.evaluated_nodes:
+            self.percentage_failed = float(
+                summary.failed_nodes / summary.evaluated_nodes * 100
+            )
+            self.percentage_passed = 100 - self.percentage_failed
+            self.passed = self.percentage_passed > self.minimum_percentage
+        else:
+            # e.g. the points fall outside of the grid (or are in another
+            # CRS), or no node holds the minimum count of soundings
+            LOG.warning(
+                f"No nodes with at least {self.minimum_count} soundings "
+                "to evaluate"
+            )
+            self.percentage_failed = None
+            self.percentage_passed = None
+            self.passed = False
+        self.histogram = list(
+            zip(
+                vertical_statistics.RATIO_EDGES.tolist(),
+                summary.ratio_hist.tolist(),
+            )
+        )
+
+        LOG.info(summary.evaluated_nodes)
+        LOG.info(self.passed)
+        LOG.info(self.percentage_passed)
+        LOG.info(summary.failed_nodes)
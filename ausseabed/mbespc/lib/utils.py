@@ -1,13 +1,50 @@
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Union, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union, Tuple
+import glob
+import tempfile
+import laspy
 import numpy
 import rasterio
 from rasterio import features
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+import shapely
 from shapely.geometry import shape
 import geopandas
 
+from ausseabed.mbespc.lib import blocks, errors, profiling, vector_sink
+from ausseabed.mbespc.lib.progress import Progress, StageProgress
 
-def update_density_no_data(grid_pathname: Path, density_pathname: Path) -> Tuple[int, int]:
+# creation options for persisted density grids
+DENSITY_GTIFF_OPTIONS = {
+    "compress": "deflate",
+    "zlevel": 6,
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+    "predictor": 2,
+}
+
+# overview levels with more cells than this are accumulated within a
+# temporary file
+MAX_IN_MEMORY_OVERVIEW_CELLS = 2**24
+
+# creation options for the 1-bit failure mask
+FAILURE_MASK_GTIFF_OPTIONS = {
+    "nbits": 1,
+    "compress": "deflate",
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+}
+
+
+def update_density_no_data(
+    grid_pathname: Path, density_pathname: Path, threads: Optional[int] = None
+) -> Tuple[int, int]:
     """
     Update the density grid calculated via the PDAL pipeline by accounting
     for the base grids' no-data mask.
@@ -17,60 +54,735 @@ def update_density_no_data(grid_pathname: Path, density_pathname: Path) -> Tuple
     :type grid_pathname: class:`pathlib.Path`
     :param density_pathname: Pathname to the density grid file
     :type density_pathname: class:`pathlib.Path`
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
     :return: A tuple of ints for the maximum cell density,
        and the total of non-nodata pixels
     :rtype: tuple
     """
-    with rasterio.open(str(grid_pathname)) as src:
+
+    def mask_block(datasets, window):
+        src, den_src = datasets
+        d_data = den_src.read(1, window=window)
+        z_data = src.read(1, window=window)
+        mask = z_data == src.nodata
+        d_data[mask] = den_src.nodata
+        return window, d_data, int((~mask).sum())
+
+    windows = blocks.block_windows(density_pathname)
+    pathnames = [grid_pathname, density_pathname]
+
+    with blocks.BlockScheduler(pathnames, threads) as scheduler:
         with rasterio.open(str(density_pathname), "r+") as den_src:
             # we need determine the max value in order to determine
             # appropriate upper bin for the histogram
             max_ = 0
             cell_count = 0
-            for _, window in den_src.block_windows():
-                d_data = den_src.read(1, window=window)
-                z_data = src.read(1, window=window)
-                mask = z_data == src.nodata
-                cell_count += (~mask).sum()
-                d_data[mask] = den_src.nodata
+            for window, d_data, count in scheduler.map(mask_block, windows):
+                cell_count += count
                 max_ = max(max_, numpy.max(d_data))
                 den_src.write(d_data, 1, window=window)
 
     return int(max_), int(cell_count)
 
 
+# densities below the cap are binned exactly (binsize of 1), whilst larger
+# densities fall within a tail of log2 spaced bins [cap, 2cap), [2cap, 4cap)
+# etc, so the histogram doesn't scale with the densest cell
+HISTOGRAM_CAP = 1024
+
+
+def _tail_index(values: numpy.ndarray, cap: int) -> numpy.ndarray:
+    """
+    Index of the log2 spaced tail bin of each value (all >= `cap`),
+    i.e. floor(log2(value / cap)).
+    """
+    # exact for integers, unlike numpy.log2
+    _, exponent = numpy.frexp((values // cap).astype("float64"))
+    return exponent - 1
+
+
+def bin_label(edge: int, cap: int = HISTOGRAM_CAP) -> str:
+    """
+    Label of a histogram bin given its lower edge; the density for bins
+    below the cap, otherwise the range of densities within the tail bin.
+    """
+    if edge < cap:
+        return str(edge)
+
+    return f"{edge}-{2 * edge - 1}"
+
+
+class DensityStatistics:
+    """
+    Mergeable partial result of the density grid statistics.
+    Tracks the maximum cell density, the total of non-nodata cells and
+    the frequency histogram of the point density. Densities below `cap`
+    are binned with a binsize of 1, whilst larger densities are binned
+    into a log2 spaced tail (see `HISTOGRAM_CAP`), bounding the size of
+    the histogram regardless of the densest cell.
+    The histogram grows as larger densities are encountered, which removes
+    the need to know the maximum density prior to binning.
+    """
+
+    def __init__(self, cap: int = HISTOGRAM_CAP) -> None:
+        if cap < 1:
+            raise errors.MbesPcError(f"Invalid histogram cap: {cap}")
+
+        self.cap = cap
+        self.max: int = 0
+        self.cell_count: int = 0
+        self.hist: numpy.ndarray = numpy.zeros(1, dtype="int64")
+        # counts of the log2 spaced bins of densities >= cap
+        self.tail: numpy.ndarray = numpy.zeros(0, dtype="int64")
+
+    def _grow(self, size: int) -> None:
+        """Extend the histogram to contain at least `size` bins."""
+        if size > self.hist.size:
+            hist = numpy.zeros(size, dtype="int64")
+            hist[: self.hist.size] = self.hist
+            self.hist = hist
+
+    def _grow_tail(self, size: int) -> None:
+        """Extend the tail to contain at least `size` bins."""
+        if size > self.tail.size:
+            tail = numpy.zeros(size, dtype="int64")
+            tail[: self.tail.size] = self.tail
+            self.tail = tail
+
+    def update(self, data: numpy.ndarray, valid: numpy.ndarray) -> None:
+        """
+        Reduce a block of density data into the statistics.
+
+        :param data: Density values for the block
+        :type data: class:`numpy.ndarray`
+        :param valid: Boolean mask identifying the non-nodata cells
+        :type valid: class:`numpy.ndarray`
+        """
+        self.cell_count += int(valid.sum())
+
+        values = data[valid]
+        values = values[values >= 0].astype("int64", copy=False)
+        if values.size == 0:
+            return
+
+        maxv = int(values.max())
+        self.max = max(self.max, maxv)
+
+        if maxv >= self.cap:
+            over = values >= self.cap
+            counts = numpy.bincount(_tail_index(values[over], self.cap))
+            self._grow_tail(counts.size)
+            self.tail[: counts.size] += counts
+            values = values[~over]
+
+        counts = numpy.bincount(values)
+        self._grow(counts.size)
+        self.hist[: counts.size] += counts
+
+    def merge(self, other: "DensityStatistics") -> "DensityStatistics":
+        """
+        Combine two partial results into a new result.
+
+        :param other: The partial result to combine with
+        :type other: class:`DensityStatistics`
+        :return: The combined statistics
+        :rtype: class:`DensityStatistics`
+        """
+        if other.cap != self.cap:
+            raise errors.MbesPcError(
+                f"Can't merge histograms capped at {self.cap} and {other.cap}"
+            )
+
+        result = DensityStatistics(self.cap)
+        result.max = max(self.max, other.max)
+        result.cell_count = self.cell_count + other.cell_count
+        result._grow(max(self.hist.size, other.hist.size))
+        result.hist[: self.hist.size] += self.hist
+        result.hist[: other.hist.size] += other.hist
+        result._grow_tail(max(self.tail.size, other.tail.size))
+        result.tail[: self.tail.size] += self.tail
+        result.tail[: other.tail.size] += other.tail
+
+        return result
+
+    def histogram(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        The frequency histogram for the values in the range [0, max].
+        The bins are the lower edge of each bin; a binsize of 1 below
+        the cap, followed by the log2 spaced tail bins (if any).
+
+        :return: A tuple of :class: `numpy.ndarray` objects containing
+            the histogram and the bins
+        :rtype: tuple
+        """
+        if self.tail.size == 0:
+            hist = self.hist[: self.max + 1].copy()
+            return hist, numpy.arange(hist.size)
+
+        hist = numpy.zeros(self.cap + self.tail.size, dtype="int64")
+        hist[: self.hist.size] = self.hist
+        hist[self.cap :] = self.tail
+        bins = numpy.concatenate(
+            [
+                numpy.arange(self.cap),
+                self.cap * 2 ** numpy.arange(self.tail.size, dtype="int64"),
+            ]
+        )
+
+        return hist, bins
+
+
+class FailureMask:
+    """
+    A compact 1-bit GeoTIFF identifying the cells failing the minimum
+    count criterion (1) and all other cells (0). Written block by block
+    within the same pass that accumulates the density statistics.
+    """
+
+    def __init__(self, pathname: Path, minimum_count: int) -> None:
+        self.pathname = pathname
+        self.minimum_count = minimum_count
+        # total of cells written as failing
+        self.failed_cells = 0
+        self._dataset = None
+
+    def open(self, dataset: rasterio.DatasetReader) -> None:
+        """
+        Create the mask with the same geometry as the given dataset.
+        """
+        kwargs = {
+            "driver": "GTiff",
+            "width": dataset.width,
+            "height": dataset.height,
+            "count": 1,
+            "dtype": "uint8",
+            "crs": dataset.crs,
+            "transform": dataset.transform,
+            **FAILURE_MASK_GTIFF_OPTIONS,
+        }
+        self._dataset = rasterio.open(str(self.pathname), "w", **kwargs)
+
+    def write(
+        self, data: numpy.ndarray, valid: numpy.ndarray, window: Window
+    ) -> None:
+        """
+        Write the failing cells of a block of density data.
+
+        :param data: Density values for the block
+        :type data: class:`numpy.ndarray`
+        :param valid: Boolean mask identifying the non-nodata cells
+        :type valid: class:`numpy.ndarray`
+        :param window: The window of the block
+        :type window: class:`rasterio.windows.Window`
+        """
+        failed = valid & (data >= 0) & (data < self.minimum_count)
+        self.failed_cells += int(failed.sum())
+        self._dataset.write(failed.astype("uint8"), 1, window=window)
+
+    def close(self) -> None:
+        """Finalise the mask."""
+        if self._dataset is not None:
+            self._dataset.close()
+            self._dataset = None
+
+
+def overview_factors(width: int, height: int, blocksize: int = 256) -> List[int]:
+    """
+    Decimation factors (2, 4, 8 ...) of the overview levels of a grid,
+    halving the resolution until a level fits within a single block.
+    """
+    factors = []
+    factor = 2
+    while max(width, height) * 2 > blocksize * factor:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def sum_2x2(
+    data: numpy.ndarray,
+    valid: numpy.ndarray,
+    row_off: int = 0,
+    col_off: int = 0,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Aggregate a block of counts to half the resolution by summing each 2x2
+    group of valid cells. A coarse cell is valid if any of its cells are.
+    Blocks starting on an odd row or column (`row_off`, `col_off`) are
+    aligned to the coarse grid, as are blocks of an odd size.
+
+    :param data: Counts of the block
+    :type data: class:`numpy.ndarray`
+    :param valid: Boolean mask identifying the non-nodata cells
+    :type valid: class:`numpy.ndarray`
+    :param row_off: Row of the block within the grid
+    :type row_off: int
+    :param col_off: Column of the block within the grid
+    :type col_off: int
+    :return: A tuple of the coarse counts (int64) and validity
+    :rtype: tuple
+    """
+    top, left = row_off % 2, col_off % 2
+    height, width = data.shape
+    rows = (top + height + 1) // 2
+    cols = (left + width + 1) // 2
+
+    counts = numpy.zeros((rows * 2, cols * 2), dtype="int64")
+    counts[top : top + height, left : left + width] = numpy.where(valid, data, 0)
+    mask = numpy.zeros((rows * 2, cols * 2), dtype="bool")
+    mask[top : top + height, left : left + width] = valid
+
+    return (
+        counts.reshape(rows, 2, cols, 2).sum(axis=(1, 3)),
+        mask.reshape(rows, 2, cols, 2).any(axis=(1, 3)),
+    )
+
+
+class SumOverviews:
+    """
+    Overview levels of the density grid built by summing the counts of
+    each 2x2 group of cells of the finer level, written as the internal
+    overviews of the density GeoTIFF. Counts are additive, so each level
+    is exact, unlike resampling. Blocks of density data are aggregated
+    into the first level within the same pass that writes the grid; the
+    coarser levels are derived from the first once the grid is closed.
+    Grids without overviews (see `overview_factors`) are left untouched.
+    """
+
+    def __init__(self) -> None:
+        self.factors: List[int] = []
+        self.pathname: Optional[str] = None
+        self.nodata: Optional[float] = None
+        self._counts: Optional[numpy.ndarray] = None
+        self._valid: Optional[numpy.ndarray] = None
+
+    def open(self, dataset: rasterio.io.DatasetWriter) -> None:
+        """
+        Define the overview levels of the (writable) density grid, prior
+        to any blocks being written, and allocate the first level.
+        """
+        self.factors = overview_factors(dataset.width, dataset.height)
+        if not self.factors:
+            return
+
+        self.pathname = dataset.name
+        self.nodata = dataset.nodata
+        # the levels are only computed from the (empty) grid whilst it is
+        # all nodata, and are overwritten on close
+        dataset.build_overviews(self.factors, Resampling.nearest)
+
+        shape = ((dataset.height + 1) // 2, (dataset.width + 1) // 2)
+        self._counts = _allocate(shape, "int64")
+        self._valid = _allocate(shape, "bool")
+
+    def write(
+        self, data: numpy.ndarray, valid: numpy.ndarray, window: Window
+    ) -> None:
+        """
+        Aggregate a block of density data into the first overview level.
+
+        :param data: Density values for the block
+        :type data: class:`numpy.ndarray`
+        :param valid: Boolean mask identifying the non-nodata cells
+        :type valid: class:`numpy.ndarray`
+        :param window: The window of the block
+        :type window: class:`rasterio.windows.Window`
+        """
+        if self._counts is None:
+            return
+
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        counts, mask = sum_2x2(data, valid, row_off, col_off)
+        rows = slice(row_off // 2, row_off // 2 + counts.shape[0])
+        cols = slice(col_off // 2, col_off // 2 + counts.shape[1])
+        # blocks may share the coarse cells along their edges
+        self._counts[rows, cols] += counts
+        self._valid[rows, cols] |= mask
+
+    def close(self) -> None:
+        """
+        Write the overview levels into the closed density grid, deriving
+        each level from the one before.
+        """
+        if self._counts is None:
+            return
+
+        counts, valid = self._counts, self._valid
+        self._counts = self._valid = None
+
+        for level, factor in enumerate(self.factors):
+            if level > 0:
+                counts, valid = _sum_level(counts, valid)
+            # the overviews follow the full resolution grid in the file
+            pathname = f"GTIFF_DIR:{level + 2}:{self.pathname}"
+            with rasterio.open(pathname, "r+") as ovr:
+                if ovr.shape != counts.shape:
+                    raise errors.MbesPcError(
+                        f"Unexpected shape of overview level {factor}: "
+                        f"{ovr.shape}"
+                    )
+                for _, window in ovr.block_windows():
+                    rows, cols = window.toslices()
+                    block = numpy.where(
+                        valid[rows, cols], counts[rows, cols], self.nodata
+                    )
+                    ovr.write(
+                        block.astype(ovr.dtypes[0], copy=False), 1, window=window
+                    )
+
+
+def _allocate(shape: Tuple[int, int], dtype: str) -> numpy.ndarray:
+    """
+    Allocate a zeroed array, memory mapped to an anonymous temporary
+    file if it is large.
+    """
+    if shape[0] * shape[1] <= MAX_IN_MEMORY_OVERVIEW_CELLS:
+        return numpy.zeros(shape, dtype=dtype)
+
+    # the file is removed once the array is released
+    return numpy.memmap(tempfile.TemporaryFile(), dtype=dtype, shape=shape)
+
+
+def _sum_level(
+    counts: numpy.ndarray, valid: numpy.ndarray, strip: int = 512
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Derive the next overview level, a strip of rows at a time."""
+    shape = ((counts.shape[0] + 1) // 2, (counts.shape[1] + 1) // 2)
+    coarse_counts = _allocate(shape, counts.dtype.name)
+    coarse_valid = _allocate(shape, "bool")
+
+    for row in range(0, counts.shape[0], strip):
+        rows = slice(row, row + strip)
+        block_counts, block_valid = sum_2x2(counts[rows], valid[rows])
+        coarse_rows = slice(row // 2, row // 2 + block_counts.shape[0])
+        coarse_counts[coarse_rows] = block_counts
+        coarse_valid[coarse_rows] = block_valid
+
+    return coarse_counts, coarse_valid
+
+
+def overview_statistics(
+    density_pathname: Path, histogram_cap: int = HISTOGRAM_CAP
+) -> List[Tuple[int, DensityStatistics]]:
+    """
+    The statistics of each overview level of a density grid; the counts
+    of a coarser effective resolution.
+
+    :param density_pathname: Pathname to the density grid file
+    :type density_pathname: class:`pathlib.Path`
+    :param histogram_cap: Densities at or above the cap are binned into
+        the log2 spaced tail of the histogram
+    :type histogram_cap: int
+    :return: A list of (decimation factor, statistics) tuples, finest first.
+        Empty if the grid has no overviews
+    :rtype: list
+    """
+    with rasterio.open(str(density_pathname)) as src:
+        factors = src.overviews(1)
+
+    results = []
+    for level, factor in enumerate(factors):
+        stats = DensityStatistics(histogram_cap)
+        with rasterio.open(str(density_pathname), overview_level=level) as src:
+            for _, window in src.block_windows():
+                data = src.read(1, window=window)
+                stats.update(data, mask_finite(data, src.nodata))
+        results.append((factor, stats))
+
+    return results
+
+
+def write_failure_mask(
+    density_pathname: Path,
+    failure_mask: FailureMask,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> None:
+    """
+    Write the failure mask from an existing density grid, e.g. one
+    retrieved from the cache.
+
+    :param density_pathname: Pathname to the density grid file
+    :type density_pathname: class:`pathlib.Path`
+    :param failure_mask: The failure mask to write
+    :type failure_mask: class:`FailureMask`
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the cells of each block
+    :type stage_progress: class:`progress.StageProgress` or None
+    """
+
+    def read_block(datasets, window):
+        (den_src,) = datasets
+        d_data = den_src.read(1, window=window)
+        return window, d_data, mask_finite(d_data, den_src.nodata)
+
+    windows = blocks.block_windows(density_pathname)
+
+    with blocks.BlockScheduler([density_pathname], threads) as scheduler:
+        with rasterio.open(str(density_pathname)) as den_src:
+            failure_mask.open(den_src)
+        try:
+            for window, d_data, valid in scheduler.map(read_block, windows):
+                failure_mask.write(d_data, valid, window)
+                if stage_progress is not None:
+                    stage_progress.update(d_data.size)
+        finally:
+            failure_mask.close()
+
+
+def _reduce_block(
+    datasets: Sequence[rasterio.DatasetReader],
+    window: Window,
+    histogram_cap: int = HISTOGRAM_CAP,
+) -> Tuple[Window, numpy.ndarray, numpy.ndarray, DensityStatistics]:
+    """
+    Apply the base grids' no-data mask to a block of the density grid,
+    and calculate the partial statistics of the block.
+    """
+    src, den_src = datasets
+    d_data = den_src.read(1, window=window)
+    z_data = src.read(1, window=window)
+    valid = mask_finite(z_data, src.nodata)
+    d_data[~valid] = den_src.nodata
+    stats = DensityStatistics(histogram_cap)
+    stats.update(d_data, valid)
+
+    return window, d_data, valid, stats
+
+
+def reduce_density(
+    grid_pathname: Path,
+    density_pathname: Path,
+    failure_mask: Optional[FailureMask] = None,
+    out_pathname: Optional[Path] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+    histogram_cap: int = HISTOGRAM_CAP,
+    overviews: Optional[SumOverviews] = None,
+) -> DensityStatistics:
+    """
+    Single pass over the density grid that applies the base grids'
+    no-data mask, writes the updated blocks, and accumulates the
+    maximum density, the total of non-nodata cells and the histogram.
+    Equivalent to :func:`update_density_no_data` followed by
+    :func:`histogram_point_density` but only decodes the density grid once.
+    Blocks are read and masked by a pool of `threads`, whilst the calling
+    thread writes the blocks and merges the partial statistics in order.
+
+    :param grid_pathname: Pathname to the base grid file
+    :type grid_pathname: class:`pathlib.Path`
+    :param density_pathname: Pathname to the density grid file
+    :type density_pathname: class:`pathlib.Path`
+    :param failure_mask: If defined, the failure mask is written within
+        the same pass
+    :type failure_mask: class:`FailureMask` or None
+    :param out_pathname: If defined, the updated blocks are written to a
+        new GeoTIFF rather than back to the density grid
+    :type out_pathname: class:`pathlib.Path` or None
+    :param creation_options: GeoTIFF creation options of `out_pathname`.
+        Default is `DENSITY_GTIFF_OPTIONS`
+    :type creation_options: dict or None
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the cells of each block
+    :type stage_progress: class:`progress.StageProgress` or None
+    :param histogram_cap: Densities at or above the cap are binned into
+        the log2 spaced tail of the histogram
+    :type histogram_cap: int
+    :param overviews: If defined, the sum aggregated overview levels are
+        written within the same pass
+    :type overviews: class:`SumOverviews` or None
+    :return: The statistics of the density grid
+    :rtype: class:`DensityStatistics`
+    """
+    stats = DensityStatistics(histogram_cap)
+    reduce_block = partial(_reduce_block, histogram_cap=histogram_cap)
+    mode = "r+" if out_pathname is None else "r"
+    windows = blocks.block_windows(density_pathname)
+    pathnames = [grid_pathname, density_pathname]
+
+    with blocks.BlockScheduler(pathnames, threads) as scheduler:
+        with rasterio.open(str(grid_pathname)) as src:
+            with rasterio.open(str(density_pathname), mode) as den_src:
+                if out_pathname is None:
+                    outds = den_src
+                else:
+                    kwargs = {
+                        "driver": "GTiff",
+                        "width": den_src.width,
+                        "height": den_src.height,
+                        "count": 1,
+                        "dtype": den_src.dtypes[0],
+                        "crs": den_src.crs,
+                        "transform": den_src.transform,
+                        "nodata": den_src.nodata,
+                        **(creation_options or DENSITY_GTIFF_OPTIONS),
+                        # compress the blocks being written concurrently
+                        "num_threads": scheduler.threads,
+                    }
+                    outds = rasterio.open(str(out_pathname), "w", **kwargs)
+                if failure_mask is not None:
+                    failure_mask.open(src)
+                if overviews is not None:
+                    overviews.open(outds)
+                try:
+                    results = scheduler.map(reduce_block, windows)
+                    for window, d_data, valid, block_stats in results:
+                        stats = stats.merge(block_stats)
+                        outds.write(d_data, 1, window=window)
+                        if failure_mask is not None:
+                            failure_mask.write(d_data, valid, window)
+                        if overviews is not None:
+                            overviews.write(d_data, valid, window)
+                        if stage_progress is not None:
+                            stage_progress.update(d_data.size)
+                finally:
+                    if failure_mask is not None:
+                        failure_mask.close()
+                    if outds is not den_src:
+                        outds.close()
+
+    if overviews is not None:
+        overviews.close()
+
+    return stats
+
+
 def histogram_point_density(
-    density_pathname: Path, maxv: int
+    density_pathname: Path,
+    maxv: int,
+    threads: Optional[int] = None,
+    histogram_cap: int = HISTOGRAM_CAP,
 ) -> Tuple[numpy.ndarray, numpy.ndarray]:
     """
     Calculate the frequency histogram of the point density grid layer.
     This routine works in chunked fashion to minimise memory use.
     The method works using a binsize of 1 to provide unique bins
-    for values in the range [0, maxv].
+    for values in the range [0, min(maxv, histogram_cap - 1)], and log2
+    spaced bins for any larger values; see :class:`DensityStatistics`.
 
     :param density_pathname: Pathname to the density grid file
     :type density_pathname: class:`pathlib.Path`
     :param maxv: Maximum density value to be considered for the histogram
     :type maxv: int
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param histogram_cap: Densities at or above the cap are binned into
+        the log2 spaced tail of the histogram
+    :type histogram_cap: int
     :return: A tuple of :class: `numpy.ndarray` objects
     :rtype: tuple
     """
-    # initialise the histogram that we'll update
-    hist = numpy.zeros(maxv + 1, dtype="int64")
+    stats = DensityStatistics(histogram_cap)
+
+    def histogram_block(datasets, window):
+        (src,) = datasets
+        data = src.read(1, window=window)
+        block_stats = DensityStatistics(histogram_cap)
+        block_stats.update(data, data <= maxv)
+        return block_stats
+
+    windows = blocks.block_windows(density_pathname)
+
+    with blocks.BlockScheduler([density_pathname], threads) as scheduler:
+        for block_stats in scheduler.map(histogram_block, windows):
+            stats = stats.merge(block_stats)
 
-    # numpy's histogram is open ended for the final bin i.e.
-    # [3, 4] whereas previous bins are half-open [2, 3)
-    # so an extra bin is defined to ensure equivalent bin sizes
-    # for all the data we care about
-    bins = numpy.arange(maxv + 2)
+    return stats.histogram()
 
-    with rasterio.open(density_pathname) as src:
-        for _, window in src.block_windows():
-            data = src.read(1, window=window)
-            h_tmp, _ = numpy.histogram(data, bins=bins, range=(0, maxv))
-            hist += h_tmp
 
-    return hist, bins[:-1]
+def find_point_files(
+    locations: Iterable[Union[str, Path]],
+    suffixes: Tuple[str, ...] = (".las", ".laz"),
+) -> List[Path]:
+    """
+    Resolve a collection of point cloud locations into a sorted list of
+    unique files. Each location may be a file, a directory (searched
+    for files with the given suffixes), or a glob pattern.
+
+    :param locations: Files, directories or glob patterns
+    :type locations: iterable
+    :param suffixes: Case insensitive suffixes to search directories for
+    :type suffixes: tuple
+    :raises MbesPcError: A location didn't resolve to any files
+    :return: A list of the resolved file pathnames
+    :rtype: list
+    """
+    pathnames = set()
+    for location in locations:
+        pth = Path(location)
+        if pth.is_dir():
+            found = [
+                p for p in pth.iterdir()
+                if p.is_file() and p.suffix.lower() in suffixes
+            ]
+        elif pth.exists():
+            found = [pth]
+        else:
+            found = [Path(p) for p in glob.glob(str(location))]
+
+        if not found:
+            msg = f"No point cloud files found for {location}"
+            raise errors.MbesPcError(msg)
+
+        pathnames.update(p.resolve() for p in found)
+
+    return sorted(pathnames)
+
+
+def header_point_count(pathnames: Sequence[Path]) -> int:
+    """
+    Total number of points declared by the headers of LAS/LAZ files,
+    without reading the points themselves.
+
+    :param pathnames: Pathnames to the LAS/LAZ files
+    :type pathnames: list
+    :return: The total number of points
+    :rtype: int
+    """
+    total = 0
+    for pathname in pathnames:
+        with laspy.open(str(pathname)) as reader:
+            total += int(reader.header.point_count)
+
+    return total
+
+
+def header_bounds(
+    pathname: Path, crs: CRS
+) -> Tuple[float, float, float, float]:
+    """
+    The (left, bottom, right, top) bounds of a LAS/LAZ file declared by
+    its header, in the given CRS, without reading the points themselves.
+    Files without a defined CRS are assumed to be in the given CRS.
+
+    :param pathname: Pathname to the LAS/LAZ file
+    :type pathname: class:`pathlib.Path`
+    :param crs: The CRS of the bounds
+    :type crs: class:`rasterio.crs.CRS`
+    :return: The bounds of the points
+    :rtype: tuple
+    """
+    with laspy.open(str(pathname)) as reader:
+        header = reader.header
+        src_crs = header.parse_crs()
+
+    left, bottom = float(header.mins[0]), float(header.mins[1])
+    right, top = float(header.maxs[0]), float(header.maxs[1])
+    if src_crs is None:
+        return left, bottom, right, top
+
+    return transform_bounds(
+        CRS.from_wkt(src_crs.to_wkt()), crs, left, bottom, right, top
+    )
 
 
 def sanitize_properties(
@@ -106,12 +818,16 @@ def sanitize_properties(
     return data_cp  # type: ignore[return-value]
 
 
-def mask_finite(data: numpy.ndarray, nodata: int | float) -> numpy.ndarray:
+def mask_finite(data: numpy.ndarray, nodata: int | float | None) -> numpy.ndarray:
     """
     Create a boolean mask identifying nodata and data.
     Whilst establishing a mask is simple via standard operators, catering for
     non-finite data is not, i.e. NaN != NaN
+    A nodata value of None identifies all data as valid.
     """
+    if nodata is None:
+        return numpy.ones(data.shape, dtype="bool")
+
     is_finite = numpy.isfinite(nodata)
 
     if is_finite:
@@ -138,25 +854,165 @@ def vectorise_low_density(
         failing to meet the minimum criterion.
     :rtype: geopandas.GeoDataFrame
     """
-    geoms = []
+    gdfs = vectorise_low_density_thresholds(density_pathname, [min_soundings])
 
-    with rasterio.open(density_pathname) as dataset:
-        nodata = dataset.nodata
-        for _, window in dataset.block_windows():
-            transform = dataset.window_transform(window)
-            data = dataset.read(1, window=window)
-            mask = mask_finite(data, nodata)
-
-            # update mask with soundings that don't meet criterion
-            mask &= data < min_soundings
-
-            # vectorise
-            shapes = features.shapes(
-                data, mask, connectivity=8, transform=transform
+    return gdfs[min_soundings]
+
+
+def _concatenate_geoms(arrays: Sequence[numpy.ndarray]) -> numpy.ndarray:
+    """Concatenate geometry arrays, allowing for an empty sequence."""
+    return numpy.concatenate([numpy.empty(0, dtype=object), *arrays])
+
+
+def _vectorise_block(
+    dataset: rasterio.DatasetReader,
+    window: Window,
+    min_soundings: Sequence[int],
+) -> Dict[int, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Vectorise the connected regions of failing cells within a block, for
+    each criterion. Cells are dissolved irrespective of their density value.
+    Returns, for each criterion, a shapely geometry array of the regions
+    and a boolean array identifying regions touching the block boundary
+    (candidates for merging with regions of neighbouring blocks).
+    """
+    transform = dataset.window_transform(window)
+    data = dataset.read(1, window=window)
+    valid = mask_finite(data, dataset.nodata)
+    left, bottom, right, top = dataset.window_bounds(window)
+    eps = 0.5 * min(abs(transform.a), abs(transform.e))
+
+    result = {}
+    for minimum in min_soundings:
+        # update mask with soundings that don't meet criterion
+        mask = valid & (data < minimum)
+
+        # vectorise
+        shapes = features.shapes(
+            mask.astype("uint8"), mask, connectivity=8, transform=transform
+        )
+        geoms = numpy.array(
+            [shape(shp) for shp, _ in shapes], dtype=object
+        )
+
+        if geoms.size == 0:
+            seam = numpy.zeros(0, dtype="bool")
+        else:
+            bounds = shapely.bounds(geoms)
+            seam = (
+                (bounds[:, 0] <= left + eps)
+                | (bounds[:, 1] <= bottom + eps)
+                | (bounds[:, 2] >= right - eps)
+                | (bounds[:, 3] >= top - eps)
             )
-            for shp, _ in shapes:
-                geoms.append(shape(shp))
 
-        gdf = geopandas.GeoDataFrame({"geometry": geoms}, crs=dataset.crs)
+        result[minimum] = (geoms, seam)
+
+    return result
+
+
+def vectorise_low_density_thresholds(
+    density_pathname: Path,
+    min_soundings: Sequence[int],
+    threads: Optional[int] = None,
+) -> Dict[int, geopandas.GeoDataFrame]:
+    """
+    Vectorise the cells failing each of several minimum soundings per cell
+    criteria, within a single scan of the density grid.
+    See :func:`stream_low_density` for the details.
+
+    :param density_pathname: Pathname to the density grid file
+    :type density_pathname: class:`pathlib.Path`
+    :param min_soundings: Minumum values for a pixel to be considered valid
+    :type min_soundings: list
+    :param threads: Number of threads. Default is the CPU count
+    :type threads: int or None
+    :return: A dict mapping each criterion to a geopandas GeoDataFrame
+        containing the vectorised cell locations failing to meet it.
+    :rtype: dict
+    """
+    sinks = {minimum: vector_sink.MemorySink() for minimum in min_soundings}
+    stream_low_density(
+        density_pathname,
+        {minimum: [sink] for minimum, sink in sinks.items()},
+        threads,
+    )
+
+    return {minimum: sink.to_geodataframe() for minimum, sink in sinks.items()}
+
+
+def stream_low_density(
+    density_pathname: Path,
+    sinks: Dict[int, Sequence[vector_sink.VectorSink]],
+    threads: Optional[int] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+) -> None:
+    """
+    Vectorise the cells failing each of several minimum soundings per cell
+    criteria, within a single scan of the density grid, streaming the
+    geometries to the sinks of each criterion.
+    Blocks are vectorised in parallel by a pool of `threads` (see
+    :class:`blocks.BlockScheduler`). Regions entirely within a block are written
+    as each block completes. Regions touching a block boundary are held
+    back and merged with their neighbours once all blocks are processed,
+    so a region spanning several blocks results in a single polygon rather
+    than a fragment per block.
+
+    :param density_pathname: Pathname to the density grid file
+    :type density_pathname: class:`pathlib.Path`
+    :param sinks: A dict mapping each minimum soundings criterion to the
+        sinks receiving the geometries failing to meet it
+    :type sinks: dict
+    :param threads: Number of threads. Default is the CPU count
+    :type threads: int or None
+    :param profiler: If defined, records the time spent writing to the
+        sinks, and merging the regions across block boundaries
+    :type profiler: class:`profiling.Profiler` or None
+    :param progress: If defined, reports the cells vectorised as the
+        "vectorise" stage
+    :type progress: class:`progress.Progress` or None
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    min_soundings = list(sinks)
+
+    def write(minimum: int, geoms: numpy.ndarray) -> None:
+        with profiler.stage("write_vectors") as timing:
+            for sink in sinks[minimum]:
+                sink.write(geoms)
+            timing.add_items(len(geoms), "features")
+
+    def vectorise(datasets, window):
+        return _vectorise_block(datasets[0], window, min_soundings)
+
+    seams: Dict[int, List[numpy.ndarray]] = {m: [] for m in min_soundings}
+
+    with rasterio.open(density_pathname) as dataset:
+        crs = dataset.crs
+        cells = dataset.width * dataset.height
+        windows = [window for _, window in dataset.block_windows()]
+
+    for minimum_sinks in sinks.values():
+        for sink in minimum_sinks:
+            sink.open(crs)
+
+    try:
+        with progress.stage("vectorise", cells, "cells") as stage, \
+                blocks.BlockScheduler([density_pathname], threads) as scheduler:
+            for window, block in zip(windows, scheduler.map(vectorise, windows)):
+                for minimum, (geoms, seam) in block.items():
+                    write(minimum, geoms[~seam])
+                    seams[minimum].append(geoms[seam])
+                stage.update(int(window.width * window.height))
 
-    return gdf
+            for minimum in min_soundings:
+                with profiler.stage("merge_seams") as timing:
+                    seam_geoms = _concatenate_geoms(seams[minimum])
+                    merged = shapely.get_parts(shapely.union_all(seam_geoms))
+                    timing.add_items(len(seam_geoms), "features")
+                write(minimum, merged)
+    finally:
+        for minimum_sinks in sinks.values():
+            for sink in minimum_sinks:
+                sink.close()
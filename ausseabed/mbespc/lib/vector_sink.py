@@ -0,0 +1,223 @@
+"""
+Streaming sinks for vectorised geometries.
+Geometries are written in batches (e.g. a block at a time) as they are
+produced, rather than collecting everything into a single GeoDataFrame.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Type
+import json
+import logging
+
+import numpy
+import fiona  # type: ignore[import]
+from fiona.model import Feature  # type: ignore[import]
+import geopandas
+import pyproj
+import shapely
+from shapely.geometry import mapping
+from rasterio.crs import CRS  # type: ignore[import] # pylint: disable=E0611
+
+from ausseabed.mbespc.lib import errors
+
+LOG = logging.getLogger(__name__)
+
+
+class VectorSink:
+    """
+    Base interface for a streaming geometry sink.
+    A sink is opened with the CRS of the geometries, written to in batches
+    of shapely geometry arrays, and then closed.
+    Only a count of the features written is retained.
+    """
+
+    # filename extension of persisted outputs
+    extension = ""
+
+    def __init__(self) -> None:
+        self.crs: Optional[CRS] = None
+        self.feature_count = 0
+
+    def open(self, crs: CRS) -> None:
+        """Prepare the sink for geometries in the given CRS."""
+        self.crs = crs
+
+    def write(self, geoms: numpy.ndarray) -> None:
+        """Write a batch of geometries."""
+        self.feature_count += len(geoms)
+
+    def close(self) -> None:
+        """Finalise the sink."""
+
+
+class MemorySink(VectorSink):
+    """Collects the geometries in memory for conversion to a GeoDataFrame."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._geoms: List[numpy.ndarray] = []
+
+    def write(self, geoms: numpy.ndarray) -> None:
+        super().write(geoms)
+        self._geoms.append(geoms)
+
+    def to_geodataframe(self) -> geopandas.GeoDataFrame:
+        """The collected geometries as a GeoDataFrame."""
+        geoms = numpy.concatenate([numpy.empty(0, dtype=object), *self._geoms])
+
+        return geopandas.GeoDataFrame({"geometry": geoms}, crs=self.crs)
+
+
+class FionaSink(VectorSink):
+    """Streams geometries to an OGR datasource via fiona."""
+
+    driver = ""
+    layer_options: Dict[str, Any] = {}
+
+    def __init__(self, pathname: Path) -> None:
+        super().__init__()
+        self.pathname = pathname
+        self._collection = None
+
+    def open(self, crs: CRS) -> None:
+        super().open(crs)
+        schema = {"geometry": "Polygon", "properties": {}}
+        self._collection = fiona.open(
+            str(self.pathname),
+            "w",
+            driver=self.driver,
+            schema=schema,
+            crs=crs.to_wkt() if crs else None,
+            **self.layer_options,
+        )
+
+    def write(self, geoms: numpy.ndarray) -> None:
+        super().write(geoms)
+        self._collection.writerecords(
+            Feature.from_dict({"geometry": mapping(geom), "properties": {}})
+            for geom in geoms
+        )
+
+    def close(self) -> None:
+        if self._collection is not None:
+            self._collection.close()
+            self._collection = None
+
+
+class FlatGeobufSink(FionaSink):
+    """FlatGeobuf output including a packed Hilbert R-tree spatial index."""
+
+    driver = "FlatGeobuf"
+    extension = "fgb"
+    layer_options = {"SPATIAL_INDEX": "YES"}
+
+
+class GeoPackageSink(FionaSink):
+    """GeoPackage output."""
+
+    driver = "GPKG"
+    extension = "gpkg"
+
+
+class ShapefileSink(FionaSink):
+    """ESRI Shapefile output (subject to the 2 GB format limit)."""
+
+    driver = "ESRI Shapefile"
+    extension = "shp"
+
+
+class GeoParquetSink(VectorSink):
+    """
+    GeoParquet output, streamed a row group per batch.
+    Requires the optional pyarrow dependency.
+    """
+
+    extension = "parquet"
+
+    def __init__(self, pathname: Path) -> None:
+        super().__init__()
+        self.pathname = pathname
+        self._writer = None
+
+    def open(self, crs: CRS) -> None:
+        try:
+            import pyarrow  # type: ignore[import]
+            import pyarrow.parquet  # type: ignore[import]
+        except ImportError as err:
+            msg = "GeoParquet output requires pyarrow to be installed"
+            raise errors.MbesPcError(msg) from err
+
+        super().open(crs)
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {
+                "geometry": {
+                    "encoding": "WKB",
+                    "geometry_types": ["Polygon"],
+                    "crs": _projjson(crs),
+                }
+            },
+        }
+        schema = pyarrow.schema(
+            [pyarrow.field("geometry", pyarrow.binary())],
+            metadata={"geo": json.dumps(geo)},
+        )
+        self._pyarrow = pyarrow
+        self._writer = pyarrow.parquet.ParquetWriter(str(self.pathname), schema)
+
+    def write(self, geoms: numpy.ndarray) -> None:
+        super().write(geoms)
+        if len(geoms) == 0:
+            return
+        column = self._pyarrow.array(
+            shapely.to_wkb(geoms), type=self._pyarrow.binary()
+        )
+        self._writer.write_table(
+            self._pyarrow.Table.from_arrays([column], schema=self._writer.schema)
+        )
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _projjson(crs: Optional[CRS]) -> Optional[Dict[str, Any]]:
+    """PROJJSON representation of a CRS, as required by GeoParquet."""
+    if crs is None:
+        return None
+
+    return pyproj.CRS.from_wkt(crs.to_wkt()).to_json_dict()
+
+
+# available persisted output formats, keyed by name
+VECTOR_SINKS: Dict[str, Type[VectorSink]] = {
+    "fgb": FlatGeobufSink,
+    "gpkg": GeoPackageSink,
+    "parquet": GeoParquetSink,
+    "shp": ShapefileSink,
+}
+
+
+def from_format(fmt: str, outdir: Path, stem: str) -> VectorSink:
+    """
+    Create a file sink of the given format within `outdir`.
+
+    :param fmt: Name of the format, see `VECTOR_SINKS`
+    :type fmt: str
+    :param outdir: Directory to write the file to
+    :type outdir: class:`pathlib.Path`
+    :param stem: Filename without the extension
+    :type stem: str
+    :raises MbesPcError: Unknown format
+    :return: The sink
+    :rtype: class:`VectorSink`
+    """
+    if fmt not in VECTOR_SINKS:
+        raise errors.MbesPcError(f"Unknown vector format: {fmt}")
+
+    sink_cls = VECTOR_SINKS[fmt]
+    pathname = outdir / f"{stem}.{sink_cls.extension}"
+
+    return sink_cls(pathname)  # type: ignore[call-arg]
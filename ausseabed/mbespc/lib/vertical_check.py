@@ -0,0 +1,81 @@
+"""
+Vertical statistics check; the spread of the soundings of each node
+against the total vertical uncertainty (TVU) budget of its depth
+"""
+
+from typing import Optional
+import logging
+
+from ausseabed.qajson.model import QajsonParam
+from ausseabed.mbespc.lib import tvu_check, vertical_statistics, workers
+
+LOG = logging.getLogger(__name__)
+
+# relative weights of the stages reported to the progress callback
+PROGRESS_WEIGHTS = {
+    "points": 6.0,
+    "statistics": 2.0,
+}
+
+
+class VerticalStatisticsCheck(tvu_check.TvuCheck):
+    # details used by the QAX plugin
+    id = "8be06186-1a6f-4ec8-bd41-b3cbb9493747"
+    name = "Vertical Statistics Check"
+    version = "1"
+    input_params = [
+        # IHO S-44 Order 1a
+        QajsonParam("Constant TVU (a)", 0.5),
+        QajsonParam("Depth dependent TVU (b)", 0.013),
+        QajsonParam("Minimum Soundings per node", 5),
+        QajsonParam("Minimum nodes within TVU percentage", 95.0),
+        *workers.input_params(),
+    ]
+
+    progress_weights = PROGRESS_WEIGHTS
+    # the standard deviation requires at least two soundings
+    least_minimum_count = 2
+    default_minimum_count = 5
+    # the statistics grid; count, mean, std, min and max bands
+    output_filename = "vertical-statistics.tif"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+        # largest standard deviation and range of the evaluated nodes
+        self.max_std: Optional[float] = None
+        self.max_range: Optional[float] = None
+
+    def _evaluate(self) -> None:
+        """
+        The statistics of the points falling within each node of the grid
+        file are accumulated in a single pass of the point cloud files,
+        and the nodes with at least the minimum count are evaluated against
+        the TVU of their mean depth.
+        """
+        summary = vertical_statistics.vertical_statistics(
+            self.grid_file,
+            self.point_cloud_files,
+            self.output_pathname(),
+            self.tvu_a,
+            self.tvu_b,
+            self.minimum_count,
+            threads=self.threads,
+            profiler=self.profiler,
+            progress=self.progress,
+        )
+
+        self.summarise(summary)
+
+    def summarise(self, summary: vertical_statistics.VerticalSummary) -> None:
+        """
+        Populate the results of the check from the evaluation of the nodes;
+        either of its own run, or of the pass of the point files shared with
+        a density check (see `AlgorithmIndependentDensityCheck`).
+
+        :param summary: The evaluation of the nodes
+        :type summary: class:`vertical_statistics.VerticalSummary`
+        """
+        super().summarise(summary)
+        self.max_std = summary.max_std
+        self.max_range = summary.max_range
@@ -0,0 +1,753 @@
+"""
+Per cell vertical statistics of the soundings using NumPy and laspy.
+The count, mean, standard deviation, minimum and maximum depth of the
+points falling within each cell of the base grid are accumulated in a
+single streaming pass of the point files. Each chunk of points is reduced
+to per cell partial results, which are merged into the grid of
+accumulators using the parallel form of Welford's algorithm (Chan et al.),
+so files can be read concurrently and chunks merged in any order without
+the loss of precision of summing squares.
+The spread of the soundings of each cell is then evaluated against the
+total vertical uncertainty (TVU) budget of the cell's depth.
+The count accumulators are the point counts of the density check, so the
+two checks can share the one pass of the point files; see
+:func:`density_statistics`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+import logging
+import os
+import tempfile
+import threading
+
+import numpy
+import rasterio  # type: ignore[import]
+from rasterio.crs import CRS  # type: ignore[import] # pylint: disable=E0611
+from affine import Affine
+
+from ausseabed.mbespc.lib import blocks, errors, numpy_density, profiling, utils
+from ausseabed.mbespc.lib.progress import Progress, StageProgress
+from ausseabed.mbespc.lib.tiling import tile_windows
+
+LOG = logging.getLogger(__name__)
+
+# accumulator grids larger than this (number of cells) are backed by
+# memory mapped files rather than held in memory; each cell takes 36 bytes
+MAX_IN_MEMORY_CELLS = 2**25
+
+# bands of the vertical statistics grid, in order
+STATISTICS = ("count", "mean", "std", "min", "max")
+
+# depths can take any finite value, so cells without statistics are NaN
+NODATA = numpy.nan
+DTYPE = "float32"
+
+# the TVU is specified at the 95% confidence level, the spread of the
+# soundings is scaled by the matching z score of a normal distribution
+CONFIDENCE_SCALE = 1.96
+
+# edges of the histogram of the ratio of the scaled spread to the TVU;
+# cells beyond the last edge are binned in the final bin
+RATIO_EDGES = numpy.round(numpy.arange(0, 2.01, 0.1), 1)
+
+VERTICAL_GTIFF_OPTIONS = {
+    "compress": "deflate",
+    "zlevel": 6,
+    "tiled": "yes",
+    "blockxsize": 256,
+    "blockysize": 256,
+    "predictor": 3,
+}
+
+
+def total_vertical_uncertainty(
+    depth: numpy.ndarray, tvu_a: float, tvu_b: float
+) -> numpy.ndarray:
+    """
+    The maximum allowable total vertical uncertainty, at the 95% confidence
+    level, of a depth; sqrt(a^2 + (b * d)^2) as per IHO S-44.
+
+    :param depth: The depths (positive or negative, the magnitude is used)
+    :type depth: class:`numpy.ndarray`
+    :param tvu_a: The portion of the uncertainty that doesn't vary with
+        depth (metres)
+    :type tvu_a: float
+    :param tvu_b: The coefficient of the portion of the uncertainty that
+        varies with depth
+    :type tvu_b: float
+    :return: The TVU of each depth
+    :rtype: class:`numpy.ndarray`
+    """
+    return numpy.sqrt(tvu_a**2 + (tvu_b * numpy.abs(depth)) ** 2)
+
+
+class CellPartials(NamedTuple):
+    """Statistics of the points of a chunk, for each cell they fall within."""
+
+    # flat (row major) cell index, in ascending order
+    cells: numpy.ndarray
+    count: numpy.ndarray
+    mean: numpy.ndarray
+    # sum of the squared differences from the mean
+    m2: numpy.ndarray
+    minimum: numpy.ndarray
+    maximum: numpy.ndarray
+
+
+def chunk_statistics(index: numpy.ndarray, z: numpy.ndarray) -> CellPartials:
+    """
+    Reduce a chunk of points to the statistics of each cell. The squared
+    differences are taken from the mean of each cell within the chunk,
+    rather than accumulating the sum of squares.
+
+    :param index: Flat cell index for each point
+    :type index: class:`numpy.ndarray`
+    :param z: The z coordinate of each point
+    :type z: class:`numpy.ndarray`
+    :return: The partial statistics of the cells within the chunk
+    :rtype: class:`CellPartials`
+    """
+    if index.size == 0:
+        empty = numpy.zeros(0)
+        return CellPartials(
+            numpy.zeros(0, dtype="int64"), empty, empty, empty, empty, empty
+        )
+
+    order = numpy.argsort(index, kind="stable")
+    index = index[order]
+    z = numpy.asarray(z, dtype="float64")[order]
+
+    starts = numpy.flatnonzero(numpy.r_[True, index[1:] != index[:-1]])
+    count = numpy.diff(numpy.r_[starts, index.size])
+    mean = numpy.add.reduceat(z, starts) / count
+    m2 = numpy.add.reduceat((z - numpy.repeat(mean, count)) ** 2, starts)
+
+    return CellPartials(
+        index[starts],
+        count,
+        mean,
+        m2,
+        numpy.minimum.reduceat(z, starts),
+        numpy.maximum.reduceat(z, starts),
+    )
+
+
+def point_statistics(
+    x: numpy.ndarray,
+    y: numpy.ndarray,
+    z: numpy.ndarray,
+    transform: Affine,
+    width: int,
+    height: int,
+) -> CellPartials:
+    """
+    Reduce a chunk of points to the statistics of the cells of a grid they
+    fall within, as per :func:`chunk_statistics`. Points falling outside
+    of the grid are discarded.
+
+    :param x: The x coordinates
+    :type x: class:`numpy.ndarray`
+    :param y: The y coordinates
+    :type y: class:`numpy.ndarray`
+    :param z: The z coordinates
+    :type z: class:`numpy.ndarray`
+    :param transform: The affine transform of the grid
+    :type transform: class:`affine.Affine`
+    :param width: Number of columns in the grid
+    :type width: int
+    :param height: Number of rows in the grid
+    :type height: int
+    :return: The partial statistics of the cells within the chunk
+    :rtype: class:`CellPartials`
+    """
+    index, inside = numpy_density.cell_index(
+        x, y, transform, width, height, return_inside=True
+    )
+
+    return chunk_statistics(index, numpy.asarray(z)[inside])
+
+
+class CellStatistics:
+    """
+    Mergeable grid of per cell accumulators; the count, mean, sum of the
+    squared differences from the mean (M2), minimum and maximum of the
+    soundings within each cell. Grids larger than `MAX_IN_MEMORY_CELLS`
+    are backed by memory mapped files within `tmpdir`.
+    """
+
+    def __init__(
+        self, height: int, width: int, tmpdir: Optional[Path] = None
+    ) -> None:
+        self.shape = (height, width)
+        cells = height * width
+        if cells <= MAX_IN_MEMORY_CELLS or tmpdir is None:
+            tmpdir = None
+        else:
+            LOG.info(f"Using memory mapped vertical statistics: {tmpdir}")
+
+        self.count = self._allocate(tmpdir, "count", cells, "int32")
+        self.mean = self._allocate(tmpdir, "mean", cells, "float64")
+        self.m2 = self._allocate(tmpdir, "m2", cells, "float64")
+        # only defined where count > 0
+        self.minimum = self._allocate(tmpdir, "minimum", cells, "float64")
+        self.maximum = self._allocate(tmpdir, "maximum", cells, "float64")
+
+    @staticmethod
+    def _allocate(
+        tmpdir: Optional[Path], name: str, cells: int, dtype: str
+    ) -> numpy.ndarray:
+        if tmpdir is None:
+            return numpy.zeros(cells, dtype=dtype)
+
+        pathname = Path(tmpdir).joinpath(f"{name}.dat")
+
+        return numpy.memmap(pathname, dtype=dtype, mode="w+", shape=(cells,))
+
+    def update(self, partials: CellPartials) -> None:
+        """
+        Merge the partial statistics of a chunk into the accumulators.
+
+        :param partials: The partial statistics of each cell
+        :type partials: class:`CellPartials`
+        """
+        cells = partials.cells
+        if cells.size == 0:
+            return
+
+        count_a = self.count[cells].astype("int64")
+        mean_a = self.mean[cells]
+        count = count_a + partials.count
+        delta = partials.mean - mean_a
+        seen = count_a > 0
+
+        self.mean[cells] = mean_a + delta * (partials.count / count)
+        self.m2[cells] = (
+            self.m2[cells]
+            + partials.m2
+            + delta**2 * (count_a * partials.count / count)
+        )
+        self.minimum[cells] = numpy.where(
+            seen, numpy.minimum(self.minimum[cells], partials.minimum),
+            partials.minimum,
+        )
+        self.maximum[cells] = numpy.where(
+            seen, numpy.maximum(self.maximum[cells], partials.maximum),
+            partials.maximum,
+        )
+        self.count[cells] = count
+
+    def merge(self, other: "CellStatistics") -> None:
+        """
+        Merge the accumulators of another grid (e.g. of a further point
+        file) of the same shape into these accumulators.
+
+        :param other: The accumulators to merge
+        :type other: class:`CellStatistics`
+        """
+        if other.shape != self.shape:
+            raise errors.MbesPcError(
+                f"Can't merge statistics of shape {self.shape} and {other.shape}"
+            )
+
+        cells = numpy.flatnonzero(other.count)
+        self.update(
+            CellPartials(
+                cells,
+                other.count[cells],
+                other.mean[cells],
+                other.m2[cells],
+                other.minimum[cells],
+                other.maximum[cells],
+            )
+        )
+
+    def read(self, rows: slice, cols: slice) -> Dict[str, numpy.ndarray]:
+        """
+        The statistics of a window of cells. The standard deviation is the
+        sample standard deviation, and is NaN for cells with fewer than two
+        soundings, as are all statistics of cells without soundings.
+
+        :param rows: The rows of the window
+        :type rows: slice
+        :param cols: The columns of the window
+        :type cols: slice
+        :return: The statistics (see `STATISTICS`) of the window's cells
+        :rtype: dict
+        """
+        height, width = self.shape
+        count = self.count.reshape(height, width)[rows, cols].astype("int64")
+        empty = count == 0
+
+        def window(values: numpy.ndarray) -> numpy.ndarray:
+            result = numpy.array(values.reshape(height, width)[rows, cols])
+            result[empty] = numpy.nan
+            return result
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            std = numpy.sqrt(window(self.m2) / (count - 1))
+        std[count < 2] = numpy.nan
+
+        return {
+            "count": count,
+            "mean": window(self.mean),
+            "std": std,
+            "min": window(self.minimum),
+            "max": window(self.maximum),
+        }
+
+
+class VerticalSummary:
+    """
+    Mergeable partial result of evaluating the vertical statistics against
+    the TVU budget. Nodes are evaluated if they're valid within the base
+    grid and hold at least the minimum count of soundings; a node fails if
+    the spread of its soundings (`CONFIDENCE_SCALE` standard deviations)
+    exceeds the TVU of its mean depth.
+    """
+
+    def __init__(self) -> None:
+        # non-nodata nodes of the base grid
+        self.total_nodes = 0
+        # nodes with enough soundings to be evaluated
+        self.evaluated_nodes = 0
+        self.failed_nodes = 0
+        self.max_std = 0.0
+        # largest difference between the deepest and shallowest soundings
+        self.max_range = 0.0
+        # histogram of the ratio of the scaled spread to the TVU
+        self.ratio_hist = numpy.zeros(RATIO_EDGES.size, dtype="int64")
+
+    def update(
+        self,
+        statistics: Dict[str, numpy.ndarray],
+        valid: numpy.ndarray,
+        tvu_a: float,
+        tvu_b: float,
+        minimum_count: int,
+    ) -> None:
+        """
+        Evaluate a block of the vertical statistics.
+
+        :param statistics: The statistics of the block's cells
+        :type statistics: dict
+        :param valid: Boolean mask identifying the non-nodata cells of the
+            base grid
+        :type valid: class:`numpy.ndarray`
+        :param tvu_a: Depth independent TVU coefficient
+        :type tvu_a: float
+        :param tvu_b: Depth dependent TVU coefficient
+        :type tvu_b: float
+        :param minimum_count: Minimum soundings for a node to be evaluated
+        :type minimum_count: int
+        """
+        self.total_nodes += int(valid.sum())
+
+        evaluated = valid & (statistics["count"] >= minimum_count)
+        std = statistics["std"][evaluated]
+        if std.size == 0:
+            return
+
+        spread = statistics["max"][evaluated] - statistics["min"][evaluated]
+        tvu = total_vertical_uncertainty(
+            statistics["mean"][evaluated], tvu_a, tvu_b
+        )
+        ratio = CONFIDENCE_SCALE * std / tvu
+
+        self.evaluated_nodes += std.size
+        self.failed_nodes += int((ratio > 1).sum())
+        self.max_std = max(self.max_std, float(std.max()))
+        self.max_range = max(self.max_range, float(spread.max()))
+        bins = numpy.searchsorted(RATIO_EDGES, ratio, side="right") - 1
+        self.ratio_hist += numpy.bincount(bins, minlength=RATIO_EDGES.size)
+
+    def merge(self, other: "VerticalSummary") -> "VerticalSummary":
+        """
+        Combine two partial results into a new result.
+
+        :param other: The partial result to combine with
+        :type other: class:`VerticalSummary`
+        :return: The combined summary
+        :rtype: class:`VerticalSummary`
+        """
+        result = VerticalSummary()
+        result.total_nodes = self.total_nodes + other.total_nodes
+        result.evaluated_nodes = self.evaluated_nodes + other.evaluated_nodes
+        result.failed_nodes = self.failed_nodes + other.failed_nodes
+        result.max_std = max(self.max_std, other.max_std)
+        result.max_range = max(self.max_range, other.max_range)
+        result.ratio_hist = self.ratio_hist + other.ratio_hist
+
+        return result
+
+
+def accumulate_points(
+    point_cloud_pathname: Path,
+    crs: CRS,
+    transform: Affine,
+    statistics: CellStatistics,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    lock: Optional[threading.Lock] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Accumulate the vertical statistics of the points of a point cloud file.
+    Each chunk is reduced to per cell partial results concurrently, whilst
+    `lock` (if defined) guards the merge into the shared accumulators.
+
+    :param point_cloud_pathname: Pathname to the LAS/LAZ file
+    :type point_cloud_pathname: class:`pathlib.Path`
+    :param crs: The CRS of the base grid
+    :type crs: class:`rasterio.crs.CRS`
+    :param transform: The affine transform of the base grid
+    :type transform: class:`affine.Affine`
+    :param statistics: The accumulators to update
+    :type statistics: class:`CellStatistics`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param lock: Lock guarding updates to the accumulators, or None
+    :type lock: class:`threading.Lock` or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points read
+    :rtype: int
+    """
+    height, width = statistics.shape
+
+    n_points = 0
+    for x, y, z in numpy_density.read_points(point_cloud_pathname, crs, chunk_size):
+        partials = point_statistics(x, y, z, transform, width, height)
+        if lock is None:
+            statistics.update(partials)
+        else:
+            with lock:
+                statistics.update(partials)
+        n_points += x.size
+        if stage_progress is not None:
+            stage_progress.update(x.size)
+
+    return n_points
+
+
+def accumulate_files(
+    point_cloud_pathnames: Sequence[Path],
+    crs: CRS,
+    transform: Affine,
+    statistics: CellStatistics,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> int:
+    """
+    Accumulate the vertical statistics of several point cloud files into
+    the one grid of accumulators, reading the files concurrently using a
+    pool of `threads` (default is one per file, up to the CPU count).
+
+    :param point_cloud_pathnames: Pathnames to the LAS/LAZ files
+    :type point_cloud_pathnames: list
+    :param crs: The CRS of the base grid
+    :type crs: class:`rasterio.crs.CRS`
+    :param transform: The affine transform of the base grid
+    :type transform: class:`affine.Affine`
+    :param statistics: The accumulators to update
+    :type statistics: class:`CellStatistics`
+    :param chunk_size: Number of points to read per chunk
+    :type chunk_size: int
+    :param threads: Number of files read concurrently
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the points of each chunk
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The number of points read
+    :rtype: int
+    """
+    if not point_cloud_pathnames:
+        return 0
+
+    lock = threading.Lock()
+    file_threads = threads or min(len(point_cloud_pathnames), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=file_threads) as executor:
+        futures = [
+            executor.submit(
+                accumulate_points,
+                pathname,
+                crs,
+                transform,
+                statistics,
+                chunk_size,
+                lock,
+                stage_progress,
+            )
+            for pathname in point_cloud_pathnames
+        ]
+        return sum(future.result() for future in futures)
+
+
+def write_statistics(
+    grid_dataset_pathname: Path,
+    statistics: CellStatistics,
+    out_pathname: Optional[Path],
+    tvu_a: float,
+    tvu_b: float,
+    minimum_count: int,
+    threads: Optional[int] = None,
+    stage_progress: Optional[StageProgress] = None,
+) -> VerticalSummary:
+    """
+    Evaluate the vertical statistics of the nodes of the base grid, and
+    write them (if `out_pathname` is defined) as a multi-band GeoTIFF, one
+    band per `STATISTICS`, masked by the base grids' no-data mask.
+    Blocks are read and evaluated by a pool of `threads`, whilst the
+    calling thread writes the blocks in order.
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param statistics: The accumulated statistics
+    :type statistics: class:`CellStatistics`
+    :param out_pathname: Pathname of the output statistics grid, or None
+    :type out_pathname: class:`pathlib.Path` or None
+    :param tvu_a: Depth independent TVU coefficient
+    :type tvu_a: float
+    :param tvu_b: Depth dependent TVU coefficient
+    :type tvu_b: float
+    :param minimum_count: Minimum soundings for a node to be evaluated
+    :type minimum_count: int
+    :param threads: Number of threads reading the blocks. Default is the
+        CPU count
+    :type threads: int or None
+    :param stage_progress: If defined, updated with the cells of each block
+    :type stage_progress: class:`progress.StageProgress` or None
+    :return: The evaluation of the nodes
+    :rtype: class:`VerticalSummary`
+    """
+    summary = VerticalSummary()
+
+    def evaluate_block(datasets, window):
+        (src,) = datasets
+        rows, cols = window.toslices()
+        z_data = src.read(1, window=window)
+        valid = utils.mask_finite(z_data, src.nodata)
+        block_statistics = statistics.read(rows, cols)
+        block_summary = VerticalSummary()
+        block_summary.update(
+            block_statistics, valid, tvu_a, tvu_b, minimum_count
+        )
+        data = numpy.stack(
+            [block_statistics[name] for name in STATISTICS]
+        ).astype(DTYPE)
+        data[:, ~valid | (block_statistics["count"] == 0)] = NODATA
+        return window, data, block_summary
+
+    with blocks.BlockScheduler([grid_dataset_pathname], threads) as scheduler:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            kwargs: Dict[str, Any] = {
+                "driver": "GTiff",
+                "width": src.width,
+                "height": src.height,
+                "count": len(STATISTICS),
+                "dtype": DTYPE,
+                "crs": src.crs,
+                "transform": src.transform,
+                "nodata": NODATA,
+                **VERTICAL_GTIFF_OPTIONS,
+                "num_threads": scheduler.threads,
+            }
+            windows = tile_windows(src.width, src.height, 256)
+
+        outds = None
+        if out_pathname is not None:
+            outds = rasterio.open(str(out_pathname), "w", **kwargs)
+            outds.descriptions = STATISTICS
+        try:
+            for window, data, block_summary in scheduler.map(
+                evaluate_block, windows
+            ):
+                summary = summary.merge(block_summary)
+                if outds is not None:
+                    outds.write(data, window=window)
+                if stage_progress is not None:
+                    stage_progress.update(window.width * window.height)
+        finally:
+            if outds is not None:
+                outds.close()
+
+    return summary
+
+
+def vertical_statistics(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    out_pathname: Optional[Path],
+    tvu_a: float,
+    tvu_b: float,
+    minimum_count: int,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    threads: Optional[int] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+) -> VerticalSummary:
+    """
+    Workflow for evaluating the vertical statistics of the soundings.
+    Point cloud files are read concurrently by a pool of `threads`
+    (default is one per file, up to the CPU count), and their statistics
+    merged into the one grid of accumulators. If defined, the `profiler`
+    records the accumulation and evaluation stages, and `progress` reports
+    the points read ("points" stage) and the cells evaluated ("statistics"
+    stage).
+
+    :param grid_dataset_pathname: Pathname to the base grid file
+    :type grid_dataset_pathname: class:`pathlib.Path`
+    :param point_cloud_pathnames: Pathnames to the LAS/LAZ files
+    :type point_cloud_pathnames: list
+    :param out_pathname: Pathname of the output statistics grid, or None
+    :type out_pathname: class:`pathlib.Path` or None
+    :param tvu_a: Depth independent TVU coefficient
+    :type tvu_a: float
+    :param tvu_b: Depth dependent TVU coefficient
+    :type tvu_b: float
+    :param minimum_count: Minimum soundings for a node to be evaluated
+    :type minimum_count: int
+    :return: The evaluation of the nodes
+    :rtype: class:`VerticalSummary`
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
+    with tempfile.TemporaryDirectory(suffix=".vertical-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            statistics = CellStatistics(src.height, src.width, Path(tmpdir))
+            crs = src.crs
+            transform = src.transform
+
+        with profiler.stage("accumulate_points") as timing, progress.stage(
+            "points", total_points, "points"
+        ) as stage:
+            n_points = accumulate_files(
+                point_cloud_pathnames,
+                crs,
+                transform,
+                statistics,
+                chunk_size,
+                threads,
+                stage,
+            )
+            timing.add_items(n_points, "points")
+
+        cells = statistics.count.size
+        with profiler.stage("write_statistics") as timing, progress.stage(
+            "statistics", cells, "cells"
+        ) as stage:
+            summary = write_statistics(
+                grid_dataset_pathname,
+                statistics,
+                out_pathname,
+                tvu_a,
+                tvu_b,
+                minimum_count,
+                threads,
+                stage,
+            )
+            timing.add_items(cells, "cells")
+
+        # release the memory maps prior to the tmpdir cleanup
+        del statistics
+
+    return summary
+
+
+def density_statistics(
+    grid_dataset_pathname: Path,
+    point_cloud_pathnames: Sequence[Path],
+    density_pathname: Path,
+    statistics_pathname: Optional[Path],
+    tvu_a: float,
+    tvu_b: float,
+    minimum_count: int,
+    chunk_size: int = numpy_density.CHUNK_SIZE,
+    threads: Optional[int] = None,
+    failure_mask: Optional[utils.FailureMask] = None,
+    creation_options: Optional[Dict[str, Any]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    progress: Optional[Progress] = None,
+    histogram_cap: int = utils.HISTOGRAM_CAP,
+    overviews: Optional[utils.SumOverviews] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray, int, VerticalSummary]:
+    """
+    Workflow for creating the density grid and evaluating the vertical
+    statistics from a single pass of the point cloud files, for when the
+    density and vertical statistics checks share their inputs.
+    The count accumulator of the vertical statistics is the count grid of
+    the points (binned as per :mod:`numpy_density`), so the density grid
+    is written from it as per :func:`numpy_density.density`, followed by
+    the statistics as per :func:`vertical_statistics`.
+    If defined, `progress` reports the points read ("points" stage), the
+    cells of the density grid ("density" stage) and of the statistics
+    ("statistics" stage).
+    Returns the result of :func:`numpy_density.density`, along with the
+    evaluation of the vertical statistics.
+    """
+    profiler = profiler or profiling.Profiler()
+    progress = progress or Progress()
+    total_points = utils.header_point_count(point_cloud_pathnames)
+
+    with tempfile.TemporaryDirectory(suffix=".vertical-calcs") as tmpdir:
+        with rasterio.open(str(grid_dataset_pathname)) as src:
+            statistics = CellStatistics(src.height, src.width, Path(tmpdir))
+            crs = src.crs
+            transform = src.transform
+
+        LOG.info("Accumulating the point counts and vertical statistics")
+        with profiler.stage("accumulate_points") as timing, progress.stage(
+            "points", total_points, "points"
+        ) as stage:
+            n_points = accumulate_files(
+                point_cloud_pathnames,
+                crs,
+                transform,
+                statistics,
+                chunk_size,
+                threads,
+                stage,
+            )
+            timing.add_items(n_points, "points")
+
+        counts = statistics.count.reshape(statistics.shape)
+        LOG.info("Writing density grid with no data values")
+        with profiler.stage("write_density") as timing, progress.stage(
+            "density", counts.size, "cells"
+        ) as stage:
+            stats = numpy_density.write_density(
+                grid_dataset_pathname,
+                counts,
+                density_pathname,
+                failure_mask,
+                creation_options,
+                threads,
+                stage,
+                histogram_cap,
+                overviews,
+            )
+            timing.add_items(counts.size, "cells")
+
+        with profiler.stage("write_statistics") as timing, progress.stage(
+            "statistics", counts.size, "cells"
+        ) as stage:
+            summary = write_statistics(
+                grid_dataset_pathname,
+                statistics,
+                statistics_pathname,
+                tvu_a,
+                tvu_b,
+                minimum_count,
+                threads,
+                stage,
+            )
+            timing.add_items(counts.size, "cells")
+
+        # release the memory maps prior to the tmpdir cleanup
+        del counts, statistics
+
+    hist, bins = stats.histogram()
+
+    return hist, bins, stats.cell_count, summary
@@ -0,0 +1,24 @@
+"""
+QAJSON parameters of the pool of worker processes the checks are run
+within (see :func:`qajson_runner.run_checks`). Every check carries them,
+so they can be set from QAX; zero leaves the setting to its default.
+"""
+
+from typing import List
+
+from ausseabed.qajson.model import QajsonParam
+
+# number of checks run concurrently, each within a worker process
+WORKERS_PARAM = "Worker processes"
+
+# memory budget (MiB) of each worker, beyond which density grids are
+# calculated one tile at a time
+WORKER_MEMORY_PARAM = "Worker memory budget (MiB)"
+
+
+def input_params() -> List[QajsonParam]:
+    """The worker parameters, with their (unset) default values."""
+    return [
+        QajsonParam(WORKERS_PARAM, 0),
+        QajsonParam(WORKER_MEMORY_PARAM, 0),
+    ]
@@ -0,0 +1,4 @@
+"""
+Benchmark suite for the density check stages.
+Run with `python -m benchmarks --help` from the root of the repository.
+"""
@@ -0,0 +1,109 @@
+"""
+Command line interface of the benchmark suite, e.g.
+
+    python -m benchmarks -s 1m -s 10m -o results.json
+    python -m benchmarks -s 1m -o current.json --compare results.json
+"""
+
+from pathlib import Path
+import json
+import logging
+import sys
+
+import click
+
+from ausseabed.mbespc.lib.profiling import format_rss
+from benchmarks import data, measure
+from benchmarks.stages import STAGES
+
+
+@click.command()
+@click.option(
+    '-s', '--size',
+    type=click.Choice(list(data.SIZES)),
+    multiple=True,
+    default=["1m"],
+    show_default=True,
+    help="Survey size(s) to benchmark (number of points). May be repeated.",
+)
+@click.option(
+    '--stage',
+    type=click.Choice(list(STAGES)),
+    multiple=True,
+    help="Stage(s) to benchmark. Defaults to all stages. May be repeated.",
+)
+@click.option(
+    '-w', '--workdir',
+    type=click.Path(file_okay=False, resolve_path=True),
+    default="benchmark-data",
+    show_default=True,
+    help="Directory holding the generated datasets, re-used between runs.",
+)
+@click.option(
+    '-r', '--repeat',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of runs of each stage, the fastest is reported.",
+)
+@click.option(
+    '-o', '--output',
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help="Write the results to this JSON file.",
+)
+@click.option(
+    '--compare',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+    help="Baseline results JSON file to check for regressions against.",
+)
+@click.option(
+    '--tolerance',
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Fractional increase of wall time or peak RSS deemed a regression.",
+)
+def main(size, stage, workdir, repeat, output, compare, tolerance):
+    """Benchmark the density check stages on synthetic surveys."""
+    logging.basicConfig(level=logging.INFO)
+    stages = list(stage) or list(STAGES)
+    results = []
+
+    for size_name in size:
+        details = data.dataset(Path(workdir), size_name)
+        for stage_name in stages:
+            result = measure.measure(stage_name, details, repeat)
+            results.append(result)
+            if result["status"] == "ok":
+                click.echo(
+                    f"{stage_name:>24} {size_name:>5}: "
+                    f"{result['wall_time']:9.3f} s, "
+                    f"{result['throughput']:12.0f} {result['unit']}/s, "
+                    f"{format_rss(result['peak_rss']):>8} MiB peak RSS"
+                )
+            else:
+                click.echo(
+                    f"{stage_name:>24} {size_name:>5}: {result['status']} "
+                    f"({result.get('reason')})"
+                )
+
+    if output is not None:
+        with open(output, "w") as outf:
+            json.dump(
+                {"environment": measure.environment(), "results": results},
+                outf,
+                indent=4,
+            )
+
+    if compare is not None:
+        with open(compare) as src:
+            baseline = json.load(src)["results"]
+        regressions = measure.compare(results, baseline, tolerance)
+        for regression in regressions:
+            click.echo(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Synthetic survey datasets for the benchmarks, built with the streaming
+test file builders in `tests.ausseabed.testutils`.
+Datasets are generated once per size into a working directory and re-used
+by subsequent runs.
+"""
+
+from pathlib import Path
+from typing import Dict, Tuple
+import json
+import logging
+
+import numpy
+import laspy
+import pyproj
+from osgeo import gdal  # type: ignore[import]
+
+from tests.ausseabed.testutils import LasTestFileBuilder, TifTestFileBuilder
+
+LOG = logging.getLogger(__name__)
+
+# survey sizes; number of points, and the grid width and height (cells)
+SIZES: Dict[str, Tuple[int, int, int]] = {
+    "tiny": (100_000, 500, 500),
+    "1m": (1_000_000, 2_000, 2_000),
+    "10m": (10_000_000, 5_000, 5_000),
+    "100m": (100_000_000, 20_000, 20_000),
+}
+
+EPSG = 32755
+RESOLUTION = 1.0
+ORIGIN_X = 300_000.0
+ORIGIN_Y = 5_800_000.0
+
+# period (cells) of the variation in point density, giving low density
+# regions that span several blocks
+DENSITY_PERIOD = 300.0
+
+# radius (cells) of the no-data holes within the base grid
+HOLE_RADIUS = 50.0
+
+
+def _density_field(rows: numpy.ndarray, cols: numpy.ndarray) -> numpy.ndarray:
+    """
+    Expected point density for the given cells; smoothly varying between
+    roughly 0 and 30 points per cell (a mean of 15).
+    """
+    return 15.0 + 15.0 * numpy.sin(cols / DENSITY_PERIOD) * numpy.cos(
+        rows / DENSITY_PERIOD
+    )
+
+
+def write_points(pathname: Path, n_points: int, width: int, height: int) -> int:
+    """
+    Write a point cloud covering the grid, with approximately `n_points`
+    points following the density field. Returns the number of points.
+    """
+    factor = n_points / (15.0 * width * height)
+
+    builder = LasTestFileBuilder(
+        densities=lambda rows, cols: factor * _density_field(rows, cols),
+        top_left_x=ORIGIN_X,
+        top_left_y=ORIGIN_Y,
+        resolution=RESOLUTION,
+        crs=pyproj.CRS.from_epsg(EPSG),
+        output_file=pathname,
+        width=width,
+        height=height,
+        seed=0,
+    )
+    builder.run()
+
+    with laspy.open(str(pathname)) as reader:
+        return int(reader.header.point_count)
+
+
+def write_grid(pathname: Path, width: int, height: int) -> None:
+    """
+    Write a tiled float32 depth grid with randomly placed no-data holes.
+    """
+    rng = numpy.random.default_rng(1)
+
+    builder = TifTestFileBuilder(
+        values=lambda rows, cols: -rng.uniform(20, 60, rows.shape),
+        top_left_x=ORIGIN_X,
+        top_left_y=ORIGIN_Y,
+        resolution=RESOLUTION,
+        crs=pyproj.CRS.from_epsg(EPSG),
+        output_file=pathname,
+        width=width,
+        height=height,
+        data_type=gdal.GDT_Float32,
+        tiled=True,
+        nodata_holes=max(1, width * height // 100_000),
+        hole_radius=HOLE_RADIUS,
+        seed=1,
+    )
+    builder.run()
+
+
+def write_density(pathname: Path, width: int, height: int) -> int:
+    """
+    Write a tiled (unmasked) int32 density grid drawn from a Poisson
+    distribution of the density field. Returns the maximum density.
+    """
+    rng = numpy.random.default_rng(2)
+    maxv = 0
+
+    def density(rows, cols):
+        nonlocal maxv
+        data = rng.poisson(_density_field(rows, cols))
+        maxv = max(maxv, int(data.max()))
+        return data
+
+    builder = TifTestFileBuilder(
+        values=density,
+        top_left_x=ORIGIN_X,
+        top_left_y=ORIGIN_Y,
+        resolution=RESOLUTION,
+        crs=pyproj.CRS.from_epsg(EPSG),
+        output_file=pathname,
+        width=width,
+        height=height,
+        data_type=gdal.GDT_Int32,
+        tiled=True,
+    )
+    builder.run()
+
+    return maxv
+
+
+def dataset(workdir: Path, size: str) -> Dict:
+    """
+    Generate (if required) the point cloud, base grid and density grid for
+    a given survey size, returning their details.
+
+    :param workdir: Directory to hold the datasets
+    :type workdir: class:`pathlib.Path`
+    :param size: Name of the survey size, see `SIZES`
+    :type size: str
+    :return: A dict of the dataset details
+    :rtype: dict
+    """
+    n_points, width, height = SIZES[size]
+    outdir = Path(workdir) / size
+    manifest = outdir / "dataset.json"
+
+    if manifest.exists():
+        with open(manifest) as src:
+            return json.load(src)
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    details = {
+        "size": size,
+        "width": width,
+        "height": height,
+        "cells": width * height,
+        "point_file": str(outdir / "points.laz"),
+        "grid_file": str(outdir / "grid.tif"),
+        "density_file": str(outdir / "density.tif"),
+    }
+
+    LOG.info(f"Generating {size} dataset within {outdir}")
+    details["points"] = write_points(
+        Path(details["point_file"]), n_points, width, height
+    )
+    write_grid(Path(details["grid_file"]), width, height)
+    details["max_density"] = write_density(
+        Path(details["density_file"]), width, height
+    )
+
+    with open(manifest, "w") as outf:
+        json.dump(details, outf, indent=4)
+
+    return details
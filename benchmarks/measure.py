@@ -0,0 +1,136 @@
+"""
+Timing, peak memory and throughput measurement of the benchmark stages.
+Each stage runs within a fresh (spawned) worker process, so the peak
+resident set size is attributable to that stage alone.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+import multiprocessing
+import platform
+import tempfile
+import time
+
+from ausseabed.mbespc.lib.profiling import peak_rss
+from benchmarks.stages import STAGES
+
+
+def _run_stage(stage: str, details: Dict, repeat: int) -> Dict[str, Any]:
+    """
+    Time a stage within the current process, keeping the fastest of
+    `repeat` runs.
+    """
+    result: Dict[str, Any] = {
+        "stage": stage,
+        "size": details["size"],
+        "status": "ok",
+    }
+    timings = []
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(suffix=".benchmark") as tmpdir:
+            try:
+                run, items, unit = STAGES[stage](details, Path(tmpdir))
+            except ImportError as err:
+                result["status"] = "skipped"
+                result["reason"] = str(err)
+                return result
+
+            setup_rss = peak_rss()
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            run()
+            timings.append(
+                (time.perf_counter() - wall, time.process_time() - cpu)
+            )
+
+    wall_time, cpu_time = min(timings)
+    result.update(
+        {
+            "items": items,
+            "unit": unit,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "throughput": items / wall_time if wall_time > 0 else None,
+            "setup_peak_rss": setup_rss,
+            "peak_rss": peak_rss(),
+        }
+    )
+
+    return result
+
+
+def measure(stage: str, details: Dict, repeat: int = 1) -> Dict[str, Any]:
+    """
+    Measure a stage within a fresh worker process.
+
+    :param stage: Name of the stage, see `STAGES`
+    :type stage: str
+    :param details: The dataset details, see :func:`data.dataset`
+    :type details: dict
+    :param repeat: Number of runs, the fastest of which is reported
+    :type repeat: int
+    :return: A dict of the wall and CPU time (seconds), peak RSS (bytes),
+        and throughput (items per second)
+    :rtype: dict
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_stage, stage, details, repeat).result()
+
+
+def environment() -> Dict[str, Any]:
+    """Details of the machine and library versions the suite ran with."""
+    import numpy
+    import rasterio  # type: ignore[import]
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+    }
+
+
+def compare(
+    results: Sequence[Dict[str, Any]],
+    baseline: Sequence[Dict[str, Any]],
+    tolerance: float = 0.2,
+) -> List[str]:
+    """
+    Identify regressions of the wall time or peak RSS relative to a
+    baseline, beyond the given fractional tolerance.
+
+    :param results: The current results
+    :type results: list
+    :param baseline: The baseline results
+    :type baseline: list
+    :param tolerance: Allowed fractional increase, e.g. 0.2 is 20%
+    :type tolerance: float
+    :return: A description of each regression
+    :rtype: list
+    """
+    previous = {
+        (r["stage"], r["size"]): r for r in baseline if r["status"] == "ok"
+    }
+    regressions = []
+
+    for result in results:
+        base = previous.get((result["stage"], result["size"]))
+        if result["status"] != "ok" or base is None:
+            continue
+        for metric in ("wall_time", "peak_rss"):
+            # peak RSS isn't available on every platform
+            if result[metric] is None or base[metric] is None:
+                continue
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['stage']} ({result['size']}): {metric} "
+                    f"{result[metric]:.4g} vs {base[metric]:.4g}"
+                )
+
+    return regressions
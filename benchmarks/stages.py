@@ -0,0 +1,140 @@
+"""
+The density check stages being benchmarked.
+Each stage prepares its inputs within a scratch directory and returns the
+callable to be timed, the number of items it processes, and the unit of
+those items (used to report the throughput).
+Imports are deferred to the stage, so stages whose optional dependencies
+are missing (e.g. PDAL) are skipped rather than failing the suite.
+"""
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+import shutil
+
+Prepared = Tuple[Callable[[], Any], int, str]
+
+
+def pdal_density(details: Dict, tmpdir: Path) -> Prepared:
+    """Density grid via the PDAL pipeline (pdal_pipeline.density)."""
+    from ausseabed.mbespc.lib import pdal_pipeline
+
+    def run():
+        pdal_pipeline.density(
+            Path(details["grid_file"]),
+            [Path(details["point_file"])],
+            tmpdir / "out.tif",
+        )
+
+    return run, details["points"], "points"
+
+
+def pdal_stream_density(details: Dict, tmpdir: Path) -> Prepared:
+    """Density grid streaming PDAL's points (pdal_stream.density)."""
+    from ausseabed.mbespc.lib import pdal_stream
+
+    def run():
+        pdal_stream.density(
+            Path(details["grid_file"]),
+            [Path(details["point_file"])],
+            tmpdir / "out.tif",
+        )
+
+    return run, details["points"], "points"
+
+
+def numpy_density(details: Dict, tmpdir: Path) -> Prepared:
+    """Density grid via the NumPy engine (numpy_density.density)."""
+    from ausseabed.mbespc.lib import numpy_density as engine
+
+    def run():
+        engine.density(
+            Path(details["grid_file"]),
+            [Path(details["point_file"])],
+            tmpdir / "out.tif",
+        )
+
+    return run, details["points"], "points"
+
+
+def numpy_density_serial(details: Dict, tmpdir: Path) -> Prepared:
+    """
+    Density grid via the NumPy engine with a single thread, decompressing
+    the LAZ chunks serially (numpy_density.density).
+    """
+    from ausseabed.mbespc.lib import numpy_density as engine
+
+    def run():
+        engine.density(
+            Path(details["grid_file"]),
+            [Path(details["point_file"])],
+            tmpdir / "out.tif",
+            threads=1,
+        )
+
+    return run, details["points"], "points"
+
+
+def update_density_no_data(details: Dict, tmpdir: Path) -> Prepared:
+    """Applying the base grids' no-data mask (utils.update_density_no_data)."""
+    from ausseabed.mbespc.lib import utils
+
+    # the grid is updated in place, so operate on a copy
+    density_pathname = tmpdir / "density.tif"
+    shutil.copy(details["density_file"], density_pathname)
+
+    def run():
+        utils.update_density_no_data(
+            Path(details["grid_file"]), density_pathname
+        )
+
+    return run, details["cells"], "cells"
+
+
+def histogram_point_density(details: Dict, tmpdir: Path) -> Prepared:
+    """Density histogram (utils.histogram_point_density)."""
+    from ausseabed.mbespc.lib import utils
+
+    def run():
+        utils.histogram_point_density(
+            Path(details["density_file"]), details["max_density"]
+        )
+
+    return run, details["cells"], "cells"
+
+
+def vectorise_low_density(details: Dict, tmpdir: Path) -> Prepared:
+    """Vectorising the low density cells (utils.vectorise_low_density)."""
+    from ausseabed.mbespc.lib import utils
+
+    def run():
+        utils.vectorise_low_density(Path(details["density_file"]), 5)
+
+    return run, details["cells"], "cells"
+
+
+def spatial_outputs(details: Dict, tmpdir: Path) -> Prepared:
+    """
+    The QAX plugin's buffer, simplify and reproject of the low density
+    regions (qajson_runner.spatial_outputs).
+    """
+    from ausseabed.mbespc.lib import qajson_runner, utils
+
+    gdf = utils.vectorise_low_density(Path(details["density_file"]), 5)
+
+    def run():
+        qajson_runner.spatial_outputs(Path(details["grid_file"]), gdf)
+
+    return run, len(gdf), "features"
+
+
+# available stages, in pipeline order
+STAGES: Dict[str, Callable[[Dict, Path], Prepared]] = {
+    "pdal_density": pdal_density,
+    "pdal_stream_density": pdal_stream_density,
+    "numpy_density": numpy_density,
+    "numpy_density_serial": numpy_density_serial,
+    "update_density_no_data": update_density_no_data,
+    "histogram_point_density": histogram_point_density,
+    "vectorise_low_density": vectorise_low_density,
+    "spatial_outputs": spatial_outputs,
+}
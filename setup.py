@@ -35,7 +35,8 @@ setup(
         'Click',
         'ausseabed.qajson',
         'geopandas>=0.14.1',
-        'laspy',
+        'shapely>=2',
+        'laspy[lazrs]',
         'fiona',
     ],
     tests_require=['pytest'],
@@ -0,0 +1,55 @@
+import threading
+
+import numpy
+
+from ausseabed.mbespc.lib import blocks
+from tests.ausseabed.testutils import write_grid
+
+# several blocks of the small grids are scheduled
+TILED = {"tiled": "yes", "blockxsize": 16, "blockysize": 16}
+
+
+def test_block_scheduler(tmp_path):
+    """
+    Results are yielded in block order, and each thread reads through
+    its own dataset handles.
+    """
+    data = numpy.arange(40 * 50, dtype="int32").reshape(40, 50)
+    pathname = tmp_path / "data.tif"
+    write_grid(pathname, data, None, **TILED)
+    windows = blocks.block_windows(pathname)
+    handles = {}
+
+    def block_sum(datasets, window):
+        handles.setdefault(threading.get_ident(), set()).add(id(datasets[0]))
+        return window, int(datasets[0].read(1, window=window).sum())
+
+    with blocks.BlockScheduler([pathname], threads=3) as scheduler:
+        results = list(scheduler.map(block_sum, windows))
+
+    assert len(windows) == 12
+    assert [window for window, _ in results] == windows
+    assert sum(total for _, total in results) == data.sum()
+    for window, total in results:
+        rows, cols = window.toslices()
+        assert total == data[rows, cols].sum()
+
+    # one handle per thread
+    assert all(len(ids) == 1 for ids in handles.values())
+    assert len(set.union(*handles.values())) == len(handles)
+
+
+def test_block_scheduler_bounded(tmp_path):
+    """No more than `max_pending` blocks are in flight at once."""
+    pathname = tmp_path / "data.tif"
+    write_grid(pathname, numpy.zeros((64, 64), dtype="uint8"), None, **TILED)
+    windows = blocks.block_windows(pathname)
+    submitted = []
+
+    def record(datasets, window):
+        submitted.append(window)
+        return window
+
+    with blocks.BlockScheduler([pathname], threads=2, max_pending=3) as scheduler:
+        for i, _ in enumerate(scheduler.map(record, windows)):
+            assert len(submitted) <= i + 3
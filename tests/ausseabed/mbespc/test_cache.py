@@ -0,0 +1,189 @@
+import hashlib
+import os
+
+import numpy
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from affine import Affine
+
+from ausseabed.mbespc.lib import cache, errors
+
+
+def _key(name):
+    """A cache key (sha256 hex digest) standing in for that of some inputs."""
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    grid_pathname = tmp_path / "grid.tif"
+    point_pathname = tmp_path / "points.las"
+    density_pathname = tmp_path / "density.tif"
+
+    kwargs = {
+        "width": 4,
+        "height": 3,
+        "count": 1,
+        "dtype": "int32",
+        "crs": CRS.from_epsg(32755),
+        "transform": Affine(1.0, 0.0, 0.0, 0.0, -1.0, 0.0),
+        "driver": "GTiff",
+        "nodata": -9999,
+    }
+    for pathname in (grid_pathname, density_pathname):
+        with rasterio.open(pathname, "w", **kwargs) as outds:
+            outds.write(numpy.ones((3, 4), dtype="int32"), 1)
+
+    point_pathname.write_bytes(b"points")
+
+    return grid_pathname, point_pathname, density_pathname
+
+
+def test_key(inputs):
+    """Keys are stable, and change with the engine and input files."""
+    grid_pathname, point_pathname, _ = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+
+    key, _ = density_cache.key(grid_pathname, [point_pathname], "pdal")
+
+    assert key == density_cache.key(grid_pathname, [point_pathname], "pdal")[0]
+    assert key != density_cache.key(grid_pathname, [point_pathname], "numpy")[0]
+
+    point_pathname.write_bytes(b"more points")
+
+    assert key != density_cache.key(grid_pathname, [point_pathname], "pdal")[0]
+
+
+def test_put_get(inputs):
+    """Cached statistics round trip, and unknown keys miss."""
+    grid_pathname, point_pathname, density_pathname = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+    key, key_inputs = density_cache.key(grid_pathname, [point_pathname], "pdal")
+
+    assert density_cache.get(key) is None
+
+    hist = numpy.array([0, 2, 10])
+    bins = numpy.arange(3)
+    density_cache.put(key, key_inputs, density_pathname, hist, bins, 12)
+    entry = density_cache.get(key)
+    c_hist, c_bins, c_cell_count = entry.statistics()
+
+    assert entry.density_pathname.exists()
+    assert (c_hist == hist).all()
+    assert (c_bins == bins).all()
+    assert c_cell_count == 12
+    assert density_cache.purge() == [key]
+    assert density_cache.entries() == []
+
+
+def test_reserve(inputs):
+    """Grids written to the reserved pathname are stored in place."""
+    grid_pathname, _, density_pathname = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+    hist = numpy.array([0, 12])
+    bins = numpy.arange(2)
+
+    reserved = density_cache.reserve(_key("a"))
+    reserved.write_bytes(density_pathname.read_bytes())
+
+    assert density_cache.get(_key("a")) is None
+    assert density_cache.entries() == []
+
+    entry = density_cache.put(_key("a"), {}, reserved, hist, bins, 12)
+
+    assert entry.density_pathname.read_bytes() == density_pathname.read_bytes()
+    assert density_cache.get(_key("a")) is not None
+    # the reservation is published as the entry, rather than copied
+    assert not reserved.exists()
+    assert list(density_cache.cache_dir.iterdir()) == [entry.pathname]
+
+
+def test_concurrent_reservations(inputs):
+    """
+    Runs reserving the same key write separate grids; the first entry
+    published is kept, and the other reservations are discarded.
+    """
+    grid_pathname, _, density_pathname = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+    key = _key("a")
+    hist = numpy.array([0, 12])
+    bins = numpy.arange(2)
+
+    first, second, failed = [density_cache.reserve(key) for _ in range(3)]
+
+    assert len({first, second, failed}) == 3
+
+    first.write_bytes(b"first")
+    second.write_bytes(b"second")
+    density_cache.put(key, {}, first, hist, bins, 12)
+    entry = density_cache.put(key, {}, second, hist, bins, 12)
+    density_cache.release(failed)
+
+    assert entry.density_pathname.read_bytes() == b"first"
+    assert [e.key for e in density_cache.entries()] == [key]
+    assert list(density_cache.cache_dir.iterdir()) == [entry.pathname]
+
+
+def test_evict(inputs):
+    """The least recently used entries are evicted first."""
+    grid_pathname, _, density_pathname = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+    hist = numpy.array([0, 12])
+    bins = numpy.arange(2)
+
+    a, b, c = _key("a"), _key("b"), _key("c")
+    for i, key in enumerate([a, b, c]):
+        entry = density_cache.put(key, {}, density_pathname, hist, bins, 12)
+        os.utime(entry.pathname, (i, i))
+
+    # mark "a" as recently used
+    density_cache.get(a)
+    # entry sizes differ by a few bytes, as the stats hold their creation time
+    sizes = {e.key: e.size for e in density_cache.entries()}
+    density_cache.max_bytes = sizes[a] + sizes[c]
+
+    assert density_cache.evict() == [b]
+    assert sorted(e.key for e in density_cache.entries()) == sorted([a, c])
+
+
+@pytest.mark.parametrize(
+    "key", ["../victim", "/tmp/victim", "..", "victim", _key("a").upper()]
+)
+def test_invalid_key(tmp_path, key):
+    """
+    Keys other than a sha256 hex digest are rejected, so no directory
+    outside of the cache is ever removed.
+    """
+    victim = tmp_path / "victim"
+    victim.mkdir()
+    density_cache = cache.DensityCache(tmp_path / "cache")
+    (tmp_path / "cache").mkdir()
+
+    with pytest.raises(errors.MbesPcError):
+        density_cache.purge(key)
+    with pytest.raises(errors.MbesPcError):
+        density_cache.get(key)
+
+    assert victim.is_dir()
+
+
+def test_purge_ignores_foreign_directories(inputs):
+    """Purging the cache only removes the directories of cache entries."""
+    grid_pathname, _, density_pathname = inputs
+    density_cache = cache.DensityCache(grid_pathname.parent / "cache")
+    key = _key("a")
+    density_cache.put(
+        key, {}, density_pathname, numpy.array([0, 12]), numpy.arange(2), 12
+    )
+    # neither is an entry; the latter is named as one but holds no stats
+    foreign = [
+        density_cache.cache_dir / "notacache",
+        density_cache.cache_dir / _key("b"),
+    ]
+    for pathname in foreign:
+        pathname.mkdir()
+        pathname.joinpath("data.txt").write_text("user data")
+
+    assert density_cache.purge() == [key]
+    assert all(pathname.joinpath("data.txt").exists() for pathname in foreign)
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from ausseabed.mbespc.lib import cancellation, errors, progress
+
+
+def test_cancellation():
+    """Checkpoints raise once stopped, or once the timeout elapses."""
+    stopped = False
+    cancel = cancellation.Cancellation(lambda: stopped)
+    assert cancel.active
+    cancel.check()
+
+    stopped = True
+    with pytest.raises(errors.CheckCancelled):
+        cancel.check()
+
+    cancel = cancellation.Cancellation(timeout=0.01)
+    cancel.check()
+    time.sleep(0.02)
+    with pytest.raises(errors.CheckTimeout):
+        cancel.check()
+
+    assert not cancellation.Cancellation().active
+
+
+def test_progress_checkpoints():
+    """Stage updates are cancellation checkpoints."""
+    stopped = False
+    prog = progress.Progress(
+        cancellation=cancellation.Cancellation(lambda: stopped)
+    )
+    assert prog.cancellable
+
+    with pytest.raises(errors.CheckCancelled):
+        with prog.stage("points", total=10) as stage:
+            stage.update(5)
+            stopped = True
+            stage.update(5)
+
+    assert stage.done == 5
+    with pytest.raises(errors.CheckCancelled):
+        with prog.stage("density"):
+            pass
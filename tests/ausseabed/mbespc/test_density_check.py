@@ -60,3 +60,20 @@ def test_density_check_simple(data_files):
             all(check.histogram[i] == val for i, val in enumerate(hist)),
         ]
     )
+
+
+def test_density_check_sweep(data_files):
+    """
+    Several thresholds are evaluated from the one density grid.
+    """
+    test_las, test_tif = data_files
+    check = AlgorithmIndependentDensityCheck(
+        test_las, test_tif, 5, 0.83, return_gdf=True
+    )
+    results = check.sweep([(2, 80.0), (5, 80.0), (6, 80.0)], vectorise=True)
+
+    assert [r.failed_nodes for r in results] == [2, 2, 8]
+    assert [r.passed for r in results] == [True, True, False]
+    assert all(r.total_nodes == 12 for r in results)
+    assert [len(r.gdf) for r in results] == [r.low_density_regions for r in results]  # noqa: E501
+    assert all(r.low_density_regions > 0 for r in results)
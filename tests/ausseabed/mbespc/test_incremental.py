@@ -0,0 +1,104 @@
+import os
+
+import numpy
+import pytest
+import rasterio
+
+from ausseabed.mbespc.lib import incremental, numpy_density
+from ausseabed.mbespc.lib.density_check import AlgorithmIndependentDensityCheck
+from tests.ausseabed.testutils import write_grid, write_points
+
+
+@pytest.fixture
+def survey(tmp_path):
+    grid = numpy.ones((20, 30), dtype="float32")
+    grid[:5, :5] = -9999
+    grid_pathname = write_grid(tmp_path / "grid.tif", grid)
+
+    rng = numpy.random.default_rng(0)
+    point_pathnames = []
+    for i in range(3):
+        pathname = tmp_path / f"line-{i}.las"
+        write_points(
+            pathname, rng.uniform(100, 130, 2000), rng.uniform(180, 200, 2000)
+        )
+        point_pathnames.append(pathname)
+
+    return grid_pathname, point_pathnames
+
+
+def test_pending(survey, tmp_path):
+    """Only the point files missing from the manifest are pending."""
+    grid_pathname, point_pathnames = survey
+    count_grid = incremental.CountGrid(tmp_path / "counts.tif")
+    counts = numpy.arange(600, dtype="int32").reshape(20, 30)
+
+    with rasterio.open(grid_pathname) as src:
+        assert count_grid.pending(src, point_pathnames) == (False, point_pathnames)
+
+        count_grid.write(counts, src, point_pathnames[:2])
+        assert count_grid.pending(src, point_pathnames) == (
+            True,
+            point_pathnames[2:],
+        )
+
+        # a counted file that changes requires the counts to be rebuilt
+        os.utime(point_pathnames[0], (0, 0))
+        assert count_grid.pending(src, point_pathnames) == (False, point_pathnames)
+
+    read = numpy.zeros_like(counts)
+    count_grid.read(read)
+    assert (read == counts).all()
+
+
+def test_density(survey, tmp_path):
+    """Incremental updates match calculating the density in one go."""
+    grid_pathname, point_pathnames = survey
+    count_grid = incremental.CountGrid(tmp_path / "counts.tif")
+
+    incremental.density(
+        grid_pathname, point_pathnames[:1], tmp_path / "day-1.tif", count_grid
+    )
+    hist, bins, cell_count = incremental.density(
+        grid_pathname, point_pathnames, tmp_path / "day-2.tif", count_grid
+    )
+    expected = numpy_density.density(
+        grid_pathname, point_pathnames, tmp_path / "full.tif"
+    )
+
+    assert (hist == expected[0]).all()
+    assert (bins == expected[1]).all()
+    assert cell_count == expected[2]
+
+    with rasterio.open(tmp_path / "day-2.tif") as src:
+        day_2 = src.read(1)
+    with rasterio.open(tmp_path / "full.tif") as src:
+        assert (day_2 == src.read(1)).all()
+
+    manifest = count_grid.manifest()
+    assert len(manifest["point_files"]) == len(point_pathnames)
+
+
+def test_density_check_bypasses_cache(survey, tmp_path):
+    """
+    With a cache directory, the count grid is still updated with the
+    point files added since the previous run.
+    """
+    grid_pathname, point_pathnames = survey
+    count_grid = tmp_path / "counts.tif"
+
+    for pathnames in (point_pathnames[:1], point_pathnames):
+        check = AlgorithmIndependentDensityCheck(
+            pathnames,
+            grid_pathname,
+            minimum_count=1,
+            minimum_count_percentage=95.0,
+            engine="numpy",
+            cache_dir=tmp_path / "cache",
+            count_grid=count_grid,
+        )
+        check.run()
+
+    manifest = incremental.CountGrid(count_grid).manifest()
+    assert len(manifest["point_files"]) == len(point_pathnames)
+    assert not list((tmp_path / "cache").glob("**/*.tif"))
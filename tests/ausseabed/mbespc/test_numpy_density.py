@@ -0,0 +1,161 @@
+import laspy
+import numpy
+import pytest
+import pyproj
+import rasterio
+from affine import Affine
+from osgeo import gdal
+
+from ausseabed.mbespc.lib import numpy_density
+from tests.ausseabed.testutils import (
+    build_las_and_tif_densities,
+    LasTestFileBuilder,
+    TifTestFileBuilder,
+)
+
+
+@pytest.fixture(scope="session")
+def data_files(tmp_path_factory):
+    test_las = tmp_path_factory.mktemp("data-files") / "test.las"
+    test_tif = tmp_path_factory.mktemp("data-files") / "test.tif"
+
+    densities = [
+        [1, 1, 5],
+        [5, 5, 5],
+        [6, 5, 7],
+        [5, 6, 9],
+    ]
+
+    # generate temporary test files from the density array
+    build_las_and_tif_densities(test_las, test_tif, densities)
+
+    return test_las, test_tif
+
+
+def test_cell_index():
+    """Points outside of the grid are discarded."""
+    transform = Affine(2.0, 0.0, 100.0, 0.0, -2.0, 50.0)
+    x = numpy.array([100.5, 103.9, 105.0, 99.0, 101.0])
+    y = numpy.array([49.5, 47.0, 44.1, 49.0, 43.0])
+
+    index = numpy_density.cell_index(x, y, transform, 3, 3)
+
+    assert index.tolist() == [0, 4, 8]
+
+    index, inside = numpy_density.cell_index(
+        x, y, transform, 3, 3, return_inside=True
+    )
+
+    assert index.tolist() == [0, 4, 8]
+    assert inside.tolist() == [True, True, True, False, False]
+
+
+def test_accumulate():
+    """Dense and sparse chunks give identical counts."""
+    counts = numpy.zeros((100, 100), dtype="int32")
+    expected = numpy.zeros(100 * 100, dtype="int32")
+
+    dense = numpy.array([5, 5, 6, 7, 7, 7])
+    sparse = numpy.array([0, 9999, 9999])
+
+    for index in (dense, sparse):
+        numpy_density.accumulate(counts, index)
+        numpy.add.at(expected, index, 1)
+
+    assert (counts.reshape(-1) == expected).all()
+
+
+def test_density(data_files, tmp_path):
+    """Histogram and cell count match the generated densities."""
+    test_las, test_tif = data_files
+    hist, bins, cell_count = numpy_density.density(
+        test_tif, [test_las], tmp_path / "density.tif"
+    )
+
+    assert cell_count == 12
+    assert bins.tolist() == list(range(10))
+    assert hist.tolist() == [0, 2, 0, 0, 0, 6, 2, 1, 0, 1]
+
+
+def test_density_multiple_files(data_files, tmp_path):
+    """Counts from each file are summed into the one grid."""
+    test_las, test_tif = data_files
+    hist, _, cell_count = numpy_density.density(
+        test_tif, [test_las, test_las], tmp_path / "density.tif"
+    )
+
+    expected = [0] * 19
+    for density, frequency in [(2, 2), (10, 6), (12, 2), (14, 1), (18, 1)]:
+        expected[density] = frequency
+
+    assert cell_count == 12
+    assert hist.tolist() == expected
+
+
+@pytest.mark.parametrize("suffix", [".las", ".laz"])
+def test_density_streamed_survey(tmp_path, suffix):
+    """
+    Points generated and written in chunks bin to the exact counts of
+    the density array, and the holes in the grid are excluded.
+    """
+    rng = numpy.random.default_rng(4)
+    densities = rng.integers(0, 12, (300, 400))
+    test_las = tmp_path / f"test{suffix}"
+    test_tif = tmp_path / "test.tif"
+    crs = pyproj.CRS.from_epsg(32755)
+
+    LasTestFileBuilder(
+        densities, 300000.0, 5800000.0, 1.0, crs, test_las,
+        chunk_size=10_000, seed=5,
+    ).run()
+    TifTestFileBuilder(
+        lambda rows, cols: numpy.full(rows.shape, -30.0),
+        300000.0, 5800000.0, 1.0, crs, test_tif,
+        width=400, height=300, data_type=gdal.GDT_Float32,
+        tiled=True, nodata_holes=5, hole_radius=20, seed=6,
+    ).run()
+
+    with rasterio.open(test_tif) as src:
+        assert src.profile["tiled"]
+        valid = src.read(1) != src.nodata
+
+    hist, bins, cell_count = numpy_density.density(
+        test_tif, [test_las], tmp_path / "density.tif"
+    )
+    expected = numpy.bincount(densities[valid], minlength=bins.size)
+
+    assert 0 < cell_count == valid.sum() < densities.size
+    assert hist.tolist() == expected.tolist()
+
+
+def test_read_points_parallel_laz(tmp_path):
+    """
+    Decompressing the ranges of a LAZ file in parallel yields the points
+    in file order, aligned to the chunks of the LAZ chunk table.
+    """
+    rng = numpy.random.default_rng(7)
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = [0.01, 0.01, 0.01]
+    header.offsets = [0.0, 0.0, 0.0]
+    las = laspy.LasData(header)
+    las.x = rng.uniform(0, 100, 120_000)
+    las.y = rng.uniform(0, 100, 120_000)
+    las.z = rng.normal(-30, 1, 120_000)
+    las.write(tmp_path / "points.laz")
+    crs = rasterio.crs.CRS.from_epsg(32755)
+
+    with laspy.open(tmp_path / "points.laz") as reader:
+        ranges = numpy_density.laz_ranges(reader.header, 60_000)
+
+    # laspy's default LAZ chunk is 50000 points
+    assert ranges == [(0, 50_000), (50_000, 100_000), (100_000, 120_000)]
+
+    serial = numpy_density.read_points(tmp_path / "points.laz", crs, 60_000)
+    parallel = numpy_density.read_points(
+        tmp_path / "points.laz", crs, 60_000, threads=3
+    )
+    for points in (serial, parallel):
+        x, y, z = (numpy.concatenate(c) for c in zip(*points))
+        assert numpy.allclose(x, las.x)
+        assert numpy.allclose(y, las.y)
+        assert numpy.allclose(z, las.z)
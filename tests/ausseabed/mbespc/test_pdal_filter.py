@@ -10,3 +10,10 @@ def test_filter_reprojection_json():
     filt_prj = pdal_filter.Reprojection.from_crs(crs)
     expected = '{"type": "filters.reprojection", "out_srs": "EPSG:4326"}'
     assert filt_prj.to_json() == expected
+
+
+def test_filter_crop_json():
+    """Test that the json dump is as expected."""
+    filt_crop = pdal_filter.Crop.from_bounds(0.0, 1.0, 2.0, 3.0)
+    expected = '{"type": "filters.crop", "bounds": "([0.0, 2.0], [1.0, 3.0])"}'
+    assert filt_crop.to_json() == expected
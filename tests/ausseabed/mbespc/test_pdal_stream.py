@@ -0,0 +1,87 @@
+import threading
+
+import numpy
+from affine import Affine
+from rasterio.crs import CRS
+
+from ausseabed.mbespc.lib import pdal_pipeline, pdal_stream, vertical_statistics
+
+
+def _chunks(x, y, z, chunk_size):
+    """Structured arrays as streamed by a PDAL pipeline."""
+    points = numpy.zeros(
+        x.size, dtype=[("X", "f8"), ("Y", "f8"), ("Z", "f8"), ("Intensity", "u2")]
+    )
+    points["X"] = x
+    points["Y"] = y
+    points["Z"] = z
+    for start in range(0, x.size, chunk_size):
+        yield points[start: start + chunk_size]
+
+
+def test_reduce_points(monkeypatch):
+    """
+    Chunks streamed through several reducers match reducing the points
+    in one go, and points outside of the grid are discarded.
+    """
+    rng = numpy.random.default_rng(0)
+    x = rng.uniform(98.0, 112.0, 5000)
+    y = rng.uniform(188.0, 202.0, 5000)
+    z = rng.normal(-30.0, 0.2, 5000)
+    transform = Affine(1.0, 0.0, 100.0, 0.0, -1.0, 200.0)
+    chunk_sizes = []
+
+    def iterate(json_pipeline, chunk_size):
+        chunk_sizes.append(chunk_size)
+        return _chunks(x, y, z, chunk_size)
+
+    monkeypatch.setattr(pdal_pipeline, "iterate", iterate)
+
+    counts = numpy.zeros((10, 10), dtype="int32")
+    statistics = vertical_statistics.CellStatistics(10, 10)
+    mask = numpy.zeros((10, 10), dtype=bool)
+    reducers = [
+        pdal_stream.CountReducer(transform, counts),
+        pdal_stream.StatisticsReducer(transform, statistics),
+        pdal_stream.CoverageReducer(transform, mask),
+    ]
+    n_points = pdal_stream.reduce_points(
+        "[]", reducers, chunk_size=700, lock=threading.Lock()
+    )
+
+    inside = (x >= 100) & (x < 110) & (y > 190) & (y <= 200)
+    index = (
+        numpy.floor(200.0 - y[inside]).astype(int) * 10
+        + numpy.floor(x[inside] - 100.0).astype(int)
+    )
+    expected = numpy.bincount(index, minlength=100).reshape(10, 10)
+    result = statistics.read(slice(0, 10), slice(0, 10))
+
+    assert n_points == 5000
+    assert chunk_sizes == [700]
+    assert (counts == expected).all()
+    assert (mask == (expected > 0)).all()
+    assert (result["count"] == expected).all()
+    cell = int(index[0])
+    assert numpy.isclose(
+        result["mean"].ravel()[cell], z[inside][index == cell].mean()
+    )
+
+
+def test_pipeline_stages():
+    """A crop filter follows the reprojection only when bounds are given."""
+    crs = CRS.from_epsg(32755)
+    stages = pdal_stream.pipeline_stages("survey.laz", crs)
+    cropped = pdal_stream.pipeline_stages(
+        "survey.laz", crs, (100.0, 190.0, 110.0, 200.0)
+    )
+
+    assert [stage["type"] for stage in stages] == [
+        "readers.las",
+        "filters.reprojection",
+    ]
+    assert [stage["type"] for stage in cropped] == [
+        "readers.las",
+        "filters.reprojection",
+        "filters.crop",
+    ]
@@ -0,0 +1,59 @@
+import time
+
+from ausseabed.mbespc.lib import profiling
+
+
+def test_profiler_stages():
+    """
+    Stages are reported in the order first entered, and re-entering a
+    stage accumulates its time and items.
+    """
+    profiler = profiling.Profiler()
+
+    with profiler.stage("read") as timing:
+        time.sleep(0.01)
+        timing.add_items(100, "points")
+    with profiler.stage("write"):
+        pass
+    with profiler.stage("read") as timing:
+        timing.add_items(50)
+
+    assert [timing.name for timing in profiler.stages] == ["read", "write"]
+
+    read, write = profiler.stages
+    assert read.calls == 2
+    assert read.items == 150
+    assert read.unit == "points"
+    assert read.wall_time >= 0.01
+    assert read.throughput is not None
+    assert read.peak_rss > 0
+    assert write.items is None
+    assert write.throughput is None
+
+    performance = profiler.to_dict()
+    assert performance["stages"][0]["name"] == "read"
+    assert performance["stages"][0]["items"] == 150
+    assert performance["wall_time"] >= read.wall_time
+    assert performance["peak_rss"] >= read.peak_rss
+
+    lines = profiler.format().splitlines()
+    assert len(lines) == 3
+    assert lines[1].startswith("read")
+
+
+def test_profiler_without_resource(monkeypatch):
+    """
+    Without the resource module (e.g. on Windows) the stages are still
+    timed, and the peak RSS is reported as unavailable.
+    """
+    monkeypatch.setattr(profiling, "resource", None)
+    profiler = profiling.Profiler()
+
+    with profiler.stage("read") as timing:
+        timing.add_items(10, "points")
+
+    (read,) = profiler.stages
+    assert read.calls == 1
+    assert read.peak_rss is None
+    assert profiler.to_dict()["peak_rss"] is None
+    assert "n/a" in profiler.format().splitlines()[1]
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ausseabed.mbespc.lib import progress
+
+
+def test_progress_weights():
+    """
+    The overall fraction weights each stage, with skipped stages counted
+    as complete.
+    """
+    events = []
+    prog = progress.Progress(
+        events.append, {"points": 3.0, "density": 1.0}, min_interval=0
+    )
+
+    with prog.stage("points", total=100, unit="points") as stage:
+        stage.update(50)
+        assert prog.fraction == pytest.approx(0.375)
+        stage.update(50)
+
+    # unweighted stages don't contribute to the overall fraction
+    with prog.stage("other") as stage:
+        stage.update(10)
+
+    assert prog.fraction == pytest.approx(0.75)
+    prog.skip("density")
+    assert prog.fraction == pytest.approx(1.0)
+    prog.finish()
+
+    assert [(e.stage, e.done, e.total) for e in events] == [
+        ("points", 0, 100),
+        ("points", 50, 100),
+        ("points", 100, 100),
+        ("points", 100, 100),
+        ("other", 0, None),
+        ("other", 10, None),
+        ("other", 10, 10),
+        ("complete", 1, 1),
+    ]
+    assert events[0].unit == "points"
+    assert events[-1].fraction == 1.0
+
+
+def test_progress_threads():
+    """
+    Updates from several threads are all counted, and reports are
+    throttled to the start and end of the stage.
+    """
+    events = []
+    prog = progress.Progress(events.append, min_interval=3600)
+
+    with prog.stage("cells", total=1000) as stage:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(stage.update, [1] * 1000))
+
+    assert stage.done == 1000
+    assert [(e.done, e.fraction) for e in events] == [(0, 0.0), (1000, 1.0)]
+
+
+def test_progress_callback_error():
+    """A failing callback doesn't fail the stage."""
+
+    def callback(event):
+        raise RuntimeError("display closed")
+
+    prog = progress.Progress(callback, min_interval=0)
+    with prog.stage("points", total=10) as stage:
+        stage.update(10)
+
+    assert stage.fraction == 1.0
@@ -0,0 +1,173 @@
+from pathlib import Path
+import pytest
+
+from ausseabed.qajson.model import QajsonCheck, QajsonInputs, QajsonParam
+
+from ausseabed.mbespc.lib import qajson_runner, workers
+from tests.ausseabed.testutils import build_las_and_tif_densities
+
+
+@pytest.fixture(scope="session")
+def data_files(tmp_path_factory):
+    test_las = tmp_path_factory.mktemp("data-files") / "test.las"
+    test_tif = tmp_path_factory.mktemp("data-files") / "test.tif"
+
+    densities = [
+        [1, 1, 5],
+        [5, 5, 5],
+        [6, 5, 7],
+        [5, 6, 9],
+    ]
+    build_las_and_tif_densities(test_las, test_tif, densities)
+
+    return test_las, test_tif
+
+
+def test_tile_size_for_budget(data_files):
+    _, test_tif = data_files
+
+    assert qajson_runner.tile_size_for_budget(test_tif, 2**20) is None
+    assert qajson_runner.tile_size_for_budget(test_tif, 1) == 256
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_density_checks(data_files, workers):
+    """
+    Each check's outputs are passed back as it completes, with checks
+    missing their inputs aborted rather than run.
+    """
+    test_las, test_tif = data_files
+    tasks = [
+        qajson_runner.DensityCheckTask(
+            [test_las], test_tif, minimum_count, 80.0, engine="numpy"
+        )
+        for minimum_count in (5, 6)
+    ]
+    tasks.append(
+        qajson_runner.DensityCheckTask(
+            [], test_tif, 5, 80.0, error="Missing input point data"
+        )
+    )
+    completed = []
+    fractions = []
+
+    results = qajson_runner.run_checks(
+        tasks,
+        workers=workers,
+        on_complete=lambda index, outputs: completed.append(index),
+        progress_callback=fractions.append,
+    )
+
+    assert sorted(completed) == [0, 1, 2]
+    assert fractions[-1] == pytest.approx(1.0)
+    assert [r.execution.status for r in results] == [
+        "completed", "completed", "aborted"
+    ]
+    assert [r.check_state for r in results[:2]] == ["pass", "fail"]
+    assert results[0].data["summary"]["failed_nodes"] == 2
+    assert results[1].data["summary"]["failed_nodes"] == 8
+    assert "performance" in results[0].data
+
+
+def test_run_tvu_checks(data_files):
+    """
+    Vertical statistics and surface consistency tasks run alongside the
+    density checks.
+    """
+    test_las, test_tif = data_files
+    tasks = [
+        qajson_runner.DensityCheckTask(
+            [test_las], test_tif, 5, 80.0, engine="numpy"
+        ),
+        qajson_runner.VerticalStatisticsTask(
+            [test_las], test_tif, 0.5, 0.013, 5, 95.0
+        ),
+        qajson_runner.SurfaceConsistencyTask(
+            [test_las], test_tif, 0.5, 0.013, 1, 95.0
+        ),
+    ]
+
+    results = qajson_runner.run_checks(tasks, workers=1)
+
+    assert [r.execution.status for r in results] == ["completed"] * 3
+    # the soundings are all at the same depth
+    assert results[1].check_state == "pass"
+    assert results[1].data["summary"]["evaluated_nodes"] == 10
+    assert results[1].data["summary"]["max_std"] == pytest.approx(0, abs=1e-6)
+    assert results[2].data["summary"]["evaluated_nodes"] == 12
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_shared_checks(data_files, workers):
+    """
+    A vertical statistics task sharing the inputs of a density task runs
+    along with it from the one pass of the points, with the same outputs
+    as when run on its own.
+    """
+    test_las, test_tif = data_files
+    tasks = [
+        qajson_runner.VerticalStatisticsTask(
+            [test_las], test_tif, 0.5, 0.013, 5, 95.0
+        ),
+        qajson_runner.DensityCheckTask(
+            [test_las], test_tif, 5, 80.0, engine="numpy"
+        ),
+        qajson_runner.VerticalStatisticsTask(
+            [test_las, test_las], test_tif, 0.5, 0.013, 5, 95.0
+        ),
+    ]
+    separate = [qajson_runner.run_check(task) for task in tasks]
+
+    results = qajson_runner.run_checks(tasks, workers=workers)
+
+    assert qajson_runner.shared_tasks(tasks) == {1: 0}
+    # only density tasks using the numpy engine share their pass
+    pdal_task = qajson_runner.DensityCheckTask([test_las], test_tif, 5, 80.0)
+    assert qajson_runner.shared_tasks([tasks[0], pdal_task]) == {}
+    assert [r.execution.status for r in results] == ["completed"] * 3
+    for result, expected in zip(results, separate):
+        assert result.check_state == expected.check_state
+        assert result.data["summary"] == expected.data["summary"]
+        assert result.data["chart"] == expected.data["chart"]
+    # the density check's pass of the points evaluated the statistics
+    stages = [s["name"] for s in results[1].data["performance"]["stages"]]
+    assert "write_statistics" in stages
+
+
+def test_schedule(tmp_path):
+    """Tasks are started largest inputs first."""
+    tasks = []
+    for size in (10, 30, 20):
+        pathname = tmp_path / f"{size}.las"
+        pathname.write_bytes(b"0" * size)
+        tasks.append(
+            qajson_runner.DensityCheckTask([pathname], None, 5, 95.0)
+        )
+
+    assert qajson_runner.schedule(tasks) == [1, 2, 0]
+
+
+def test_worker_settings():
+    """
+    The largest worker parameters set by any check apply, and unset (zero
+    or missing) parameters leave the defaults.
+    """
+    def check(*params):
+        return QajsonCheck(None, QajsonInputs([], list(params)), None)
+
+    checks = [
+        check(QajsonParam(workers.WORKERS_PARAM, 2)),
+        check(
+            QajsonParam(workers.WORKERS_PARAM, 4),
+            QajsonParam(workers.WORKER_MEMORY_PARAM, 0),
+        ),
+        check(),
+    ]
+
+    assert qajson_runner.worker_settings(checks) == (4, None)
+    assert qajson_runner.worker_settings(
+        [check(*workers.input_params())]
+    ) == (None, None)
+    assert qajson_runner.worker_settings(
+        [check(QajsonParam(workers.WORKER_MEMORY_PARAM, 512))]
+    ) == (None, 512 * 2**20)
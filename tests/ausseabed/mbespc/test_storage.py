@@ -0,0 +1,44 @@
+import numpy
+import rasterio
+
+from ausseabed.mbespc.lib import storage, utils
+from tests.ausseabed.testutils import write_grid
+
+
+def test_plan(tmp_path):
+    """Persisted grids go to their destination, small grids to memory."""
+    grid_pathname = tmp_path / "grid.tif"
+    write_grid(grid_pathname, numpy.zeros((10, 20), dtype="float32"))
+    destination = tmp_path / "density.tif"
+
+    store = storage.plan(grid_pathname, tmp_path, destination)
+    assert store.pathname == destination
+    assert store.creation_options == utils.DENSITY_GTIFF_OPTIONS
+    assert not store.in_memory
+
+    store = storage.plan(grid_pathname, tmp_path, max_in_memory_cells=100)
+    assert store.pathname == tmp_path / "density.tif"
+    assert store.creation_options == storage.TEMP_GTIFF_OPTIONS
+
+    with storage.plan(grid_pathname, tmp_path) as store:
+        assert store.in_memory
+        with rasterio.open(grid_pathname) as src:
+            kwargs = {**src.profile, **store.creation_options}
+        with rasterio.open(str(store.pathname), "w", **kwargs) as outds:
+            outds.write(numpy.ones((10, 20), dtype="float32"), 1)
+        with rasterio.open(str(store.pathname)) as src:
+            assert src.read(1).sum() == 200
+
+    assert not store.in_memory
+
+
+def test_link_or_copy(tmp_path):
+    """The destination is replaced with the contents of the source."""
+    src_pathname = tmp_path / "a.tif"
+    dst_pathname = tmp_path / "b.tif"
+    src_pathname.write_bytes(b"density")
+    dst_pathname.write_bytes(b"stale")
+
+    storage.link_or_copy(src_pathname, dst_pathname)
+
+    assert dst_pathname.read_bytes() == b"density"
@@ -0,0 +1,109 @@
+import numpy
+import pytest
+import rasterio
+
+from ausseabed.mbespc.lib import surface_consistency
+from ausseabed.mbespc.lib.surface_check import SurfaceConsistencyCheck
+from tests.ausseabed.testutils import write_grid, write_points
+
+
+@pytest.fixture
+def surface(tmp_path):
+    grid = numpy.arange(-40, -10, dtype="float32").reshape(5, 6)
+    grid[0, 0] = -9999
+
+    return write_grid(tmp_path / "grid.tif", grid), grid
+
+
+def test_surface_blocks(surface):
+    """
+    Lookups from a single block, or from many (partial) blocks, match
+    indexing the whole grid, and the cached blocks aren't read again.
+    """
+    grid_pathname, grid = surface
+    rng = numpy.random.default_rng(0)
+    row = rng.integers(0, 5, 100)
+    col = rng.integers(1, 6, 100)
+    expected = numpy.where(grid == -9999, numpy.nan, grid)[row, col]
+
+    with rasterio.open(grid_pathname) as src:
+        blocks = surface_consistency.SurfaceBlocks(src)
+        values = blocks.lookup(row, col)
+        assert numpy.array_equal(values, expected, equal_nan=True)
+        assert blocks.reads == 1
+
+        # 2x2 blocks; 3 rows by 3 columns of blocks, all touched
+        blocks = surface_consistency.SurfaceBlocks(src, 2, max_blocks=4)
+        values = blocks.lookup(row, col)
+        assert numpy.array_equal(values, expected, equal_nan=True)
+        assert blocks.reads == 9
+        assert len(blocks.blocks) == 4
+
+        # the most recently used blocks are kept, the others read again
+        values = blocks.lookup(numpy.array([4, 0]), numpy.array([5, 1]))
+        assert values.tolist() == [grid[4, 5], grid[0, 1]]
+        assert blocks.reads == 10
+
+
+def test_surface_consistency_check(surface, tmp_path):
+    """
+    The mean of the soundings of each node is compared to the surface,
+    ignoring the soundings of no-data nodes.
+    """
+    grid_pathname, grid = surface
+    rows, cols = numpy.mgrid[0:5, 0:6]
+    # two soundings per cell either side of the surface, offset by 0.1;
+    # bar the last cell, offset by 2.0 (beyond its TVU of 0.5)
+    offset = numpy.full((5, 6), 0.1)
+    offset[4, 5] = 2.0
+    x = numpy.repeat(100.5 + cols.ravel(), 2)
+    y = numpy.repeat(199.5 - rows.ravel(), 2)
+    z = numpy.repeat(grid.ravel() + offset.ravel(), 2) + numpy.tile(
+        [-0.05, 0.05], 30
+    )
+    write_points(tmp_path / "points.las", x, y, z)
+
+    check = SurfaceConsistencyCheck(
+        tmp_path / "points.las",
+        grid_pathname,
+        minimum_count=2,
+        minimum_percentage=97.0,
+        outdir=tmp_path / "outputs",
+    )
+    check.run()
+
+    assert check.total_nodes == 29
+    assert check.evaluated_nodes == 29
+    assert check.failed_nodes == 1
+    assert not check.passed
+    assert check.max_abs_difference == pytest.approx(2.0)
+    assert check.soundings == 58
+    assert check.mean_residual == pytest.approx((28 * 0.1 + 2.0) / 29)
+
+    out_pathname = (
+        tmp_path / "outputs" / "points" / check.name / "surface-difference.tif"
+    )
+    with rasterio.open(out_pathname) as src:
+        difference = src.read(1)
+
+    assert numpy.isnan(difference[0, 0])
+    assert numpy.allclose(difference.ravel()[1:], offset.ravel()[1:], atol=1e-4)
+
+
+def test_surface_consistency_check_not_evaluated(surface, tmp_path):
+    """A check whose soundings all miss the grid fails."""
+    grid_pathname, _ = surface
+    write_points(
+        tmp_path / "points.las",
+        numpy.full(5, 500.5),
+        numpy.full(5, 199.5),
+        numpy.full(5, -20.0),
+    )
+
+    check = SurfaceConsistencyCheck(tmp_path / "points.las", grid_pathname)
+    check.run()
+
+    assert check.total_nodes == 29
+    assert check.evaluated_nodes == 0
+    assert check.percentage_passed is None
+    assert not check.passed
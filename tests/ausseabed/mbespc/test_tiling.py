@@ -0,0 +1,115 @@
+import numpy
+import pytest
+import rasterio
+
+from ausseabed.mbespc.lib import numpy_density, tiling, utils
+from tests.ausseabed.testutils import (
+    build_las_and_tif_densities,
+    GRID_CRS,
+    GRID_TRANSFORM,
+    write_grid,
+    write_points,
+)
+
+
+@pytest.fixture(scope="session")
+def data_files(tmp_path_factory):
+    test_las = tmp_path_factory.mktemp("data-files") / "test.las"
+    test_tif = tmp_path_factory.mktemp("data-files") / "test.tif"
+
+    densities = [
+        [1, 1, 5, 2, 0],
+        [5, 5, 5, 3, 1],
+        [6, 5, 7, 8, 2],
+        [5, 6, 9, 1, 4],
+    ]
+
+    # generate temporary test files from the density array
+    build_las_and_tif_densities(test_las, test_tif, densities)
+
+    return test_las, test_tif
+
+
+def test_tile_windows():
+    """Edge tiles are truncated, and the tiles cover the grid."""
+    windows = tiling.tile_windows(5, 4, 2)
+
+    assert len(windows) == 6
+    assert sum(w.width * w.height for w in windows) == 20
+    assert (windows[-1].width, windows[-1].height) == (1, 2)
+
+
+def test_density_tiled(data_files, tmp_path):
+    """Tiled results match the untiled density grid."""
+    test_las, test_tif = data_files
+    untiled_pathname = tmp_path / "untiled.tif"
+    tiled_pathname = tmp_path / "tiled.tif"
+
+    hist, bins, cell_count = numpy_density.density(
+        test_tif, [test_las], untiled_pathname
+    )
+    t_hist, t_bins, t_cell_count = tiling.density_tiled(
+        test_tif,
+        [test_las],
+        tiled_pathname,
+        numpy_density.density_tile,
+        tile_size=2,
+        processes=2,
+    )
+
+    with rasterio.open(untiled_pathname) as src_a:
+        with rasterio.open(tiled_pathname) as src_b:
+            assert (src_a.read(1) == src_b.read(1)).all()
+
+    assert t_cell_count == cell_count
+    assert (t_hist == hist).all()
+    assert (t_bins == bins).all()
+
+
+def _files_per_tile(grid_pathname, point_pathnames, window):
+    """Tile "counts" recording the number of point files read per tile."""
+    return numpy.full(
+        (int(window.height), int(window.width)), len(point_pathnames)
+    )
+
+
+def test_tile_point_files(tmp_path):
+    """
+    Tiles are only given the point files whose header bounds intersect
+    them; a file outside of a tile is never read for that tile.
+    """
+    grid_pathname = write_grid(
+        tmp_path / "grid.tif", numpy.ones((4, 4), dtype="float32")
+    )
+
+    # one file within the top left tile, the other spanning the right tiles
+    point_pathnames = [tmp_path / "top-left.las", tmp_path / "right.las"]
+    for pathname, x, y in zip(
+        point_pathnames,
+        ([100.5, 101.5], [102.5, 103.5]),
+        ([199.5, 198.5], [199.5, 196.5]),
+    ):
+        write_points(pathname, x, y)
+
+    windows = tiling.tile_windows(4, 4, 2)
+    bounds = [utils.header_bounds(p, GRID_CRS) for p in point_pathnames]
+    tile_files = tiling.tile_point_files(
+        windows, GRID_TRANSFORM, point_pathnames, bounds
+    )
+
+    assert tile_files == [
+        point_pathnames[:1], point_pathnames[1:], [], point_pathnames[1:]
+    ]
+
+    tiling.density_tiled(
+        grid_pathname,
+        point_pathnames,
+        tmp_path / "density.tif",
+        _files_per_tile,
+        tile_size=2,
+        processes=2,
+    )
+    with rasterio.open(tmp_path / "density.tif") as src:
+        files_read = src.read(1)
+
+    assert files_read[::2, ::2].tolist() == [[1, 1], [0, 1]]
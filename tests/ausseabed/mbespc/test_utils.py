@@ -0,0 +1,250 @@
+import numpy
+import pytest
+import rasterio
+import shapely
+
+from ausseabed.mbespc.lib import utils, errors
+from tests.ausseabed.testutils import write_grid
+
+# small grids are tiled, so the block reads are exercised
+TILED = {"tiled": "yes", "blockxsize": 16, "blockysize": 16}
+
+
+def test_density_statistics_merge():
+    """Merged partial results equal a single reduction over all the data."""
+    rng = numpy.random.default_rng(0)
+    data = rng.integers(0, 40, (64, 64)).astype("int32")
+    valid = rng.random((64, 64)) > 0.2
+
+    full = utils.DensityStatistics()
+    full.update(data, valid)
+
+    top = utils.DensityStatistics()
+    top.update(data[:10], valid[:10])
+    bottom = utils.DensityStatistics()
+    bottom.update(data[10:], valid[10:])
+    merged = top.merge(bottom)
+
+    hist, bins = merged.histogram()
+    expected, _ = numpy.histogram(
+        data[valid], bins=numpy.arange(data[valid].max() + 2)
+    )
+
+    assert merged.max == full.max == data[valid].max()
+    assert merged.cell_count == full.cell_count == valid.sum()
+    assert (hist == expected).all()
+    assert (bins == numpy.arange(hist.size)).all()
+
+
+def test_density_statistics_cap():
+    """
+    Densities below the cap are binned exactly, larger densities fall
+    within log2 spaced bins.
+    """
+    rng = numpy.random.default_rng(2)
+    data = rng.integers(0, 20, (32, 32)).astype("int32")
+    data[0, :4] = [16, 31, 32, 40000]
+    valid = numpy.ones(data.shape, dtype=bool)
+
+    top = utils.DensityStatistics(cap=16)
+    top.update(data[:5], valid[:5])
+    bottom = utils.DensityStatistics(cap=16)
+    bottom.update(data[5:], valid[5:])
+    stats = top.merge(bottom)
+    hist, bins = stats.histogram()
+
+    expected = numpy.bincount(data[data < 16], minlength=16)
+    assert stats.max == 40000
+    assert (hist[:16] == expected).all()
+    assert (bins[:16] == numpy.arange(16)).all()
+    # [16, 32), [32, 64) ... [32768, 65536)
+    assert (bins[16:] == 16 * 2 ** numpy.arange(12)).all()
+    assert hist[16] == (data[(data >= 16) & (data < 32)]).size
+    assert hist[17] == 1
+    assert hist[-1] == 1
+    assert hist.sum() == data.size
+    assert utils.bin_label(bins[-1], 16) == "32768-65535"
+    assert utils.bin_label(15, 16) == "15"
+
+    with pytest.raises(errors.MbesPcError):
+        stats.merge(utils.DensityStatistics(cap=8))
+
+
+def test_reduce_density(tmp_path):
+    """
+    The fused reducer matches the separate no-data update and histogram
+    routines.
+    """
+    rng = numpy.random.default_rng(1)
+    grid = rng.random((40, 50)).astype("float32")
+    grid[rng.random((40, 50)) > 0.7] = -9999
+    density = rng.integers(0, 12, (40, 50)).astype("int32")
+
+    grid_pathname = tmp_path / "grid.tif"
+    density_a = tmp_path / "density-a.tif"
+    density_b = tmp_path / "density-b.tif"
+    write_grid(grid_pathname, grid, **TILED)
+    write_grid(density_a, density, **TILED)
+    write_grid(density_b, density, **TILED)
+
+    maxv, cell_count = utils.update_density_no_data(grid_pathname, density_a)
+    hist, bins = utils.histogram_point_density(density_a, maxv)
+
+    stats = utils.reduce_density(grid_pathname, density_b)
+    s_hist, s_bins = stats.histogram()
+
+    with rasterio.open(density_a) as src_a, rasterio.open(density_b) as src_b:
+        assert (src_a.read(1) == src_b.read(1)).all()
+
+    assert stats.max == maxv
+    assert stats.cell_count == cell_count
+    assert (s_hist == hist).all()
+    assert (s_bins == bins).all()
+
+    # writing to a new grid leaves the source untouched
+    density_c = tmp_path / "density-c.tif"
+    density_d = tmp_path / "density-d.tif"
+    write_grid(density_c, density, **TILED)
+    stats = utils.reduce_density(
+        grid_pathname, density_c, out_pathname=density_d
+    )
+
+    with rasterio.open(density_a) as src_a, rasterio.open(density_d) as src_d:
+        assert (src_a.read(1) == src_d.read(1)).all()
+        assert src_d.profile["compress"] == "deflate"
+
+    with rasterio.open(density_c) as src_c:
+        assert (src_c.read(1) == density).all()
+
+    assert stats.cell_count == cell_count
+
+
+def test_sum_overviews(tmp_path):
+    """
+    Overview levels sum the counts of the finer level, ignoring no-data,
+    and are written within the density grid.
+    """
+    rng = numpy.random.default_rng(3)
+    grid = rng.random((300, 530)).astype("float32")
+    grid[50:120, 20:300] = -9999
+    grid[:, :3] = -9999
+    density = rng.integers(0, 12, grid.shape).astype("int32")
+
+    grid_pathname = tmp_path / "grid.tif"
+    density_pathname = tmp_path / "density.tif"
+    out_pathname = tmp_path / "density-out.tif"
+    write_grid(grid_pathname, grid, **TILED)
+    write_grid(density_pathname, density, **TILED)
+
+    utils.reduce_density(
+        grid_pathname,
+        density_pathname,
+        out_pathname=out_pathname,
+        overviews=utils.SumOverviews(),
+    )
+
+    valid = grid != -9999
+    with rasterio.open(out_pathname) as src:
+        assert src.overviews(1) == [2, 4]
+        full = src.read(1)
+
+    statistics = utils.overview_statistics(out_pathname)
+    assert [factor for factor, _ in statistics] == [2, 4]
+
+    for level, (factor, stats) in enumerate(statistics):
+        rows, cols = -(-300 // factor), -(-530 // factor)
+        counts = numpy.zeros((rows * factor, cols * factor), dtype="int64")
+        counts[:300, :530] = numpy.where(valid, full, 0)
+        mask = numpy.zeros(counts.shape, dtype="bool")
+        mask[:300, :530] = valid
+        counts = counts.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+        mask = mask.reshape(rows, factor, cols, factor).any(axis=(1, 3))
+
+        with rasterio.open(out_pathname, overview_level=level) as src:
+            data = src.read(1)
+            assert (data == numpy.where(mask, counts, src.nodata)).all()
+
+        assert stats.cell_count == mask.sum()
+        assert stats.max == counts[mask].max()
+
+    # grids within a single block have no overviews
+    assert utils.overview_factors(256, 100) == []
+
+
+def test_find_point_files(tmp_path):
+    """Files, directories and glob patterns resolve to unique files."""
+    for name in ["a.las", "b.LAZ", "c.tif"]:
+        tmp_path.joinpath(name).touch()
+
+    expected = [tmp_path / "a.las", tmp_path / "b.LAZ"]
+
+    assert utils.find_point_files([tmp_path]) == expected
+    assert utils.find_point_files([tmp_path / "a.las", tmp_path / "*.LAZ"]) == expected  # noqa: E501
+    assert utils.find_point_files([tmp_path / "a.las", tmp_path]) == expected
+
+    with pytest.raises(errors.MbesPcError):
+        utils.find_point_files([tmp_path / "*.laz"])
+
+
+def test_vectorise_low_density_thresholds(tmp_path):
+    """A single scan covers the failing cells of every threshold."""
+    rng = numpy.random.default_rng(2)
+    density = rng.integers(0, 12, (40, 50)).astype("int32")
+    density[rng.random((40, 50)) > 0.8] = -9999
+    density_pathname = tmp_path / "density.tif"
+    write_grid(density_pathname, density, **TILED)
+
+    gdfs = utils.vectorise_low_density_thresholds(
+        density_pathname, [3, 5, 9], threads=2
+    )
+
+    for minimum, gdf in gdfs.items():
+        failing = (density >= 0) & (density < minimum)
+        assert gdf.area.sum() == failing.sum()
+        assert shapely.union_all(gdf.geometry.values).area == failing.sum()
+
+
+def test_vectorise_low_density_seams(tmp_path):
+    """A region spanning several blocks is a single polygon."""
+    density = numpy.full((40, 50), 10, dtype="int32")
+    density[5:30, 10:45] = 1
+    density[35:, 45:] = 2
+    density_pathname = tmp_path / "density.tif"
+    write_grid(density_pathname, density, **TILED)
+
+    gdf = utils.vectorise_low_density(density_pathname, 5)
+
+    assert len(gdf) == 2
+    assert sorted(gdf.area.tolist()) == [25.0, 875.0]
+
+
+def test_failure_mask(tmp_path):
+    """
+    The 1-bit failure mask written during the density pass matches the
+    mask written from the final density grid.
+    """
+    rng = numpy.random.default_rng(3)
+    grid = rng.random((40, 50)).astype("float32")
+    grid[rng.random((40, 50)) > 0.7] = -9999
+    density = rng.integers(0, 12, (40, 50)).astype("int32")
+
+    grid_pathname = tmp_path / "grid.tif"
+    density_pathname = tmp_path / "density.tif"
+    write_grid(grid_pathname, grid, **TILED)
+    write_grid(density_pathname, density, **TILED)
+
+    mask_a = utils.FailureMask(tmp_path / "mask-a.tif", 5)
+    stats = utils.reduce_density(grid_pathname, density_pathname, mask_a)
+    mask_b = utils.FailureMask(tmp_path / "mask-b.tif", 5)
+    utils.write_failure_mask(density_pathname, mask_b)
+
+    expected = (grid != -9999) & (density < 5)
+
+    with rasterio.open(mask_a.pathname) as src_a:
+        assert src_a.tags(1, "IMAGE_STRUCTURE")["NBITS"] == "1"
+        assert (src_a.read(1) == expected).all()
+        with rasterio.open(mask_b.pathname) as src_b:
+            assert (src_a.read(1) == src_b.read(1)).all()
+
+    assert mask_a.failed_cells == mask_b.failed_cells == expected.sum()
+    assert mask_a.failed_cells == stats.hist[:5].sum()
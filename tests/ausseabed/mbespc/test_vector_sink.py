@@ -0,0 +1,64 @@
+import fiona
+import numpy
+import pytest
+import shapely
+from rasterio.crs import CRS
+
+from ausseabed.mbespc.lib import vector_sink
+
+
+@pytest.fixture
+def geoms():
+    return shapely.box(
+        numpy.arange(10), numpy.zeros(10), numpy.arange(10) + 0.5, numpy.ones(10)
+    )
+
+
+@pytest.mark.parametrize("fmt", ["fgb", "gpkg", "shp"])
+def test_fiona_sinks(fmt, geoms, tmp_path):
+    """Batches are streamed to file, and only a count is retained."""
+    sink = vector_sink.from_format(fmt, tmp_path, "low-density-pixels")
+    sink.open(CRS.from_epsg(32755))
+    sink.write(geoms[:4])
+    sink.write(geoms[4:4])
+    sink.write(geoms[4:])
+    sink.close()
+
+    assert sink.feature_count == 10
+    assert sink.pathname.name == f"low-density-pixels.{fmt}"
+
+    with fiona.open(sink.pathname) as src:
+        assert len(src) == 10
+        assert src.crs.to_epsg() == 32755
+
+
+def test_geoparquet_sink(geoms, tmp_path):
+    """GeoParquet output is readable by geopandas."""
+    pytest.importorskip("pyarrow")
+    import geopandas
+
+    sink = vector_sink.from_format("parquet", tmp_path, "low-density-pixels")
+    sink.open(CRS.from_epsg(32755))
+    sink.write(geoms[:4])
+    sink.write(geoms[4:])
+    sink.close()
+
+    gdf = geopandas.read_parquet(sink.pathname)
+
+    assert len(gdf) == 10
+    assert gdf.crs.to_epsg() == 32755
+    assert gdf.geometry.equals(geopandas.GeoSeries(geoms))
+
+
+def test_memory_sink(geoms):
+    """Batches are collected into a GeoDataFrame."""
+    sink = vector_sink.MemorySink()
+    sink.open(CRS.from_epsg(32755))
+    sink.write(geoms[:4])
+    sink.write(geoms[4:])
+    sink.close()
+
+    gdf = sink.to_geodataframe()
+
+    assert len(gdf) == sink.feature_count == 10
+    assert gdf.crs.to_epsg() == 32755
@@ -0,0 +1,223 @@
+import numpy
+import pytest
+import rasterio
+
+from ausseabed.mbespc.lib import errors, numpy_density, vertical_statistics
+from ausseabed.mbespc.lib.density_check import AlgorithmIndependentDensityCheck
+from ausseabed.mbespc.lib.vertical_check import VerticalStatisticsCheck
+from tests.ausseabed.testutils import write_grid, write_points
+
+
+def _expected(index, z, cells):
+    """Per cell statistics calculated in one go."""
+    count = numpy.bincount(index, minlength=cells)
+    mean = numpy.zeros(cells)
+    std = numpy.full(cells, numpy.nan)
+    minimum = numpy.zeros(cells)
+    maximum = numpy.zeros(cells)
+    for cell in numpy.flatnonzero(count):
+        values = z[index == cell]
+        mean[cell] = values.mean()
+        if values.size > 1:
+            std[cell] = values.std(ddof=1)
+        minimum[cell] = values.min()
+        maximum[cell] = values.max()
+
+    return count, mean, std, minimum, maximum
+
+
+def _write_grid(tmp_path):
+    """A 2 x 3 grid 20m deep, with the first cell nodata."""
+    grid = numpy.full((2, 3), -20, dtype="float32")
+    grid[0, 0] = -9999
+
+    return write_grid(tmp_path / "grid.tif", grid)
+
+
+def _write_soundings(pathname):
+    """
+    Soundings of each cell of the grid (row major); the first cell is
+    nodata, the last doesn't hold three soundings.
+    """
+    soundings = [
+        [-20.0, -30.0, -40.0],
+        [-20.0, -20.2, -19.8],
+        [-20.0, -22.0, -18.0],
+        [-100.0, -100.5, -99.5, -100.0],
+        [-20.0, -20.0, -20.0],
+        [-20.0, -21.0],
+    ]
+    x, y, z = [], [], []
+    for cell, values in enumerate(soundings):
+        row, col = divmod(cell, 3)
+        x.extend([100.5 + col] * len(values))
+        y.extend([199.5 - row] * len(values))
+        z.extend(values)
+
+    write_points(pathname, x, y, z)
+
+
+def test_cell_statistics():
+    """
+    Accumulating chunks, and merging the accumulators of separate files,
+    matches the statistics calculated in one go.
+    """
+    rng = numpy.random.default_rng(0)
+    index = rng.integers(0, 48, 5000)
+    z = rng.normal(-1000, 0.5, 5000)
+
+    statistics = vertical_statistics.CellStatistics(6, 10)
+    other = vertical_statistics.CellStatistics(6, 10)
+    for start in range(0, 3000, 600):
+        statistics.update(
+            vertical_statistics.chunk_statistics(
+                index[start: start + 600], z[start: start + 600]
+            )
+        )
+    other.update(vertical_statistics.chunk_statistics(index[3000:], z[3000:]))
+    statistics.merge(other)
+
+    result = statistics.read(slice(0, 6), slice(0, 10))
+    count, mean, std, minimum, maximum = _expected(index, z, 60)
+    seen = count > 0
+
+    assert (result["count"].ravel() == count).all()
+    assert numpy.allclose(result["mean"].ravel()[seen], mean[seen])
+    assert numpy.allclose(result["std"].ravel()[seen], std[seen])
+    assert (result["min"].ravel()[seen] == minimum[seen]).all()
+    assert (result["max"].ravel()[seen] == maximum[seen]).all()
+    assert numpy.isnan(result["mean"].ravel()[~seen]).all()
+
+
+def test_vertical_statistics_check(tmp_path):
+    """
+    Nodes are evaluated against the TVU of their mean depth, once they hold
+    the minimum count of soundings.
+    """
+    grid_pathname = _write_grid(tmp_path)
+    _write_soundings(tmp_path / "points.las")
+
+    check = VerticalStatisticsCheck(
+        tmp_path / "points.las",
+        grid_pathname,
+        tvu_a=0.5,
+        tvu_b=0.013,
+        minimum_count=3,
+        minimum_percentage=70.0,
+        outdir=tmp_path / "outputs",
+    )
+    check.run()
+
+    # TVU at 20m is 0.565, at 100m 1.393; 1.96 * 2.0 (std) exceeds the former
+    assert check.total_nodes == 5
+    assert check.evaluated_nodes == 4
+    assert check.failed_nodes == 1
+    assert check.percentage_passed == pytest.approx(75.0)
+    assert check.passed
+    assert check.max_std == pytest.approx(2.0)
+    assert check.max_range == pytest.approx(4.0)
+    assert sum(c for _, c in check.histogram) == 4
+
+    out_pathname = (
+        tmp_path / "outputs" / "points" / check.name / "vertical-statistics.tif"
+    )
+    with rasterio.open(out_pathname) as src:
+        assert src.descriptions == vertical_statistics.STATISTICS
+        count, mean, std, minimum, maximum = src.read()
+
+    assert numpy.isnan(count[0, 0])
+    assert count.ravel()[1:].tolist() == [3, 3, 4, 3, 2]
+    assert mean[1, 0] == pytest.approx(-100.0)
+    assert std[0, 2] == pytest.approx(2.0)
+    assert minimum[0, 2] == pytest.approx(-22.0)
+    assert maximum[0, 2] == pytest.approx(-18.0)
+
+
+def test_vertical_statistics_check_not_evaluated(tmp_path):
+    """
+    A check that evaluates no nodes fails, rather than reporting all of
+    the (zero) evaluated nodes within the TVU.
+    """
+    grid_pathname = _write_grid(tmp_path)
+    # soundings falling beside the grid, as if in another CRS
+    write_points(tmp_path / "points.las", [500.5] * 5, [199.5] * 5, [-20.0] * 5)
+
+    check = VerticalStatisticsCheck(
+        tmp_path / "points.las", grid_pathname, minimum_count=3
+    )
+    check.run()
+
+    assert check.total_nodes == 5
+    assert check.evaluated_nodes == 0
+    assert check.percentage_passed is None
+    assert not check.passed
+
+
+def test_density_check_shares_vertical_statistics(tmp_path, monkeypatch):
+    """
+    A vertical statistics check sharing the inputs of a density check is
+    evaluated from the same single pass of the points as the density grid,
+    with the same results as when run on its own.
+    """
+    grid_pathname = _write_grid(tmp_path)
+    points_pathname = tmp_path / "points.las"
+    _write_soundings(points_pathname)
+
+    def vertical_check():
+        return VerticalStatisticsCheck(
+            points_pathname, grid_pathname, minimum_count=3
+        )
+
+    separate = vertical_check()
+    separate.run()
+
+    reads = []
+    read_points = numpy_density.read_points
+
+    def counted_read_points(pathname, *args, **kwargs):
+        reads.append(pathname)
+        return read_points(pathname, *args, **kwargs)
+
+    monkeypatch.setattr(numpy_density, "read_points", counted_read_points)
+
+    shared = vertical_check()
+    density_check = AlgorithmIndependentDensityCheck(
+        points_pathname,
+        grid_pathname,
+        minimum_count=3,
+        minimum_count_percentage=50.0,
+        engine="numpy",
+        vertical_check=shared,
+    )
+    density_check.run()
+
+    assert reads == [points_pathname]
+    assert density_check.total_nodes == 5
+    assert density_check.failed_nodes == 1
+    assert dict(density_check.histogram)[3] == 3
+    for name in (
+        "total_nodes", "evaluated_nodes", "failed_nodes", "passed", "histogram"
+    ):
+        assert getattr(shared, name) == getattr(separate, name)
+    assert shared.max_std == pytest.approx(separate.max_std)
+
+    with pytest.raises(errors.MbesPcError):
+        AlgorithmIndependentDensityCheck(
+            [points_pathname, points_pathname],
+            grid_pathname,
+            minimum_count=3,
+            minimum_count_percentage=50.0,
+            engine="numpy",
+            vertical_check=vertical_check(),
+        )
+
+    # the shared pass bins the points as the numpy engine does
+    with pytest.raises(errors.MbesPcError):
+        AlgorithmIndependentDensityCheck(
+            points_pathname,
+            grid_pathname,
+            minimum_count=3,
+            minimum_count_percentage=50.0,
+            engine="pdal",
+            vertical_check=vertical_check(),
+        )
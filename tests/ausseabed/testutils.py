@@ -5,30 +5,77 @@ Collection of utils used by test cases
 import laspy
 import numpy as np
 import osgeo
-import random
 import pyproj
 import pyproj.enums
+import rasterio
 
-from osgeo import gdal, osr
+from affine import Affine
+from osgeo import gdal, gdal_array, osr
 from pathlib import Path
+from rasterio.crs import CRS
+from typing import Any, Callable, Iterator, Optional, Sequence, Union
 
 gdal.UseExceptions()  # supresses GDAL 4.0 future warning
 
 
+# number of points generated, and written, at a time
+CHUNK_SIZE = 1_000_000
+
+# geometry of the small grids written by write_grid; 1m cells in UTM zone
+# 55S, with the top left corner at (100, 200)
+GRID_CRS = CRS.from_epsg(32755)
+GRID_TRANSFORM = Affine(1.0, 0.0, 100.0, 0.0, -1.0, 200.0)
+
+# a density array, or a function of the (row, col) cell indices returning
+# the expected density of those cells
+Densities = Union[list[list[int]], np.ndarray, Callable[[np.ndarray, np.ndarray], np.ndarray]]  # noqa: E501
+
+
+def _density_bands(
+    densities: Densities,
+    width: int,
+    height: int,
+    rows_per_band: int,
+    rng: np.random.Generator,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Yield (row offset, counts) for bands of rows of the density grid.
+    Arrays are taken as exact counts, whereas the counts of a density
+    function are drawn from a Poisson distribution of the expected density.
+    """
+    for row_off in range(0, height, rows_per_band):
+        n_rows = min(rows_per_band, height - row_off)
+        if callable(densities):
+            rows, cols = np.mgrid[row_off: row_off + n_rows, 0:width]
+            counts = rng.poisson(np.maximum(densities(rows, cols), 0))
+        else:
+            counts = np.asarray(densities[row_off: row_off + n_rows])
+
+        yield row_off, counts.astype(np.int64)
+
+
 class LasTestFileBuilder():
     """
-    Build a simple las file that randomly generates points to satisfy
-    a 2d point density array.
+    Build a las (or laz) file that randomly generates points to satisfy
+    a 2d point density array, or a density generating function.
+    Points are generated with NumPy and streamed to file in chunks, so
+    surveys of hundreds of millions of points can be built in bounded
+    memory.
     """
 
     def __init__(
         self,
-        densities: list[list[int]],
+        densities: Densities,
         top_left_x: float,
         top_left_y: float,
         resolution: float,
         crs: pyproj.CRS,
-        output_file: Path
+        output_file: Path,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        scale: float = 0.01,
+        chunk_size: int = CHUNK_SIZE,
+        seed: Optional[int] = None,
     ) -> None:
         self.densities = densities
         self.top_left_x = top_left_x
@@ -36,70 +83,106 @@ class LasTestFileBuilder():
         self.resolution = resolution
         self.crs = crs
         self.output_file = output_file
+        # grid dimensions; required when densities is a function
+        if callable(densities):
+            if width is None or height is None:
+                raise ValueError("width and height required for a density function")
+            self.width = width
+            self.height = height
+        else:
+            self.height = len(densities)
+            self.width = len(densities[0])
+        # coordinate precision of the stored points
+        self.scale = scale
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
 
-    def run(self):
-        x_coordinates:list[float] = []
-        y_coordinates:list[float] = []
-        z_coordinates:list[float] = []
-
-        x = self.top_left_x
-        y = self.top_left_y
-        for row in self.densities:
-            # loop through all the rows of the grid
-            for col in row:
-                # loop through all the columns of the grid
-                # each col value is the density count - the number
-                # of points we're going to generate in this cell
-                for pt_count in range(0, col):
-                    x_max = x + self.resolution
-                    y_min = y - self.resolution
-                    # currently the height information isn't particularly relevant
-                    # so just use a dummy value 
-                    pt_z = 2.3
-                    pt_x = random.uniform(x, x_max)
-                    pt_y = random.uniform(y_min, y)
+    def _header(self) -> laspy.LasHeader:
+        header = laspy.LasHeader(point_format=3, version="1.2")
+        header.add_crs(self.crs)
+        header.scales = np.array([self.scale, self.scale, self.scale])
+        # offset to the lower left of the grid so that coordinates are
+        # stored as small integers
+        header.offsets = np.array([
+            np.floor(self.top_left_x),
+            np.floor(self.top_left_y - self.height * self.resolution),
+            0.0,
+        ])
 
-                    x_coordinates.append(pt_x)
-                    y_coordinates.append(pt_y)
-                    z_coordinates.append(pt_z)
+        return header
 
-                x += self.resolution
+    def _chunks(self, row_off: int, counts: np.ndarray) -> Iterator[tuple[np.ndarray, np.ndarray]]:  # noqa: E501
+        """
+        Yield the x, y coordinates of the points of a band of cells, in
+        chunks of at most (approximately) `chunk_size` points.
+        """
+        flat = counts.ravel()
+        csum = np.cumsum(flat)
+        start = 0
+        done = 0
+        while start < flat.size:
+            end = int(np.searchsorted(csum, done + self.chunk_size, side="right"))
+            end = max(end, start + 1)
+            cells = np.repeat(np.arange(start, end), flat[start:end])
+            rows = row_off + cells // counts.shape[1]
+            cols = cells % counts.shape[1]
 
-            x = self.top_left_x
-            y -= self.resolution
+            # keep a margin of the coordinate precision from the cell edges
+            # so that rounding doesn't move points into a neighbouring cell
+            margin = min(self.scale, 0.25 * self.resolution)
+            extent = self.resolution - 2 * margin
+            x = self.top_left_x + cols * self.resolution + margin + self.rng.random(cells.size) * extent  # noqa: E501
+            y = self.top_left_y - rows * self.resolution - margin - self.rng.random(cells.size) * extent  # noqa: E501
 
-        x_np = np.array(x_coordinates, dtype=np.int32)
-        y_np = np.array(y_coordinates, dtype=np.int32)
-        z_np = np.array(z_coordinates, dtype=np.int32)
+            yield x, y
 
-        header = laspy.header.LasHeader()
-        header.add_crs(self.crs)
-        header.x_scale = 1.0
-        header.y_scale = 1.0
-        header.z_scale = 1.0
+            done = int(csum[end - 1])
+            start = end
 
-        las = laspy.create()
-        las.header = header
-        las.X = x_np
-        las.Y = y_np
-        las.Z = z_np
-        las.update_header()
-        las.write(str(self.output_file))
+    def run(self):
+        header = self._header()
+        rows_per_band = max(1, self.chunk_size // self.width)
+        bands = _density_bands(
+            self.densities, self.width, self.height, rows_per_band, self.rng
+        )
+
+        with laspy.open(str(self.output_file), mode="w", header=header) as writer:
+            for row_off, counts in bands:
+                for x, y in self._chunks(row_off, counts):
+                    if x.size == 0:
+                        continue
+                    points = laspy.ScaleAwarePointRecord.zeros(x.size, header=header)
+                    points.x = x
+                    points.y = y
+                    # currently the height information isn't particularly relevant
+                    # so just use a dummy value
+                    points.z = np.full(x.size, 2.3)
+                    writer.write_points(points)
 
 
 class TifTestFileBuilder():
     """
-    Build a simple tif file that includes the values given in a 2d array
+    Build a tif file that includes the values given in a 2d array, or
+    generated by a function of the (row, col) cell indices.
+    Large grids are written tiled, block by block, and may include
+    randomly placed circular nodata holes.
     """
 
     def __init__(
         self,
-        values: list[list[int]],
+        values: Union[list[list[int]], np.ndarray, Callable[[np.ndarray, np.ndarray], np.ndarray]],  # noqa: E501
         top_left_x: float,
         top_left_y: float,
         resolution: float,
         crs: pyproj.CRS,
-        output_file: Path
+        output_file: Path,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        data_type: int = gdal.GDT_Int16,
+        tiled: bool = False,
+        nodata_holes: int = 0,
+        hole_radius: float = 10.0,
+        seed: Optional[int] = None,
     ) -> None:
         self.values = values
         self.top_left_x = top_left_x
@@ -107,29 +190,100 @@ class TifTestFileBuilder():
         self.resolution = resolution
         self.crs = crs
         self.output_file = output_file
+        # grid dimensions; required when values is a function
+        if callable(values):
+            if width is None or height is None:
+                raise ValueError("width and height required for a value function")
+            self.width = width
+            self.height = height
+        else:
+            self.height = len(values)
+            self.width = len(values[0])
+        self.data_type = data_type
+        # write a tiled, compressed tif (256x256 blocks)
+        self.tiled = tiled
+        # number and radius (cells) of randomly placed nodata holes
+        self.nodata_holes = nodata_holes
+        self.hole_radius = hole_radius
+        self.rng = np.random.default_rng(seed)
 
         # optional band name used to set the description field in tif metadata
         self.band_name = None
 
+    def _blocks(self) -> Iterator[tuple[int, int, int, int]]:
+        """Yield the (xoff, yoff, xsize, ysize) of each block to write."""
+        size = 1024 if self.tiled else max(self.width, self.height)
+        for yoff in range(0, self.height, size):
+            for xoff in range(0, self.width, size):
+                yield (
+                    xoff,
+                    yoff,
+                    min(size, self.width - xoff),
+                    min(size, self.height - yoff),
+                )
+
+    def _holes(self, rows: np.ndarray, cols: np.ndarray, centres: np.ndarray) -> np.ndarray:  # noqa: E501
+        """Boolean mask of the cells within any of the nodata holes."""
+        mask = np.zeros(rows.shape, dtype=bool)
+        for row, col in centres:
+            mask |= (rows - row) ** 2 + (cols - col) ** 2 <= self.hole_radius ** 2
+
+        return mask
+
     def run(self):
         """
         Run the process to build the test geotiff
         """
+        options = []
+        if self.tiled:
+            options = [
+                "TILED=YES",
+                "BLOCKXSIZE=256",
+                "BLOCKYSIZE=256",
+                "COMPRESS=DEFLATE",
+                "BIGTIFF=IF_SAFER",
+            ]
+
         driver = gdal.GetDriverByName("GTiff")
         dst_ds = driver.Create(
             str(self.output_file),
-            len(self.values[0]),
-            len(self.values),
+            self.width,
+            self.height,
             1,
-            gdal.GDT_Int16
+            self.data_type,
+            options=options,
         )
-        np_2d_array = np.array(self.values, dtype=np.int16)
-        
-        dst_ds.GetRasterBand(1).WriteArray(np_2d_array)
-        dst_ds.GetRasterBand(1).SetNoDataValue(-9999)
+        band = dst_ds.GetRasterBand(1)
+        band.SetNoDataValue(-9999)
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(self.data_type)
+
+        centres = np.column_stack([
+            self.rng.uniform(0, self.height, self.nodata_holes),
+            self.rng.uniform(0, self.width, self.nodata_holes),
+        ])
+
+        values = None if callable(self.values) else np.asarray(self.values, dtype=dtype)
+
+        for xoff, yoff, xsize, ysize in self._blocks():
+            rows, cols = np.mgrid[yoff: yoff + ysize, xoff: xoff + xsize]
+            if values is None:
+                data = np.asarray(self.values(rows, cols), dtype=dtype)
+            else:
+                data = values[yoff: yoff + ysize, xoff: xoff + xsize].copy()
+
+            # only the holes near the block need testing
+            near = (
+                (centres[:, 0] >= yoff - self.hole_radius)
+                & (centres[:, 0] < yoff + ysize + self.hole_radius)
+                & (centres[:, 1] >= xoff - self.hole_radius)
+                & (centres[:, 1] < xoff + xsize + self.hole_radius)
+            )
+            data[self._holes(rows, cols, centres[near])] = -9999
+
+            band.WriteArray(data, xoff, yoff)
 
         if self.band_name:
-            dst_ds.GetRasterBand(1).SetDescription(self.band_name)
+            band.SetDescription(self.band_name)
 
         # top left x, w-e pixel resolution, rotation, top left y, rotation, n-s pixel resolution
         dst_ds.SetGeoTransform([
@@ -181,3 +335,54 @@ def build_las_and_tif_densities(
         output_file=tif_file
     )
     tb.run()
+
+
+def write_grid(
+        pathname: Path,
+        data: np.ndarray,
+        nodata: Optional[float] = -9999,
+        **creation_options: Any
+    ) -> Path:
+    """
+    Write a small single band GeoTIFF of the data array, with the grid
+    geometry given by GRID_CRS and GRID_TRANSFORM. The creation options
+    (e.g. tiled, blockxsize) are passed to rasterio.
+    """
+    height, width = data.shape
+    kwargs = {
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": data.dtype.name,
+        "crs": GRID_CRS,
+        "transform": GRID_TRANSFORM,
+        "driver": "GTiff",
+        "nodata": nodata,
+        **creation_options,
+    }
+    with rasterio.open(pathname, "w", **kwargs) as outds:
+        outds.write(data, 1)
+
+    return pathname
+
+
+def write_points(
+        pathname: Path,
+        x: Sequence[float],
+        y: Sequence[float],
+        z: Optional[Sequence[float]] = None
+    ) -> Path:
+    """
+    Write the points to a LAS 1.2 file, with coordinates scaled to the
+    centimetre. The depths default to zero.
+    """
+    header = laspy.LasHeader(point_format=0, version="1.2")
+    header.scales = [0.01, 0.01, 0.01]
+    header.offsets = [0.0, 0.0, 0.0]
+    las = laspy.LasData(header)
+    las.x = np.asarray(x)
+    las.y = np.asarray(y)
+    las.z = np.zeros(len(x)) if z is None else np.asarray(z)
+    las.write(pathname)
+
+    return pathname